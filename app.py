@@ -1,19 +1,1228 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request
 from flask_cors import CORS
-import yt_dlp
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
+from werkzeug.exceptions import HTTPException
+import requests
 import re
 import json
+import os
+import gzip
+import time
+import hashlib
+import threading
+import queue
+import html
+import math
+import unicodedata
+import codecs
+import zlib
+import base64
+import sqlite3
+import logging
+import contextvars
+import uuid
+import random
+import xml.etree.ElementTree as ET
+from array import array
+from bisect import bisect_left
+from urllib.parse import parse_qs, urlencode, urlparse
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin coordinación entre workers
+    fcntl = None
+
+try:
+    import brotli
+except ImportError:  # sin brotli solo se ofrece gzip
+    brotli = None
+
+# Serialización compacta para los almacenes compartidos; sin estas librerías se usa json + zlib
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import redis
+except ImportError:  # CACHE_BACKEND=redis no disponible
+    redis = None
 
 app = Flask(__name__)
 CORS(app)
 
-def obtener_subtitulos_directo(video_id):
-    """Obtiene subtítulos directamente sin usar yt-dlp"""
-    import requests
-    import xml.etree.ElementTree as ET
+# Logging estructurado: nivel con LOG_LEVEL, formato 'texto' o 'json' con LOG_FORMATO
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMATO = os.environ.get('LOG_FORMATO', 'texto')
+
+# Trace id de la petición en curso; se propaga a los hilos de proveedores y lotes
+trace_id_actual = contextvars.ContextVar('trace_id', default='-')
+
+
+class _FiltroTrace(logging.Filter):
+    """Agrega el trace id de la petición en curso a cada registro emitido"""
+
+    def filter(self, record):
+        record.trace_id = trace_id_actual.get()
+        return True
+
+
+class FormateadorJSON(logging.Formatter):
+    """Una línea JSON por registro; los campos extra van en extra={'campos': {...}}"""
+
+    def format(self, record):
+        datos = {
+            'ts': round(record.created, 3),
+            'nivel': record.levelname,
+            'mensaje': record.getMessage(),
+            'trace_id': getattr(record, 'trace_id', '-'),
+        }
+        datos.update(getattr(record, 'campos', {}))
+        if record.exc_info:
+            datos['excepcion'] = self.formatException(record.exc_info)
+        return json.dumps(datos, ensure_ascii=False, default=str)
+
+
+def configurar_logging():
+    manejador = logging.StreamHandler()
+    manejador.addFilter(_FiltroTrace())
+    if LOG_FORMATO == 'json':
+        manejador.setFormatter(FormateadorJSON())
+    else:
+        manejador.setFormatter(logging.Formatter('%(asctime)s %(levelname)s [%(trace_id)s] %(message)s'))
+    logger = logging.getLogger('transcripciones')
+    logger.handlers[:] = [manejador]
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+    return logger
+
+
+log = configurar_logging()
+
+
+def enviar_con_contexto(ejecutor, funcion, *args):
+    """submit() conservando los contextvars (trace id) de quien encola la tarea"""
+    contexto = contextvars.copy_context()
+    return ejecutor.submit(contexto.run, funcion, *args)
+
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BUCKETS_BYTES = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+def _etiquetas_prometheus(etiquetas):
+    if not etiquetas:
+        return ''
+    partes = []
+    for nombre, valor in etiquetas:
+        valor = str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        partes.append(f'{nombre}="{valor}"')
+    return '{' + ','.join(partes) + '}'
+
+
+class Metricas:
+    """Registro mínimo de contadores e histogramas en formato de texto de Prometheus"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._definiciones = {}  # nombre -> (tipo, ayuda, buckets)
+        self._series = {}  # nombre -> {etiquetas: valor | [conteos por bucket..., suma, cantidad]}
+        self._recolectores = []  # funciones que calculan métricas al exportar
+
+    def contador(self, nombre, ayuda):
+        self._definiciones[nombre] = ('counter', ayuda, None)
+        self._series[nombre] = {}
+
+    def histograma(self, nombre, ayuda, buckets=BUCKETS_SEGUNDOS):
+        self._definiciones[nombre] = ('histogram', ayuda, buckets)
+        self._series[nombre] = {}
+
+    def recolector(self, funcion):
+        """funcion() devuelve [(nombre, tipo, ayuda, [(etiquetas, valor), ...]), ...]"""
+        self._recolectores.append(funcion)
+        return funcion
+
+    def incrementar(self, nombre, valor=1, **etiquetas):
+        clave = tuple(sorted(etiquetas.items()))
+        with self._lock:
+            series = self._series[nombre]
+            series[clave] = series.get(clave, 0) + valor
+
+    def observar(self, nombre, valor, **etiquetas):
+        buckets = self._definiciones[nombre][2]
+        clave = tuple(sorted(etiquetas.items()))
+        with self._lock:
+            serie = self._series[nombre].get(clave)
+            if serie is None:
+                serie = self._series[nombre][clave] = [0] * len(buckets) + [0.0, 0]
+            indice = bisect_left(buckets, valor)
+            if indice < len(buckets):
+                serie[indice] += 1
+            serie[-2] += valor
+            serie[-1] += 1
+
+    def exportar(self):
+        lineas = []
+        with self._lock:
+            copia = {nombre: {k: (list(v) if isinstance(v, list) else v) for k, v in series.items()}
+                     for nombre, series in self._series.items()}
+
+        for nombre, (tipo, ayuda, buckets) in self._definiciones.items():
+            lineas.append(f'# HELP {nombre} {ayuda}')
+            lineas.append(f'# TYPE {nombre} {tipo}')
+            for clave, valor in copia[nombre].items():
+                if tipo == 'counter':
+                    lineas.append(f'{nombre}{_etiquetas_prometheus(clave)} {valor}')
+                    continue
+                acumulado = 0
+                for limite, cantidad in zip(buckets, valor):
+                    acumulado += cantidad
+                    lineas.append(f'{nombre}_bucket{_etiquetas_prometheus(clave + (("le", limite),))} {acumulado}')
+                lineas.append(f'{nombre}_bucket{_etiquetas_prometheus(clave + (("le", "+Inf"),))} {valor[-1]}')
+                lineas.append(f'{nombre}_sum{_etiquetas_prometheus(clave)} {valor[-2]}')
+                lineas.append(f'{nombre}_count{_etiquetas_prometheus(clave)} {valor[-1]}')
+
+        for recolector in self._recolectores:
+            for nombre, tipo, ayuda, muestras in recolector():
+                lineas.append(f'# HELP {nombre} {ayuda}')
+                lineas.append(f'# TYPE {nombre} {tipo}')
+                for etiquetas, valor in muestras:
+                    lineas.append(f'{nombre}{_etiquetas_prometheus(tuple(sorted(etiquetas.items())))} {valor}')
+
+        return '\n'.join(lineas) + '\n'
+
+
+metricas = Metricas()
+metricas.contador('transcripciones_peticiones_total', 'Peticiones HTTP por endpoint y status')
+metricas.histograma('transcripciones_peticion_duracion_segundos', 'Duración de las peticiones HTTP por endpoint')
+metricas.contador('transcripciones_proveedor_resultados_total',
+                  'Resultados por proveedor (exito, sin_resultado, bloqueado, error, cancelado, limitado, circuito_abierto)')
+metricas.histograma('transcripciones_proveedor_duracion_segundos', 'Latencia de cada proveedor')
+metricas.histograma('transcripciones_limitador_espera_segundos', 'Espera por un token del limitador de cada proveedor')
+metricas.histograma('transcripciones_descarga_bytes', 'Tamaño de los subtítulos descargados por formato', BUCKETS_BYTES)
+metricas.histograma('transcripciones_parseo_duracion_segundos', 'Tiempo de CPU de parseo por formato (sin esperar la red)')
+metricas.histograma('transcripciones_ytdlp_extraccion_segundos', 'Duración de extract_info de yt-dlp')
+
+# Configuración de la cache de transcripciones
+# Preferencia de idiomas por defecto, separados por comas (parámetro lang)
+IDIOMA_POR_DEFECTO = os.environ.get('IDIOMA_POR_DEFECTO', 'es')
+IDIOMAS_MAX = int(os.environ.get('IDIOMAS_MAX', 10))
+PATRON_IDIOMA = re.compile(r'^[A-Za-z]{2,3}(-[A-Za-z0-9]{2,8})*$')
+CACHE_TTL = int(os.environ.get('CACHE_TTL', 6 * 3600))
+CACHE_TTL_NEGATIVO = int(os.environ.get('CACHE_TTL_NEGATIVO', 15 * 60))
+CACHE_MAX_ENTRADAS = int(os.environ.get('CACHE_MAX_ENTRADAS', 1000))
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memoria')
+CACHE_DIR = os.environ.get('CACHE_DIR', '/tmp/cache_transcripciones')
+# Backends compartidos entre workers: sqlite (un host) y redis (varios nodos)
+CACHE_SQLITE = os.environ.get('CACHE_SQLITE', os.path.join(CACHE_DIR, 'cache.sqlite3'))
+CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES', 512 * 1024 * 1024))
+CACHE_DIR_MAX_ARCHIVOS = int(os.environ.get('CACHE_DIR_MAX_ARCHIVOS', 100000))
+# Índice de pistas por video (idiomas, nombres y formatos disponibles)
+INDICE_TTL = int(os.environ.get('INDICE_TTL', 6 * 3600))
+INDICE_MARGEN_URL = 300  # segundos de margen antes de que expiren las URLs firmadas
+# Directorio de archivos de bloqueo para coordinar workers (vacío = solo hilos)
+SINGLEFLIGHT_LOCK_DIR = os.environ.get('SINGLEFLIGHT_LOCK_DIR', '')
+
+# Lotes (/transcripts) y concurrencia máxima por proveedor upstream
+BATCH_MAX_VIDEOS = int(os.environ.get('BATCH_MAX_VIDEOS', 500))
+BATCH_MAX_HILOS = int(os.environ.get('BATCH_MAX_HILOS', 16))
+CONCURRENCIA_PROVEEDOR = {
+    'timedtext': int(os.environ.get('LIMITE_TIMEDTEXT', 16)),
+    'rapidapi': int(os.environ.get('LIMITE_RAPIDAPI', 8)),
+    'ytdlp': int(os.environ.get('LIMITE_YTDLP', 4)),
+}
+LIMITES_PROVEEDOR = {nombre: threading.BoundedSemaphore(n) for nombre, n in CONCURRENCIA_PROVEEDOR.items()}
+
+# Pool compartido por todos los lotes para acotar los hilos del worker
+ejecutor_lotes = ThreadPoolExecutor(max_workers=BATCH_MAX_HILOS, thread_name_prefix='lote')
+
+# Formatos de /transcript: texto plano (por defecto), segmentos con tiempos, SRT o VTT
+FORMATOS_RESPUESTA = ('text', 'segments', 'srt', 'vtt')
+
+# Estrategia de proveedores: secuencial (uno tras otro), hedged (el siguiente
+# arranca si el anterior no respondió tras ESTRATEGIA_HEDGE segundos) o paralelo
+MODOS_ESTRATEGIA = ('secuencial', 'hedged', 'paralelo')
+ESTRATEGIA_MODO = os.environ.get('ESTRATEGIA_MODO', 'secuencial')
+ESTRATEGIA_ORDEN = os.environ.get('ESTRATEGIA_ORDEN', '')  # vacío = todos en orden de registro
+ESTRATEGIA_HEDGE = os.environ.get('ESTRATEGIA_HEDGE', '3')  # segundos, uno por proveedor separados por comas
+ESTRATEGIA_DEADLINE = float(os.environ.get('ESTRATEGIA_DEADLINE', 90))
+PROVEEDORES_MAX_HILOS = int(os.environ.get('PROVEEDORES_MAX_HILOS', 32))
+
+# Limitador adaptativo por proveedor (peticiones/s por worker y ráfaga; 0 = sin límite)
+TASAS_PROVEEDOR = {
+    'timedtext': (float(os.environ.get('TASA_TIMEDTEXT', 20)), float(os.environ.get('RAFAGA_TIMEDTEXT', 40))),
+    'rapidapi': (float(os.environ.get('TASA_RAPIDAPI', 5)), float(os.environ.get('RAFAGA_RAPIDAPI', 10))),
+    'ytdlp': (float(os.environ.get('TASA_YTDLP', 4)), float(os.environ.get('RAFAGA_YTDLP', 8))),
+}
+# Lo más que una petición espera un token antes de pasar al siguiente proveedor de la cadena
+TASA_ESPERA_MAX = float(os.environ.get('TASA_ESPERA_MAX', 1))
+# Tiempo límite propio y reintentos por proveedor: (segundos, reintentos ante errores de red, espera base del backoff)
+POLITICAS_PROVEEDOR = {
+    'timedtext': (float(os.environ.get('TIMEOUT_TIMEDTEXT', 15)), int(os.environ.get('REINTENTOS_TIMEDTEXT', 1)),
+                  float(os.environ.get('ESPERA_TIMEDTEXT', 0.5))),
+    'rapidapi': (float(os.environ.get('TIMEOUT_RAPIDAPI', 35)), int(os.environ.get('REINTENTOS_RAPIDAPI', 1)),
+                 float(os.environ.get('ESPERA_RAPIDAPI', 1))),
+    'ytdlp': (float(os.environ.get('TIMEOUT_YTDLP', 60)), int(os.environ.get('REINTENTOS_YTDLP', 0)),
+              float(os.environ.get('ESPERA_YTDLP', 1))),
+    'whisper': (float(os.environ.get('TIMEOUT_WHISPER', 5)), 0, 0.5),
+}
+# Directorio con transcripciones locales (salida de Whisper); si está definido se prueba primero
+WHISPER_DIR = os.environ.get('WHISPER_DIR', '')
+# Circuit breaker: fallos seguidos para abrir y enfriamiento (se duplica en cada sonda fallida)
+INTERRUPTOR_UMBRAL = int(os.environ.get('INTERRUPTOR_UMBRAL', 5))
+INTERRUPTOR_ENFRIAMIENTO = float(os.environ.get('INTERRUPTOR_ENFRIAMIENTO', 30))
+INTERRUPTOR_ENFRIAMIENTO_MAX = float(os.environ.get('INTERRUPTOR_ENFRIAMIENTO_MAX', 600))
+# Si está definido, /admin y /prefetch exigen la cabecera X-Admin-Token; sin él, las rutas que cambian
+# estado o gastan cuota upstream (reset, /prefetch) quedan deshabilitadas
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+# Refresco en segundo plano de videos populares y precarga (/prefetch)
+REFRESCO_ACTIVO = os.environ.get('REFRESCO_ACTIVO', '1') == '1'
+REFRESCO_MARGEN = float(os.environ.get('REFRESCO_MARGEN', 0.2))  # fracción final del TTL en la que se refresca
+REFRESCO_MIN_PUNTAJE = float(os.environ.get('REFRESCO_MIN_PUNTAJE', 3))  # peticiones recientes para ser popular
+REFRESCO_VIDA_MEDIA = float(os.environ.get('REFRESCO_VIDA_MEDIA', 3600))  # segundos en que el puntaje cae a la mitad
+REFRESCO_HILOS = int(os.environ.get('REFRESCO_HILOS', 2))
+REFRESCO_MAX_PENDIENTES = int(os.environ.get('REFRESCO_MAX_PENDIENTES', 1000))
+TASA_REFRESCO = float(os.environ.get('TASA_REFRESCO', 1))
+RAFAGA_REFRESCO = float(os.environ.get('RAFAGA_REFRESCO', 5))
+# Búsqueda sobre las transcripciones ya obtenidas por el worker (/search; 0 = desactivada)
+BUSQUEDA_MAX_VIDEOS = int(os.environ.get('BUSQUEDA_MAX_VIDEOS', CACHE_MAX_ENTRADAS))
+BUSQUEDA_MAX_RESULTADOS = int(os.environ.get('BUSQUEDA_MAX_RESULTADOS', 200))
+# Compresión de respuestas negociada con Accept-Encoding
+COMPRESION_MIN_BYTES = int(os.environ.get('COMPRESION_MIN_BYTES', 1024))
+COMPRESION_NIVEL_GZIP = int(os.environ.get('COMPRESION_NIVEL_GZIP', 6))
+COMPRESION_CALIDAD_BROTLI = int(os.environ.get('COMPRESION_CALIDAD_BROTLI', 5))
+TIPOS_COMPRIMIBLES = ('application/json', 'application/x-ndjson', 'application/x-subrip', 'text/')
+
+ejecutor_proveedores = ThreadPoolExecutor(max_workers=PROVEEDORES_MAX_HILOS, thread_name_prefix='proveedor')
+# Pools propios para el refresco (estrategia y proveedores): nunca ocupa hilos de las peticiones en vivo
+ejecutor_refresco = ThreadPoolExecutor(max_workers=REFRESCO_HILOS, thread_name_prefix='refresco')
+ejecutor_proveedores_refresco = ThreadPoolExecutor(max_workers=REFRESCO_HILOS * 2, thread_name_prefix='refresco-proveedor')
+# Indexado para /search fuera de la petición (y del event loop en modo ASGI)
+ejecutor_indice = ThreadPoolExecutor(max_workers=1, thread_name_prefix='indice')
+
+
+def _reiniciar_ejecutores():
+    """Los hilos no sobreviven a un fork: cada worker crea sus propios pools"""
+    global ejecutor_lotes, ejecutor_proveedores, ejecutor_refresco, ejecutor_proveedores_refresco, ejecutor_indice
+    ejecutor_lotes = ThreadPoolExecutor(max_workers=BATCH_MAX_HILOS, thread_name_prefix='lote')
+    ejecutor_proveedores = ThreadPoolExecutor(max_workers=PROVEEDORES_MAX_HILOS, thread_name_prefix='proveedor')
+    ejecutor_refresco = ThreadPoolExecutor(max_workers=REFRESCO_HILOS, thread_name_prefix='refresco')
+    ejecutor_proveedores_refresco = ThreadPoolExecutor(max_workers=REFRESCO_HILOS * 2,
+                                                       thread_name_prefix='refresco-proveedor')
+    ejecutor_indice = ThreadPoolExecutor(max_workers=1, thread_name_prefix='indice')
+
+
+# Con gunicorn --preload el módulo se importa en el master y luego se hace fork
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reiniciar_ejecutores)
+
+# yt-dlp: instancias YoutubeDL reutilizables por worker y extracción solo de subtítulos
+YTDLP_POOL = int(os.environ.get('YTDLP_POOL', 2))
+YTDLP_SOLO_SUBTITULOS = os.environ.get('YTDLP_SOLO_SUBTITULOS', '1') == '1'
+YTDLP_OPCIONES = {
+    'skip_download': True,
+    'writesubtitles': True,
+    'writeautomaticsub': True,
+    'quiet': True,
+    'no_warnings': True,
+    'extractor_args': {
+        'youtube': {
+            'player_client': ['android', 'web'],
+            'skip': ['hls', 'dash']
+        }
+    }
+}
+
+# Endpoints upstream (configurables para apuntar a un servidor local en benchmarks)
+TIMEDTEXT_URL = os.environ.get('TIMEDTEXT_URL', 'https://www.youtube.com/api/timedtext')
+RAPIDAPI_URL = os.environ.get('RAPIDAPI_URL', 'https://youtube-transcript3.p.rapidapi.com/api/transcript')
+
+# Pool de conexiones HTTP: hosts distintos y conexiones keep-alive por host
+HTTP_POOL_HOSTS = int(os.environ.get('HTTP_POOL_HOSTS', 10))
+HTTP_POOL_POR_HOST = int(os.environ.get('HTTP_POOL_POR_HOST', 32))
+# Si está activo, al agotar el pool de un host se espera en vez de abrir conexiones extra
+HTTP_POOL_BLOQUEANTE = os.environ.get('HTTP_POOL_BLOQUEANTE', '0') == '1'
+
+_sesion_http = None
+_sesion_http_pid = None
+_sesion_http_lock = threading.Lock()
+
+
+def obtener_sesion_http():
+    """Sesión requests compartida con keep-alive; se recrea en cada proceso hijo tras un fork"""
+    global _sesion_http, _sesion_http_pid
+    pid = os.getpid()
+    if _sesion_http is None or _sesion_http_pid != pid:
+        with _sesion_http_lock:
+            if _sesion_http is None or _sesion_http_pid != pid:
+                sesion = requests.Session()
+                adaptador = HTTPAdapter(
+                    pool_connections=HTTP_POOL_HOSTS,
+                    pool_maxsize=HTTP_POOL_POR_HOST,
+                    pool_block=HTTP_POOL_BLOQUEANTE
+                )
+                sesion.mount('https://', adaptador)
+                sesion.mount('http://', adaptador)
+                _sesion_http = sesion
+                _sesion_http_pid = pid
+    return _sesion_http
+
+
+def http_get(url, **kwargs):
+    """GET a través del pool compartido; todas las estrategias usan esta función"""
+    return obtener_sesion_http().get(url, **kwargs)
+
+def tiempo_restante(limite):
+    """Timeout para la próxima llamada de un proveedor que debe terminar antes de limite (time.monotonic())"""
+    restante = limite - time.monotonic()
+    if restante <= 0:
+        raise requests.Timeout('Sin tiempo restante para el proveedor')
+    return restante
+
+
+class EstadisticasTiempos:
+    """Acumula cantidad, total y máximo de duración por fase"""
+
+    def __init__(self):
+        self._fases = {}
+        self._lock = threading.Lock()
+
+    def registrar(self, fase, segundos):
+        with self._lock:
+            datos = self._fases.setdefault(fase, {'cantidad': 0, 'total': 0.0, 'maximo': 0.0})
+            datos['cantidad'] += 1
+            datos['total'] += segundos
+            datos['maximo'] = max(datos['maximo'], segundos)
+
+    @contextmanager
+    def medir(self, fase):
+        inicio = time.monotonic()
+        try:
+            yield
+        finally:
+            self.registrar(fase, time.monotonic() - inicio)
+
+    def resumen(self):
+        with self._lock:
+            return {
+                fase: {
+                    'cantidad': datos['cantidad'],
+                    'promedio_ms': round(datos['total'] / datos['cantidad'] * 1000, 1),
+                    'maximo_ms': round(datos['maximo'] * 1000, 1),
+                }
+                for fase, datos in self._fases.items()
+            }
+
+
+class PoolYoutubeDL:
+    """Instancias YoutubeDL de larga vida por worker
+    
+    Reutilizar la instancia mantiene calientes los extractores y sus caches
+    (player JS, funciones de firma) entre peticiones.
+    """
+
+    def __init__(self, opciones, tamaño):
+        self.opciones = opciones
+        self.tamaño = max(1, tamaño)
+        self._libres = queue.LifoQueue()  # LIFO: reutiliza la instancia más caliente
+        self._creadas = 0
+        self._lock = threading.Lock()
+        self.tiempos = EstadisticasTiempos()
+
+    @contextmanager
+    def instancia(self):
+        with self.tiempos.medir('espera_pool'):
+            try:
+                ydl = self._libres.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    crear = self._creadas < self.tamaño
+                    if crear:
+                        self._creadas += 1
+                if crear:
+                    with self.tiempos.medir('creacion'):
+                        ydl = cargar_yt_dlp().YoutubeDL(self.opciones)
+                else:
+                    ydl = self._libres.get()
+        try:
+            yield ydl
+        finally:
+            self._libres.put(ydl)
+
+    def resumen(self):
+        return {
+            'tamaño': self.tamaño,
+            'creadas': self._creadas,
+            'libres': self._libres.qsize(),
+            'solo_subtitulos': YTDLP_SOLO_SUBTITULOS,
+            'tiempos': self.tiempos.resumen(),
+        }
+
+
+# yt-dlp es la dependencia más pesada: se importa en la primera petición que la necesita
+yt_dlp = None
+_yt_dlp_lock = threading.Lock()
+
+
+def cargar_yt_dlp():
+    """Importa yt-dlp una sola vez; con gunicorn --preload puede llamarse en el master"""
+    global yt_dlp
+    if yt_dlp is None:
+        with _yt_dlp_lock:
+            if yt_dlp is None:
+                inicio = time.monotonic()
+                import yt_dlp as modulo
+                yt_dlp = modulo
+                log.info('yt-dlp importado en %.0f ms', (time.monotonic() - inicio) * 1000)
+    return yt_dlp
+
+
+_pool_ytdlp = None
+_pool_ytdlp_pid = None
+_pool_ytdlp_lock = threading.Lock()
+
+
+def obtener_pool_ytdlp():
+    """Pool de yt-dlp del proceso actual (se recrea tras un fork)"""
+    global _pool_ytdlp, _pool_ytdlp_pid
+    pid = os.getpid()
+    if _pool_ytdlp is None or _pool_ytdlp_pid != pid:
+        with _pool_ytdlp_lock:
+            if _pool_ytdlp is None or _pool_ytdlp_pid != pid:
+                _pool_ytdlp = PoolYoutubeDL(YTDLP_OPCIONES, YTDLP_POOL)
+                _pool_ytdlp_pid = pid
+    return _pool_ytdlp
+
+
+def extraer_info_subtitulos(video_id):
+    """Extrae la información del video necesaria para descubrir pistas de subtítulos
+    
+    Con YTDLP_SOLO_SUBTITULOS se usa process=False: se omite la selección y
+    ordenamiento de formatos, que no hace falta para listar subtítulos.
+    """
+    url = f"https://www.youtube.com/watch?v={video_id}"
+    pool = obtener_pool_ytdlp()
+    
+    with LIMITES_PROVEEDOR['ytdlp'], pool.instancia() as ydl:
+        inicio = time.monotonic()
+        info = ydl.extract_info(url, download=False, process=not YTDLP_SOLO_SUBTITULOS)
+        duracion = time.monotonic() - inicio
+    
+    pool.tiempos.registrar('extraccion', duracion)
+    metricas.observar('transcripciones_ytdlp_extraccion_segundos', duracion)
+    log.info('yt-dlp extrajo %s en %.0f ms', video_id, duracion * 1000,
+             extra={'campos': {'video_id': video_id, 'duracion_ms': round(duracion * 1000)}})
+    return info
+
+
+class AlmacenDirectorio:
+    """Almacén en disco: un archivo JSON comprimido con gzip por clave, con tamaño total acotado
+
+    El mtime de cada archivo es su vencimiento y el atime su último uso, así la
+    limpieza decide con stat() sin abrir los archivos. Se limpia cuando lo escrito
+    por este proceso supera max_bytes o max_archivos, y cada LIMPIAR_CADA segundos
+    por las entradas vencidas y lo que escriban otros workers.
+    """
+
+    LIMPIAR_CADA = 300  # segundos entre limpiezas aunque no se llegue a los límites
+    USO_RESOLUCION = 60  # segundos: el atime de un archivo se actualiza a lo sumo una vez por intervalo
+
+    def __init__(self, ruta=CACHE_DIR, max_bytes=CACHE_MAX_BYTES, max_archivos=CACHE_DIR_MAX_ARCHIVOS):
+        self.ruta = ruta
+        self.max_bytes = max_bytes
+        self.max_archivos = max_archivos
+        self._lock = threading.Lock()
+        self._limpiando = threading.Lock()
+        # Estimación desde la última limpieza; la primera escritura limpia el directorio
+        self._bytes = 0
+        self._archivos = 0
+        self._proxima_limpieza = 0
+        os.makedirs(ruta, exist_ok=True)
+
+    def _archivo(self, clave):
+        nombre = hashlib.sha1(clave.encode('utf-8')).hexdigest()
+        return os.path.join(self.ruta, nombre + '.json.gz')
+
+    def leer(self, clave):
+        """Devuelve (expira, valor) o None si no existe o está corrupto"""
+        archivo = self._archivo(clave)
+        try:
+            with gzip.open(archivo, 'rt', encoding='utf-8') as f:
+                datos = json.load(f)
+            expira, valor = datos['expira'], datos['valor']
+        except (OSError, ValueError, KeyError):
+            return None
+        self._marcar_uso(archivo, expira)
+        return expira, valor
+
+    def _marcar_uso(self, archivo, expira):
+        """Actualiza el atime si quedó viejo (con noatime el sistema no lo hace solo)"""
+        ahora = time.time()
+        try:
+            if ahora - os.stat(archivo).st_atime >= self.USO_RESOLUCION:
+                os.utime(archivo, (ahora, expira))
+        except OSError:
+            pass
+
+    def escribir(self, clave, expira, valor):
+        archivo = self._archivo(clave)
+        temporal = f"{archivo}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with gzip.open(temporal, 'wt', encoding='utf-8') as f:
+                json.dump({'expira': expira, 'valor': valor}, f, ensure_ascii=False)
+            os.utime(temporal, (time.time(), expira))
+            tamaño = os.path.getsize(temporal)
+            # Reemplazo atómico para que otros workers nunca lean un archivo a medias
+            os.replace(temporal, archivo)
+        except OSError as e:
+            log.warning('No se pudo escribir la cache en disco: %s', e)
+            return
+        with self._lock:
+            # Reescribir una clave también suma: la estimación solo puede pecar de adelantar la limpieza
+            self._bytes += tamaño
+            self._archivos += 1
+            limpiar = (self._bytes > self.max_bytes or self._archivos > self.max_archivos
+                       or time.time() >= self._proxima_limpieza)
+        if limpiar:
+            self.acotar()
+
+    def borrar(self, clave):
+        try:
+            os.remove(self._archivo(clave))
+        except OSError:
+            pass
+
+    def acotar(self):
+        """Borra los archivos vencidos y luego los menos usados hasta entrar en max_bytes y max_archivos"""
+        if not self._limpiando.acquire(blocking=False):
+            return 0  # ya limpia otro hilo
+        try:
+            ahora = time.time()
+            vigentes = []
+            for entrada in os.scandir(self.ruta):
+                try:
+                    estado = entrada.stat()
+                    if entrada.name.endswith('.json.gz'):
+                        if estado.st_mtime <= ahora:
+                            os.remove(entrada.path)
+                        else:
+                            vigentes.append((estado.st_atime, estado.st_size, entrada.path))
+                    elif entrada.name.endswith('.tmp') and estado.st_mtime < ahora - self.LIMPIAR_CADA:
+                        os.remove(entrada.path)  # restos de escrituras interrumpidas
+                except OSError:
+                    continue
+            total = sum(tamaño for _, tamaño, _ in vigentes)
+            expulsados = 0
+            if total > self.max_bytes or len(vigentes) > self.max_archivos:
+                exceso_bytes = total - self.max_bytes * 0.9
+                exceso_archivos = len(vigentes) - int(self.max_archivos * 0.9)
+                for _, tamaño, ruta in sorted(vigentes):
+                    if exceso_bytes <= 0 and exceso_archivos <= 0:
+                        break
+                    try:
+                        os.remove(ruta)
+                    except OSError:
+                        pass
+                    total -= tamaño
+                    exceso_bytes -= tamaño
+                    exceso_archivos -= 1
+                    expulsados += 1
+                log.info('Cache en disco acotada: %d archivos expulsados', expulsados)
+            with self._lock:
+                self._bytes = total
+                self._archivos = len(vigentes) - expulsados
+                self._proxima_limpieza = ahora + self.LIMPIAR_CADA
+            return expulsados
+        finally:
+            self._limpiando.release()
+
+
+# Los dos primeros bytes indican el formato, así un worker lee lo que escribió otro con otras librerías
+_zstd = threading.local()
+
+def serializar(valor):
+    if msgpack is not None:
+        formato, datos = b'M', msgpack.packb(valor, use_bin_type=True)
+    else:
+        formato, datos = b'J', json.dumps(valor, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    if zstandard is not None:
+        if not hasattr(_zstd, 'compresor'):  # los compresores de zstandard no son thread-safe
+            _zstd.compresor = zstandard.ZstdCompressor(level=3)
+        return formato + b'Z' + _zstd.compresor.compress(datos)
+    return formato + b'z' + zlib.compress(datos, 6)
+
+def deserializar(datos):
+    """Valor serializado o ValueError si el formato no se puede leer en este worker"""
+    formato, compresion, cuerpo = datos[:1], datos[1:2], datos[2:]
+    if compresion == b'Z' and zstandard is not None:
+        cuerpo = zstandard.ZstdDecompressor().decompress(cuerpo)
+    elif compresion == b'z':
+        cuerpo = zlib.decompress(cuerpo)
+    else:
+        raise ValueError('compresión no disponible')
+    if formato == b'M' and msgpack is not None:
+        return msgpack.unpackb(cuerpo, raw=False)
+    if formato == b'J':
+        return json.loads(cuerpo)
+    raise ValueError('serialización no disponible')
+
+
+class AlmacenSqlite:
+    """Almacén compartido por los workers de un host: sqlite en modo WAL con tamaño total acotado
+
+    Al superar max_bytes se borran primero las entradas vencidas y luego las
+    menos usadas recientemente, hasta quedar en el 90%. Cada escritura suma su
+    tamaño al total conocido y se acota en cuanto lo cruza; lo que escriben otros
+    workers se ve al releer el total, cada REVISAR_CADA escrituras.
+    """
+
+    REVISAR_CADA = 50  # escrituras entre relecturas del tamaño total
+    USO_RESOLUCION = 60  # segundos: la marca LRU de una clave se actualiza a lo sumo una vez por intervalo
+
+    def __init__(self, ruta=CACHE_SQLITE, max_bytes=CACHE_MAX_BYTES):
+        self.ruta = ruta
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._escrituras = 0
+        self._bytes = None  # total estimado; None hasta leerlo de la base
+        os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+        self._conexion().execute(
+            'CREATE TABLE IF NOT EXISTS cache ('
+            'clave TEXT PRIMARY KEY, expira REAL, usado REAL, tamaño INTEGER, valor BLOB)'
+        )
+        self._conexion().execute('CREATE INDEX IF NOT EXISTS cache_usado ON cache (usado)')
+
+    def _conexion(self):
+        """Una conexión por hilo y por proceso (no se comparten tras un fork)"""
+        if getattr(self._local, 'pid', None) != os.getpid():
+            conexion = sqlite3.connect(self.ruta, timeout=5, isolation_level=None, check_same_thread=False)
+            conexion.execute('PRAGMA journal_mode=WAL')
+            conexion.execute('PRAGMA synchronous=NORMAL')
+            self._local.conexion = conexion
+            self._local.pid = os.getpid()
+        return self._local.conexion
+
+    def leer(self, clave):
+        try:
+            fila = self._conexion().execute(
+                'SELECT expira, usado, valor FROM cache WHERE clave = ?', (clave,)
+            ).fetchone()
+            if fila is None:
+                return None
+            valor = deserializar(fila[2])
+        except (sqlite3.Error, ValueError, zlib.error) as e:
+            log.warning('No se pudo leer la cache sqlite: %s', e)
+            return None
+        self._marcar_uso(clave, fila[1])
+        return fila[0], valor
+
+    def _marcar_uso(self, clave, usado):
+        """Actualiza la marca LRU solo si quedó vieja: las lecturas casi nunca compiten por el lock de escritura
+
+        Si el lock está ocupado se deja para la próxima lectura; el acierto ya está leído.
+        """
+        ahora = time.time()
+        if ahora - usado < self.USO_RESOLUCION:
+            return
+        try:
+            self._conexion().execute('UPDATE cache SET usado = ? WHERE clave = ? AND usado < ?',
+                                     (ahora, clave, ahora - self.USO_RESOLUCION))
+        except sqlite3.Error as e:
+            log.debug('No se pudo actualizar el uso en la cache sqlite: %s', e)
+
+    def escribir(self, clave, expira, valor):
+        datos = serializar(valor)
+        try:
+            self._conexion().execute(
+                'INSERT OR REPLACE INTO cache (clave, expira, usado, tamaño, valor) VALUES (?, ?, ?, ?, ?)',
+                (clave, expira, time.time(), len(datos), datos)
+            )
+            self._escrituras += 1
+            if self._bytes is None or self._escrituras % self.REVISAR_CADA == 0:
+                self._bytes = self._total()
+            else:
+                self._bytes += len(datos)  # reemplazar una clave también suma: solo adelanta el acotado
+            if self._bytes > self.max_bytes:
+                self.acotar()
+        except sqlite3.Error as e:
+            log.warning('No se pudo escribir la cache sqlite: %s', e)
+
+    def _total(self):
+        return self._conexion().execute('SELECT COALESCE(SUM(tamaño), 0) FROM cache').fetchone()[0]
+
+    def borrar(self, clave):
+        try:
+            self._conexion().execute('DELETE FROM cache WHERE clave = ?', (clave,))
+        except sqlite3.Error:
+            pass
+
+    def acotar(self):
+        """Expulsa entradas vencidas y luego las menos usadas hasta entrar en max_bytes"""
+        conexion = self._conexion()
+        conexion.execute('DELETE FROM cache WHERE expira <= ?', (time.time(),))
+        total = self._total()
+        if total <= self.max_bytes:
+            self._bytes = total
+            return 0
+        exceso = total - self.max_bytes * 0.9
+        expulsadas = []
+        for clave, tamaño in conexion.execute('SELECT clave, tamaño FROM cache ORDER BY usado'):
+            if exceso <= 0:
+                break
+            expulsadas.append((clave,))
+            exceso -= tamaño
+        conexion.executemany('DELETE FROM cache WHERE clave = ?', expulsadas)
+        self._bytes = self._total()
+        log.info('Cache sqlite acotada: %d entradas expulsadas', len(expulsadas))
+        return len(expulsadas)
+
+
+class AlmacenRedis:
+    """Almacén compartido entre workers y nodos por protocolo Redis (Redis, Valkey, KeyDB...)
+
+    Cada clave expira con su TTL. El tamaño total lo acota el servidor con
+    maxmemory; con CACHE_REDIS_CONFIGURAR=1 se fija en CACHE_MAX_BYTES con
+    política allkeys-lru.
+    """
+
+    def __init__(self, url=CACHE_REDIS_URL, prefijo='transcripciones:'):
+        if redis is None:
+            raise RuntimeError('CACHE_BACKEND=redis requiere el paquete redis')
+        self.prefijo = prefijo
+        self.cliente = redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+        if os.environ.get('CACHE_REDIS_CONFIGURAR', '0') == '1':
+            try:
+                self.cliente.config_set('maxmemory', CACHE_MAX_BYTES)
+                self.cliente.config_set('maxmemory-policy', 'allkeys-lru')
+            except redis.RedisError as e:
+                log.warning('No se pudo configurar maxmemory en Redis: %s', e)
+
+    def leer(self, clave):
+        try:
+            datos = self.cliente.get(self.prefijo + clave)
+            if datos is None:
+                return None
+            entrada = deserializar(datos)
+            return entrada['expira'], entrada['valor']
+        except (redis.RedisError, ValueError, KeyError, zlib.error) as e:
+            log.warning('No se pudo leer la cache Redis: %s', e)
+            return None
+
+    def escribir(self, clave, expira, valor):
+        ttl = max(1, int(expira - time.time()))
+        try:
+            self.cliente.set(self.prefijo + clave, serializar({'expira': expira, 'valor': valor}), ex=ttl)
+        except redis.RedisError as e:
+            log.warning('No se pudo escribir la cache Redis: %s', e)
+
+    def borrar(self, clave):
+        try:
+            self.cliente.delete(self.prefijo + clave)
+        except redis.RedisError:
+            pass
+
+
+# Backends disponibles (CACHE_BACKEND); sqlite y redis se comparten entre workers
+ALMACENES = {
+    'directorio': AlmacenDirectorio,
+    'sqlite': AlmacenSqlite,
+    'redis': AlmacenRedis,
+}
+
+
+class CacheTranscripciones:
+    """Cache LRU en memoria con TTL y un almacén en disco opcional"""
+
+    def __init__(self, max_entradas=1000, almacen=None):
+        self.max_entradas = max_entradas
+        self.almacen = almacen
+        self._entradas = OrderedDict()  # clave -> (expira, valor)
+        self._lock = threading.Lock()
+        self.estadisticas = {
+            'aciertos': 0,
+            'aciertos_negativos': 0,
+            'aciertos_disco': 0,
+            'fallos': 0,
+            'guardados': 0,
+            'expulsiones': 0,
+        }
+
+    def _contar(self, nombre):
+        with self._lock:
+            self.estadisticas[nombre] += 1
+
+    def _guardar_en_memoria(self, clave, expira, valor):
+        with self._lock:
+            self._entradas[clave] = (expira, valor)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+                self.estadisticas['expulsiones'] += 1
+
+    def obtener(self, clave, contar=True):
+        """Devuelve el valor guardado o None si no existe o ya expiró"""
+        ahora = time.time()
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None:
+                if entrada[0] > ahora:
+                    self._entradas.move_to_end(clave)
+                else:
+                    del self._entradas[clave]
+                    entrada = None
+
+        if entrada is None and self.almacen is not None:
+            entrada = self.almacen.leer(clave)
+            if entrada is not None and entrada[0] <= ahora:
+                self.almacen.borrar(clave)
+                entrada = None
+            if entrada is not None:
+                if contar:
+                    self._contar('aciertos_disco')
+                self._guardar_en_memoria(clave, *entrada)
+
+        if entrada is None:
+            if contar:
+                self._contar('fallos')
+            return None
+
+        valor = entrada[1]
+        if contar:
+            self._contar('aciertos_negativos' if valor.get('negativo') else 'aciertos')
+        return valor
+
+    def vigencia(self, clave):
+        """Segundos que le quedan a una entrada en memoria, o None si no está"""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+        return entrada[0] - time.time() if entrada is not None else None
+
+    def guardar(self, clave, valor, ttl):
+        expira = time.time() + ttl
+        self._guardar_en_memoria(clave, expira, valor)
+        if self.almacen is not None:
+            self.almacen.escribir(clave, expira, valor)
+        self._contar('guardados')
+
+    def resumen(self):
+        with self._lock:
+            datos = dict(self.estadisticas)
+            datos['entradas_memoria'] = len(self._entradas)
+        consultas = datos['aciertos'] + datos['aciertos_negativos'] + datos['fallos']
+        datos['ratio_aciertos'] = round((consultas - datos['fallos']) / consultas, 4) if consultas else 0.0
+        datos['backend'] = CACHE_BACKEND
+        return datos
+
+
+def crear_cache():
+    """Crea la cache según la configuración de entorno"""
+    almacen = None
+    if CACHE_BACKEND in ALMACENES:
+        try:
+            almacen = ALMACENES[CACHE_BACKEND]()
+        except Exception as e:
+            # La cache es una optimización: sin backend se sigue sirviendo desde memoria
+            log.error("No se pudo iniciar CACHE_BACKEND '%s' (%s), usando solo memoria", CACHE_BACKEND, e)
+    elif CACHE_BACKEND != 'memoria':
+        log.warning("CACHE_BACKEND desconocido '%s', usando solo memoria", CACHE_BACKEND)
+    return CacheTranscripciones(max_entradas=CACHE_MAX_ENTRADAS, almacen=almacen)
+
+
+cache_transcripciones = crear_cache()
+
+
+def clave_cache(video_id, idioma=IDIOMA_POR_DEFECTO):
+    return f"transcript:{video_id}:{idioma}"
+
+
+# Índice de pistas: misma cache y backend, otro espacio de claves
+indice_pistas = crear_cache()
+
+
+def clave_indice(video_id):
+    return f"pistas:{video_id}"
+
+def obtener_indice(video_id):
+    return indice_pistas.obtener(clave_indice(video_id))
+
+def guardar_indice(video_id, indice):
+    indice_pistas.guardar(clave_indice(video_id), indice, INDICE_TTL)
+    return indice
+
+def _expiracion_url(url):
+    """Devuelve el parámetro expire de una URL firmada de YouTube, o None"""
+    valor = parse_qs(urlparse(url).query).get('expire')
+    try:
+        return float(valor[0]) if valor else None
+    except ValueError:
+        return None
+
+def _url_con_idioma(url, lang):
+    partes = urlparse(url)
+    consulta = parse_qs(partes.query)
+    consulta['tlang'] = [lang]
+    return partes._replace(query=urlencode(consulta, doseq=True)).geturl()
+
+def _resumir_pistas(subtitulos, indice):
+    """Resume las pistas de yt-dlp quedándose con el formato preferido de cada idioma
+    
+    Las traducciones automáticas solo difieren en el parámetro tlang, así que
+    guardan una única URL plantilla en el índice en lugar de una URL cada una.
+    """
+    pistas = {}
+    for lang, formatos in subtitulos.items():
+        pista = {'nombre': next((f['name'] for f in formatos if f.get('name')), None)}
+        por_formato = {f.get('ext'): f for f in reversed(formatos) if f.get('url')}
+        formato = next((por_formato[ext] for ext in PARSERS_POR_FORMATO if ext in por_formato), None)
+        if formato is not None:
+            pista['ext'] = formato['ext']
+            if 'tlang' in parse_qs(urlparse(formato['url']).query):
+                indice['traduccion'] = indice['traduccion'] or formato['url']
+            else:
+                pista['url'] = formato['url']
+            expira = _expiracion_url(formato['url'])
+            if expira is not None and (indice['expira_urls'] is None or expira < indice['expira_urls']):
+                indice['expira_urls'] = expira
+        pistas[lang] = pista
+    return pistas
+
+def indexar_info(video_id, info):
+    """Construye y guarda el índice completo a partir de la información de yt-dlp"""
+    indice = {'fuente': 'ytdlp', 'completo': True, 'titulo': info.get('title'),
+              'traduccion': None, 'expira_urls': None}
+    indice['manuales'] = _resumir_pistas(info.get('subtitles') or {}, indice)
+    indice['automaticos'] = _resumir_pistas(info.get('automatic_captions') or {}, indice)
+    return guardar_indice(video_id, indice)
+
+def indexar_lista_timedtext(video_id, root):
+    """Guarda el índice parcial (solo pistas manuales) de la respuesta type=list"""
+    manuales = {track.get('lang_code', ''): {'nombre': track.get('name')} for track in root.findall('.//track')}
+    return guardar_indice(video_id, {'fuente': 'timedtext', 'completo': False, 'titulo': None,
+                                     'manuales': manuales, 'automaticos': {},
+                                     'traduccion': None, 'expira_urls': None})
+
+def urls_vigentes(indice):
+    expira = indice.get('expira_urls')
+    return expira is None or expira - INDICE_MARGEN_URL > time.time()
+
+def pista_de_indice(indice, tipo, lang):
+    """Devuelve la lista de formatos de una pista como la entrega yt-dlp, o None si no hay URL"""
+    pista = indice[tipo].get(lang)
+    if pista is None or 'ext' not in pista:
+        return None
+    url = pista.get('url')
+    if url is None and indice.get('traduccion'):
+        url = _url_con_idioma(indice['traduccion'], lang)
+    if url is None:
+        return None
+    return [{'ext': pista['ext'], 'url': url, 'name': pista.get('nombre')}]
+
+def idioma_base(lang):
+    return lang.split('-')[0].lower()
+
+def candidatos_idioma(preferencia, disponibles):
+    """Idiomas disponibles que satisfacen una preferencia: el código exacto, el idioma base y sus variantes regionales"""
+    base = idioma_base(preferencia)
+    candidatos = [preferencia, base] + [lang for lang in disponibles if idioma_base(lang) == base]
+    return [lang for lang in dict.fromkeys(candidatos) if lang in disponibles]
+
+def pistas_preferidas(indice, idiomas, tipos=('manuales', 'automaticos')):
+    """Recorre (tipo, idioma) en orden de preferencia; dentro de cada idioma, manuales antes que automáticas"""
+    for preferencia in idiomas:
+        for tipo in tipos:
+            for lang in candidatos_idioma(preferencia, indice[tipo]):
+                yield tipo, lang
+
+def descubrir_pistas_timedtext(video_id, listar):
+    """Índice parcial desde la lista de timedtext; una sola llamada type=list aunque lo pidan varios hilos"""
+    def descubrir():
+        indice = indice_pistas.obtener(clave_indice(video_id), contar=False)
+        if indice is not None:
+            return indice
+        root = listar()
+        return indexar_lista_timedtext(video_id, root) if root is not None else None
+    return coalescedor.ejecutar(clave_indice(video_id), descubrir)[0]
+
+def descubrir_pistas_ytdlp(video_id, forzar=False):
+    """Índice completo desde yt-dlp; una sola extracción aunque lo pidan varios hilos"""
+    def descubrir():
+        indice = indice_pistas.obtener(clave_indice(video_id), contar=False)
+        if not forzar and indice and indice.get('completo') and urls_vigentes(indice):
+            return indice
+        return indexar_info(video_id, extraer_info_subtitulos(video_id))
+    return coalescedor.ejecutar(clave_indice(video_id) + ':ytdlp', descubrir)[0]
+
+
+class _Llamada:
+    """Una obtención en curso compartida por todos los que piden la misma clave"""
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.resultado = None
+        self.error = None
+
+
+class SingleFlight:
+    """Agrupa peticiones concurrentes de la misma clave en una sola llamada upstream"""
+
+    def __init__(self, dir_locks=''):
+        self.dir_locks = dir_locks
+        self._en_vuelo = {}  # clave -> _Llamada
+        self._lock = threading.Lock()
+        self.estadisticas = {'ejecutadas': 0, 'compartidas': 0}
+        if dir_locks:
+            os.makedirs(dir_locks, exist_ok=True)
+
+    @contextmanager
+    def _lock_entre_workers(self, clave):
+        """Bloqueo por archivo (flock) para que un solo worker obtenga la clave"""
+        if not self.dir_locks or fcntl is None:
+            yield
+            return
+
+        ruta = os.path.join(self.dir_locks, hashlib.sha1(clave.encode('utf-8')).hexdigest() + '.lock')
+        while True:
+            fd = os.open(ruta, os.O_CREAT | os.O_RDWR, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                # Si el dueño anterior borró el archivo mientras esperábamos, reintenta
+                if os.fstat(fd).st_ino == os.stat(ruta).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+        try:
+            yield
+        finally:
+            try:
+                os.unlink(ruta)
+            except OSError:
+                pass
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def ejecutar(self, clave, funcion):
+        """Ejecuta funcion() una sola vez por clave; devuelve (resultado, compartido)"""
+        with self._lock:
+            llamada = self._en_vuelo.get(clave)
+            lider = llamada is None
+            if lider:
+                llamada = _Llamada()
+                self._en_vuelo[clave] = llamada
+                self.estadisticas['ejecutadas'] += 1
+            else:
+                self.estadisticas['compartidas'] += 1
+
+        if not lider:
+            llamada.evento.wait()
+            if llamada.error is not None:
+                raise llamada.error
+            return llamada.resultado, True
+
+        try:
+            with self._lock_entre_workers(clave):
+                llamada.resultado = funcion()
+        except BaseException as e:
+            llamada.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._en_vuelo[clave]
+            llamada.evento.set()
+
+        return llamada.resultado, False
+
+    def resumen(self):
+        with self._lock:
+            datos = dict(self.estadisticas)
+            datos['en_vuelo'] = len(self._en_vuelo)
+        datos['entre_workers'] = bool(self.dir_locks and fcntl is not None)
+        return datos
+
+
+coalescedor = SingleFlight(SINGLEFLIGHT_LOCK_DIR)
+
+class ProveedorBloqueado(Exception):
+    """El upstream respondió con un bloqueo (página 'sorry' de Google o 429)"""
+
+class SinSubtitulos(Exception):
+    """El proveedor confirmó que no hay subtítulos utilizables; los detalles van al payload del 404"""
+    
+    def __init__(self, mensaje, **detalles):
+        super().__init__(mensaje)
+        self.detalles = detalles
+
+class Resultado:
+    """Resultado común de cualquier proveedor: segmentos con tiempos, idioma y origen"""
+    
+    __slots__ = ('transcripcion', 'idioma', 'tipo', 'metodo', 'duracion')
+    
+    def __init__(self, transcripcion, idioma, tipo, metodo):
+        self.transcripcion = transcripcion
+        self.idioma = idioma
+        self.tipo = tipo
+        self.metodo = metodo
+        self.duracion = None  # segundos, lo completa el motor
+    
+    def payload(self, video_id):
+        texto = self.transcripcion.texto_plano()
+        payload = {
+            'exito': True,
+            'video_id': video_id,
+            'transcripcion': texto,
+            'total_caracteres': len(texto),
+            'total_segmentos': len(self.transcripcion),
+            'tipo_subtitulos': self.tipo,
+            'idioma': self.idioma,
+            'metodo': self.metodo
+        }
+        if self.duracion is not None:
+            payload['duracion_ms'] = round(self.duracion * 1000)
+        return payload
+
+# Cabeceras de las peticiones a timedtext
+CABECERAS_TIMEDTEXT = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+}
+
+def cabeceras_timedtext(idiomas):
+    """CABECERAS_TIMEDTEXT con Accept-Language armado desde la preferencia de la petición (es-MX,es;q=0.9,...)"""
+    aceptados = [lang if i == 0 else f'{lang};q={max(0.1, 1 - i / 10):.1f}' for i, lang in enumerate(idiomas)]
+    return dict(CABECERAS_TIMEDTEXT, **{'Accept-Language': ','.join(aceptados)})
+
+def verificar_bloqueo_google(response):
+    # Sirve para respuestas de requests y de aiohttp (modo ASGI)
+    if response.status_code == 429 or '/sorry/' in str(response.url):
+        raise ProveedorBloqueado(f'Google bloqueó la petición ({response.status_code})')
+
+def verificar_status(response, proveedor):
+    """404 es que no hay subtítulos; cualquier otro status distinto de 200 es un fallo del upstream
+    
+    Se lanza como error HTTP de requests: se reintenta como un error de red y
+    cuenta como fallo en el circuit breaker del proveedor.
+    """
+    if response.status_code not in (200, 404):
+        raise requests.HTTPError(f'{proveedor} respondió {response.status_code}')
+
+def obtener_subtitulos_directo(video_id, cancelado=None, idiomas=None, timeout=10):
+    """Obtiene subtítulos directamente sin usar yt-dlp, en el primer idioma de la preferencia que exista
     
+    timeout es el tiempo total para listar idiomas y descargar la pista.
+    """
+    limite = time.monotonic() + timeout
     # URL de la API de subtítulos de YouTube
-    base_url = "https://www.youtube.com/api/timedtext"
+    base_url = TIMEDTEXT_URL
     
     # Primero, obtiene la lista de idiomas disponibles
     params = {
@@ -21,35 +1230,35 @@ def obtener_subtitulos_directo(video_id):
         'type': 'list'
     }
     
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-        'Accept-Language': 'es-ES,es;q=0.9'
-    }
+    idiomas = idiomas or leer_idiomas()
+    headers = cabeceras_timedtext(idiomas)
     
-    try:
-        # Lista de idiomas
-        response = requests.get(base_url, params=params, headers=headers, timeout=10)
+    def listar():
+        with LIMITES_PROVEEDOR['timedtext']:
+            response = http_get(base_url, params=params, headers=headers, timeout=tiempo_restante(limite))
         
+        verificar_bloqueo_google(response)
+        verificar_status(response, 'timedtext')
         if response.status_code != 200:
-            return None, None, None
+            return None
         
         # Parsea XML de idiomas disponibles
-        root = ET.fromstring(response.text)
-        
-        # Busca español
-        idiomas_espanol = ['es', 'es-ES', 'es-MX', 'es-419']
-        lang_code = None
-        lang_name = None
-        
-        for track in root.findall('.//track'):
-            lang = track.get('lang_code', '')
-            if lang in idiomas_espanol:
-                lang_code = lang
-                lang_name = track.get('name', 'Español')
-                break
+        return ET.fromstring(response.text)
+    
+    try:
+        # Lista de idiomas, salvo que ya esté en el índice de pistas
+        indice = obtener_indice(video_id) or descubrir_pistas_timedtext(video_id, listar)
+        if indice is None:
+            return None, None, None
         
+        lang_code = idioma_timedtext(indice, idiomas)
         if not lang_code:
             return None, None, None
+        lang_name = indice['manuales'][lang_code].get('nombre') or lang_code
+        
+        # Otro proveedor ya respondió mientras listábamos idiomas
+        if cancelado is not None and cancelado.is_set():
+            return None, None, None
         
         # Descarga los subtítulos en ese idioma
         params = {
@@ -58,140 +1267,410 @@ def obtener_subtitulos_directo(video_id):
             'fmt': 'srv3'  # Formato XML simple
         }
         
-        response = requests.get(base_url, params=params, headers=headers, timeout=10)
-        
-        if response.status_code != 200:
-            return None, None, None
-        
-        # Parsea el XML de subtítulos
-        root = ET.fromstring(response.text)
-        textos = []
+        # Parsea el XML a medida que se descarga, sin cargar el documento entero
+        with LIMITES_PROVEEDOR['timedtext']:
+            with http_get(base_url, params=params, headers=headers, timeout=tiempo_restante(limite),
+                          stream=True) as response:
+                verificar_bloqueo_google(response)
+                verificar_status(response, 'timedtext')
+                if response.status_code != 200:
+                    return None, None, None
+                transcripcion = parsear_srv3(response.iter_content(TAMAÑO_CHUNK))
         
-        for text_elem in root.findall('.//text'):
-            texto = text_elem.text
-            if texto:
-                textos.append(texto.strip())
-        
-        texto_completo = ' '.join(textos)
-        
-        return texto_completo, lang_code, lang_name
+        return transcripcion, lang_code, lang_name
         
+    except (ProveedorBloqueado, requests.RequestException):
+        # Bloqueos y errores de red llegan al circuit breaker
+        raise
     except Exception as e:
-        print(f"❌ Error en obtener_subtitulos_directo: {e}")
+        log.warning('Error en obtener_subtitulos_directo: %s', e)
         return None, None, None
 
-def obtener_subtitulos_rapidapi(video_id):
-    """Obtiene subtítulos usando RapidAPI"""
-    import requests
-    import os
+def idioma_timedtext(indice, idiomas):
+    """Primer idioma manual del índice que satisface la preferencia, o None"""
+    return next((lang for _, lang in pistas_preferidas(indice, idiomas, ('manuales',))), None)
+
+def transcripcion_de_items(items):
+    """Convierte una lista de items {text, offset/start, duration/dur} de RapidAPI en segmentos"""
+    transcripcion = Transcripcion()
+    for item in items:
+        if isinstance(item, dict) and item.get('text'):
+            inicio = item.get('offset', item.get('start', 0)) or 0
+            duracion = item.get('duration', item.get('dur', 0)) or 0
+            transcripcion.agregar(float(inicio), float(duracion), html.unescape(str(item['text'])))
+    return transcripcion
+
+def _rapidapi_lista(data):
+    if isinstance(data, list) and data:
+        return transcripcion_de_items(data)
+
+def _rapidapi_campo(campo):
+    def extraer(data):
+        if not isinstance(data, dict):
+            return None
+        valor = data.get(campo)
+        if isinstance(valor, str):
+            return Transcripcion.desde_texto(valor)
+        if isinstance(valor, list):
+            return transcripcion_de_items(valor)
+    return extraer
+
+def _rapidapi_texto_largo(data):
+    # Cualquier clave que contenga texto largo
+    if not isinstance(data, dict):
+        return None
+    for valor in data.values():
+        if isinstance(valor, str) and len(valor) > 100:
+            return Transcripcion.desde_texto(valor)
+        if isinstance(valor, list) and valor:
+            posible = transcripcion_de_items(valor)
+            if len(posible.texto_plano()) > 100:
+                return posible
+
+# Formas conocidas de la respuesta de RapidAPI, en orden de prueba
+FORMAS_RAPIDAPI = {
+    'lista': _rapidapi_lista,
+    'transcript': _rapidapi_campo('transcript'),
+    'text': _rapidapi_campo('text'),
+    'data': _rapidapi_campo('data'),
+    'texto_largo': _rapidapi_texto_largo,
+}
+_forma_rapidapi = None  # última forma que funcionó; la API casi nunca cambia entre llamadas
+
+def transcripcion_de_rapidapi(data):
+    """Extrae la transcripción probando primero la forma que funcionó la última vez"""
+    global _forma_rapidapi
+    formas = list(FORMAS_RAPIDAPI)
+    if _forma_rapidapi is not None:
+        formas.remove(_forma_rapidapi)
+        formas.insert(0, _forma_rapidapi)
+    
+    for forma in formas:
+        transcripcion = FORMAS_RAPIDAPI[forma](data)
+        if transcripcion and len(transcripcion.texto_plano()) > 50:
+            if forma != _forma_rapidapi:
+                log.info('Forma de respuesta de RapidAPI detectada: %s', forma)
+                _forma_rapidapi = forma
+            return transcripcion
+    return None
+
+def peticion_rapidapi(video_id, idiomas=None):
+    """(idioma, headers, querystring) de la consulta a RapidAPI"""
+    idioma = (idiomas or leer_idiomas())[0]
     
     # Obtener API Key de variable de entorno o usar la hardcodeada
     api_key = os.environ.get('RAPIDAPI_KEY', '4db8764539mshfca57004d418dd6p1f779ajsn94d62ab586d8')
     
-    url = "https://youtube-transcript3.p.rapidapi.com/api/transcript"
-    
     # CAMBIO IMPORTANTE: videoId en lugar de video_id
     querystring = {
         "videoId": video_id,  # <-- CAMBIADO AQUÍ
-        "lang": "es"
+        "lang": idioma
     }
     
     headers = {
         "X-RapidAPI-Key": api_key,
         "X-RapidAPI-Host": "youtube-transcript3.p.rapidapi.com"
     }
+    return idioma, headers, querystring
+
+def leer_respuesta_rapidapi(response, idioma):
+    """Interpreta la respuesta de RapidAPI (de requests o de aiohttp); devuelve (transcripcion, idioma, metodo)"""
+    metricas.observar('transcripciones_descarga_bytes', len(response.content), formato='rapidapi')
+    log.debug('RapidAPI respondió %s (%d bytes)', response.status_code, len(response.content))
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug('Respuesta de RapidAPI: %.500s', response.text)
     
-    try:
-        print("🌐 Intentando con RapidAPI...")
-        print(f"🔗 URL: {url}")
-        print(f"📋 Video ID: {video_id}")
+    if response.status_code == 429:
+        raise ProveedorBloqueado('RapidAPI devolvió 429 (cuota o límite de tasa)')
+    verificar_status(response, 'rapidapi')
+    
+    if response.status_code == 200:
+        data = response.json()
         
-        response = requests.get(url, headers=headers, params=querystring, timeout=30)
+        # Verifica si la respuesta fue exitosa
+        if isinstance(data, dict) and data.get('success') == False:
+            log.warning('RapidAPI respondió con error: %s', data.get('error'))
+            return None, None, None
         
-        print(f"📡 Código de respuesta: {response.status_code}")
-        print(f"📄 Respuesta: {response.text[:500]}...")
+        # Registra la estructura para ver qué formato tiene
+        log.debug('Estructura de la respuesta de RapidAPI: %s %s', type(data).__name__,
+                  list(data.keys()) if isinstance(data, dict) else len(data))
         
-        if response.status_code == 200:
-            data = response.json()
-            
-            # Verifica si la respuesta fue exitosa
-            if isinstance(data, dict) and data.get('success') == False:
-                print(f"❌ API respondió con error: {data.get('error')}")
-                return None, None, None
-            
-            # Imprime la estructura para ver qué formato tiene
-            print(f"🔍 Estructura de datos: {type(data)}")
-            if isinstance(data, dict):
-                print(f"🔑 Claves disponibles: {list(data.keys())}")
-            
-            # Intenta diferentes formatos de respuesta
-            texto_completo = None
-            
-            # Formato 1: Lista directa
-            if isinstance(data, list) and len(data) > 0:
-                texto_completo = ' '.join([item.get('text', '') for item in data if 'text' in item])
-            
-            # Formato 2: Diccionario con 'transcript'
-            elif isinstance(data, dict):
-                if 'transcript' in data:
-                    if isinstance(data['transcript'], str):
-                        texto_completo = data['transcript']
-                    elif isinstance(data['transcript'], list):
-                        texto_completo = ' '.join([item.get('text', '') for item in data['transcript']])
-                
-                # Formato 3: Diccionario con 'text'
-                elif 'text' in data:
-                    texto_completo = data['text']
-                
-                # Formato 4: Diccionario con 'data'
-                elif 'data' in data:
-                    if isinstance(data['data'], str):
-                        texto_completo = data['data']
-                    elif isinstance(data['data'], list):
-                        texto_completo = ' '.join([item.get('text', '') for item in data['data']])
-                
-                # Formato 5: Buscar cualquier clave que contenga texto largo
-                else:
-                    for key, value in data.items():
-                        if isinstance(value, str) and len(value) > 100:
-                            texto_completo = value
-                            break
-                        elif isinstance(value, list) and len(value) > 0:
-                            # Intenta extraer texto de la lista
-                            posible_texto = ' '.join([str(item.get('text', '')) for item in value if isinstance(item, dict)])
-                            if len(posible_texto) > 100:
-                                texto_completo = posible_texto
-                                break
-            
-            if texto_completo and len(texto_completo) > 50:
-                print(f"✅ Texto extraído: {len(texto_completo)} caracteres")
-                return texto_completo, 'es', 'RapidAPI'
-            else:
-                print(f"❌ No se pudo extraer texto válido de la respuesta")
-                print(f"📄 Respuesta completa: {data}")
-                return None, None, None
+        transcripcion = transcripcion_de_rapidapi(data)
         
+        if transcripcion:
+            log.debug('Texto extraído de RapidAPI: %d caracteres', len(transcripcion.texto_plano()))
+            return transcripcion, idioma, 'RapidAPI'
         else:
-            print(f"❌ Error {response.status_code}: {response.text}")
+            log.warning('No se pudo extraer texto válido de la respuesta de RapidAPI')
+            log.debug('Respuesta completa de RapidAPI: %s', data)
+            return None, None, None
+    
+    else:
+        log.warning('RapidAPI respondió %s', response.status_code)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug('Cuerpo del error de RapidAPI: %s', response.text)
+    
+    return None, None, None
+
+def obtener_subtitulos_rapidapi(video_id, idiomas=None, timeout=30):
+    """Obtiene subtítulos usando RapidAPI (solo admite un idioma: el primero de la preferencia)"""
+    
+    idioma, headers, querystring = peticion_rapidapi(video_id, idiomas)
+    
+    try:
+        log.debug('Consultando RapidAPI para %s', video_id)
         
-        return None, None, None
+        with LIMITES_PROVEEDOR['rapidapi']:
+            response = http_get(RAPIDAPI_URL, headers=headers, params=querystring, timeout=timeout)
         
+        return leer_respuesta_rapidapi(response, idioma)
+        
+    except (ProveedorBloqueado, requests.RequestException):
+        raise
     except Exception as e:
-        print(f"❌ Error con RapidAPI: {type(e).__name__}: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception('Error con RapidAPI: %s: %s', type(e).__name__, e)
         return None, None, None
 
-@app.route('/')
-def inicio():
-    return jsonify({
+@app.before_request
+def iniciar_peticion():
+    # En modo ASGI la petición empezó antes, mientras se resolvía la transcripción (ver asgi.py)
+    g.inicio_peticion = request.environ.get('transcripciones.inicio') or time.monotonic()
+    # Respeta el id que envía el cliente o un proxy; si no hay, genera uno
+    trace_id_actual.set(request.environ.get('transcripciones.trace_id')
+                        or request.headers.get('X-Request-ID', '')[:64] or uuid.uuid4().hex[:16])
+
+@app.after_request
+def terminar_peticion(respuesta):
+    respuesta.headers['X-Request-ID'] = trace_id_actual.get()
+    endpoint = request.endpoint or 'desconocido'
+    metricas.incrementar('transcripciones_peticiones_total', endpoint=endpoint, status=str(respuesta.status_code))
+    if 'inicio_peticion' in g:
+        metricas.observar('transcripciones_peticion_duracion_segundos',
+                          time.monotonic() - g.inicio_peticion, endpoint=endpoint)
+    return respuesta
+
+@app.errorhandler(Exception)
+def error_inesperado(error):
+    """Una excepción no prevista responde con el mismo sobre JSON que los demás errores"""
+    if isinstance(error, HTTPException):
+        return error  # 404, 405... siguen con la respuesta de Flask
+    log.exception('Error no controlado en %s: %s: %s', request.path, type(error).__name__, error)
+    return jsonify(payload_de_error(error, request.args.get('video_id'))), 500
+
+def payload_de_error(error, video_id=None):
+    """Sobre JSON de un error no previsto, por petición o por video de un lote"""
+    payload = {'exito': False, 'error': f'{type(error).__name__}: {error}'}
+    if video_id:
+        payload['video_id'] = video_id
+    return payload
+
+def elegir_codificacion(aceptadas=None):
+    """Codificación preferida por el cliente entre las disponibles (br antes que gzip en empate)"""
+    aceptadas = request.accept_encodings if aceptadas is None else aceptadas
+    disponibles = (['br'] if brotli is not None else []) + ['gzip']
+    codificacion = max(disponibles, key=lambda c: aceptadas[c])
+    return codificacion if aceptadas[codificacion] > 0 else None
+
+def comprimir(datos, codificacion):
+    if codificacion == 'br':
+        return brotli.compress(datos, quality=COMPRESION_CALIDAD_BROTLI)
+    return gzip.compress(datos, COMPRESION_NIVEL_GZIP)
+
+def compresor_flujo(codificacion):
+    """(agregar, terminar) de un compresor que se vacía en cada chunk para no retener datos"""
+    if codificacion == 'br':
+        compresor = brotli.Compressor(quality=COMPRESION_CALIDAD_BROTLI)
+        return lambda datos: compresor.process(datos) + compresor.flush(), compresor.finish
+    compresor = zlib.compressobj(COMPRESION_NIVEL_GZIP, zlib.DEFLATED, 31)  # 31: formato gzip
+    return lambda datos: compresor.compress(datos) + compresor.flush(zlib.Z_SYNC_FLUSH), compresor.flush
+
+def comprimir_flujo(chunks, codificacion):
+    """Comprime un cuerpo en streaming"""
+    agregar, terminar = compresor_flujo(codificacion)
+    try:
+        for chunk in chunks:
+            datos = agregar(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+            if datos:
+                yield datos
+        yield terminar()
+    finally:
+        # Propaga el cierre (cliente desconectado) al generador original
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+@app.after_request
+def comprimir_respuesta(respuesta):
+    if (respuesta.status_code < 200 or respuesta.status_code in (204, 304) or respuesta.direct_passthrough
+            or 'Content-Encoding' in respuesta.headers
+            or not respuesta.mimetype.startswith(TIPOS_COMPRIMIBLES)):
+        return respuesta
+    
+    respuesta.vary.add('Accept-Encoding')
+    codificacion = elegir_codificacion()
+    if codificacion is None:
+        return respuesta
+    
+    if respuesta.is_streamed:
+        respuesta.response = comprimir_flujo(respuesta.response, codificacion)
+        respuesta.headers.pop('Content-Length', None)
+    else:
+        datos = respuesta.get_data()
+        if len(datos) < COMPRESION_MIN_BYTES:
+            return respuesta
+        respuesta.set_data(comprimir(datos, codificacion))
+    respuesta.headers['Content-Encoding'] = codificacion
+    return respuesta
+
+@metricas.recolector
+def metricas_cache_y_pools():
+    cache = cache_transcripciones.resumen()
+    indice = indice_pistas.resumen()
+    refresco = refrescador.resumen()
+    coalescencia = coalescedor.resumen()
+    pool = obtener_pool_ytdlp().resumen()
+    busqueda = indice_busqueda.resumen()
+    return [
+        ('transcripciones_cache_consultas_total', 'counter', 'Consultas a la cache por resultado', [
+            ({'resultado': 'acierto'}, cache['aciertos']),
+            ({'resultado': 'acierto_negativo'}, cache['aciertos_negativos']),
+            ({'resultado': 'fallo'}, cache['fallos']),
+        ]),
+        ('transcripciones_cache_aciertos_disco_total', 'counter', 'Aciertos servidos desde el almacén en disco',
+         [({}, cache['aciertos_disco'])]),
+        ('transcripciones_cache_expulsiones_total', 'counter', 'Entradas expulsadas por LRU',
+         [({}, cache['expulsiones'])]),
+        ('transcripciones_cache_entradas', 'gauge', 'Entradas en la cache en memoria',
+         [({}, cache['entradas_memoria'])]),
+        ('transcripciones_cache_ratio_aciertos', 'gauge', 'Proporción de consultas resueltas por la cache',
+         [({}, cache['ratio_aciertos'])]),
+        ('transcripciones_indice_consultas_total', 'counter', 'Consultas al índice de pistas por resultado', [
+            ({'resultado': 'acierto'}, indice['aciertos']),
+            ({'resultado': 'fallo'}, indice['fallos']),
+        ]),
+        ('transcripciones_refresco_total', 'counter', 'Trabajos de refresco y precarga por resultado', [
+            ({'resultado': nombre}, refresco[nombre])
+            for nombre in ('encolados', 'descartados', 'refrescados', 'sin_cambios', 'fallidos')
+        ]),
+        ('transcripciones_refresco_pendientes', 'gauge', 'Trabajos de refresco y precarga en cola',
+         [({}, refresco['pendientes'])]),
+        ('transcripciones_busqueda_transcripciones', 'gauge', 'Transcripciones en el índice de búsqueda',
+         [({}, busqueda['transcripciones'])]),
+        ('transcripciones_coalescidas_total', 'counter', 'Peticiones que compartieron una obtención en curso',
+         [({}, coalescencia['compartidas'])]),
+        ('transcripciones_en_vuelo', 'gauge', 'Obtenciones upstream en curso',
+         [({}, coalescencia['en_vuelo'])]),
+        ('transcripciones_ytdlp_instancias', 'gauge', 'Instancias YoutubeDL creadas en el pool',
+         [({}, pool['creadas'])]),
+        ('transcripciones_interruptor_estado', 'gauge', 'Circuit breaker por proveedor (0 cerrado, 1 semiabierto, 2 abierto)',
+         [({'proveedor': nombre}, ESTADOS_INTERRUPTOR.index(i.estado)) for nombre, i in INTERRUPTORES.items()]),
+        ('transcripciones_limitador_tasa', 'gauge', 'Tasa actual permitida por proveedor (peticiones/s)',
+         [({'proveedor': nombre}, c.tasa) for nombre, c in CUBETAS.items()]),
+    ]
+
+@app.route('/metrics')
+def exportar_metricas():
+    return Response(metricas.exportar(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/')
+def inicio():
+    return jsonify({
         'mensaje': '✅ El servidor está funcionando',
         'endpoints': {
-            '/transcript': 'Obtener transcripción (params: video_id)',
-            '/check': 'Verificar idiomas disponibles (params: video_id)'
+            '/transcript': 'Obtener transcripción (params: video_id, opcionales: lang=es,en (preferencia), langs=es,en (varios idiomas), format=text|segments|srt|vtt, stream=1, estrategia, proveedores, hedge, deadline)',
+            '/transcripts': 'Transcripciones en lote, respuesta NDJSON (POST: {"video_ids": [...], "lang": "es,en"})',
+            '/check': 'Verificar idiomas disponibles (params: video_id)',
+            '/search': 'Buscar en las transcripciones ya obtenidas por este worker (params: q, opcionales: video_id, lang, limite, contexto)',
+            '/prefetch': 'Encolar videos para precargarlos en segundo plano (POST: {"video_ids": [...], "lang": "es"})',
+            '/stats': 'Estadísticas de cache, índice de pistas, refresco, coalescencia y tiempos de yt-dlp',
+            '/metrics': 'Métricas en formato Prometheus',
+            '/admin/proveedores': 'Estado de circuit breakers y limitadores por proveedor'
+        }
+    })
+
+@app.route('/stats')
+def estadisticas():
+    return jsonify({
+        'cache': cache_transcripciones.resumen(),
+        'indice_pistas': indice_pistas.resumen(),
+        'refresco': dict(refrescador.resumen(), populares=frecuencias.populares()),
+        'busqueda': indice_busqueda.resumen(),
+        'coalescencia': coalescedor.resumen(),
+        'ytdlp': obtener_pool_ytdlp().resumen()
+    })
+
+def _admin_autorizado(mutacion=False):
+    """Las rutas que solo leen quedan abiertas sin ADMIN_TOKEN; las que cambian estado lo exigen siempre"""
+    if not ADMIN_TOKEN:
+        return not mutacion
+    return request.headers.get('X-Admin-Token') == ADMIN_TOKEN
+
+@app.route('/admin/proveedores')
+def estado_proveedores():
+    if not _admin_autorizado():
+        return jsonify({'error': 'No autorizado'}), 403
+    
+    return jsonify({
+        nombre: {
+            'interruptor': INTERRUPTORES[nombre].resumen(),
+            'limitador': CUBETAS[nombre].resumen(),
+            'concurrencia_max': CONCURRENCIA_PROVEEDOR.get(nombre),
+            'politica': PROVEEDORES[nombre].resumen()
         }
+        for nombre in PROVEEDORES
     })
 
+@app.route('/admin/proveedores/<nombre>/reset', methods=['POST'])
+def reiniciar_proveedor(nombre):
+    if not _admin_autorizado(mutacion=True):
+        return jsonify({'error': 'No autorizado'}), 403
+    if nombre not in PROVEEDORES:
+        return jsonify({'error': f'Proveedor desconocido: {nombre}'}), 404
+    
+    INTERRUPTORES[nombre].reiniciar()
+    CUBETAS[nombre].tasa = CUBETAS[nombre].tasa_max
+    log.info('Proveedor %s reiniciado manualmente', nombre)
+    return jsonify({nombre: INTERRUPTORES[nombre].resumen()})
+
+@app.route('/prefetch', methods=['POST'])
+def precargar():
+    """Encola videos para obtenerlos antes de que lleguen las peticiones (ej. subidas nuevas de un canal)"""
+    # Gasta cuota upstream: como las rutas que cambian estado, exige ADMIN_TOKEN
+    if not _admin_autorizado(mutacion=True):
+        return jsonify({'error': 'No autorizado'}), 403
+    
+    datos = request.get_json(silent=True)
+    video_ids = datos.get('video_ids') if isinstance(datos, dict) else datos
+    if not isinstance(video_ids, list) or not video_ids:
+        return jsonify({
+            'exito': False,
+            'error': 'Necesitas proporcionar una lista video_ids'
+        }), 400
+    
+    try:
+        config = leer_config_estrategia({'lang': datos.get('lang')} if isinstance(datos, dict) else None)
+    except ValueError as error:
+        return jsonify({
+            'exito': False,
+            'error': str(error)
+        }), 400
+    
+    encolados, omitidos = [], []
+    for video_id in dict.fromkeys(str(v) for v in video_ids if v):
+        # Lo que ya está en cache no gasta presupuesto upstream
+        en_cache = cache_transcripciones.obtener(clave_cache(video_id, ','.join(config['idiomas'])), contar=False)
+        if en_cache is None and refrescador.encolar(video_id, config, 'precarga'):
+            encolados.append(video_id)
+        else:
+            omitidos.append(video_id)
+    
+    return jsonify({
+        'exito': True,
+        'encolados': encolados,
+        'omitidos': omitidos,
+        'pendientes': refrescador.resumen()['pendientes']
+    }), 202
+
 @app.route('/check')
 def verificar_idiomas():
     video_id = request.args.get('video_id')
@@ -200,110 +1679,468 @@ def verificar_idiomas():
         return jsonify({'error': 'Necesitas proporcionar un video_id'}), 400
     
     try:
-        url = f"https://www.youtube.com/watch?v={video_id}"
-        
-        ydl_opts = {
-            'skip_download': True,
-            'writesubtitles': True,
-            'writeautomaticsub': True,
-            'quiet': True,
-            'no_warnings': True
-        }
+        # Solo el índice completo (de yt-dlp) trae automáticos y título
+        indice = obtener_indice(video_id)
+        en_cache = bool(indice and indice.get('completo'))
+        if not en_cache:
+            indice = descubrir_pistas_ytdlp(video_id)
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            
-            subtitulos_manuales = list(info.get('subtitles', {}).keys())
-            subtitulos_auto = list(info.get('automatic_captions', {}).keys())
-            
-            return jsonify({
-                'video_id': video_id,
-                'titulo': info.get('title', 'Sin título'),
-                'subtitulos_manuales': subtitulos_manuales,
-                'subtitulos_automaticos': subtitulos_auto,
-                'tiene_espanol_manual': any('es' in s for s in subtitulos_manuales),
-                'tiene_espanol_auto': any('es' in s for s in subtitulos_auto)
-            })
+        subtitulos_manuales = list(indice['manuales'])
+        subtitulos_auto = list(indice['automaticos'])
+        
+        respuesta = jsonify({
+            'video_id': video_id,
+            'titulo': indice.get('titulo') or 'Sin título',
+            'subtitulos_manuales': subtitulos_manuales,
+            'subtitulos_automaticos': subtitulos_auto,
+            'tiene_espanol_manual': any('es' in s for s in subtitulos_manuales),
+            'tiene_espanol_auto': any('es' in s for s in subtitulos_auto)
+        })
+        respuesta.headers['X-Cache'] = 'HIT' if en_cache else 'MISS'
+        return respuesta
     
     except Exception as error:
         return jsonify({'error': str(error)}), 500
 
+@app.route('/search')
+def buscar_transcripciones():
+    consulta = request.args.get('q', '').strip()
+    video_id = request.args.get('video_id')
+    idioma = request.args.get('lang')
+    
+    if not consulta:
+        return jsonify({
+            'exito': False,
+            'error': 'Necesitas proporcionar el texto a buscar en q'
+        }), 400
+    
+    try:
+        limite = min(max(int(request.args.get('limite', 20)), 0), BUSQUEDA_MAX_RESULTADOS)
+        contexto = min(max(int(request.args.get('contexto', 0)), 0), 5)
+    except ValueError:
+        return jsonify({
+            'exito': False,
+            'error': 'limite y contexto deben ser enteros'
+        }), 400
+    
+    try:
+        idiomas = leer_idiomas(idioma)
+    except ValueError as error:
+        return jsonify({
+            'exito': False,
+            'error': str(error)
+        }), 400
+    idioma = idiomas[0] if idioma else None
+    
+    if video_id and not indice_busqueda.contiene(video_id, idioma):
+        # Otro worker pudo haberla obtenido (o sigue en cola para indexarse): se indexa desde la cache,
+        # con la misma clave que /transcript, nunca desde upstream
+        entrada = cache_transcripciones.obtener(clave_cache(video_id, ','.join(idiomas)), contar=False)
+        if entrada is None or entrada.get('status') != 200:
+            return jsonify({
+                'exito': False,
+                'error': 'La transcripción de este video no está en cache; pídela primero en /transcript',
+                'video_id': video_id
+            }), 404
+        indice_busqueda.agregar(entrada)
+        # Con lang=es,en la transcripción puede estar en cualquiera de los dos
+        idioma = entrada['payload'].get('idioma') if idioma else None
+    
+    total, resultados = indice_busqueda.buscar(consulta, video_id or None, idioma, limite, contexto)
+    respuesta = {
+        'exito': True,
+        'consulta': consulta,
+        'video_id': video_id,
+        'total_coincidencias': total,
+        'resultados': resultados
+    }
+    if not video_id:
+        # El índice es de cada worker: sin video_id no hay forma de cargar lo que obtuvieron los demás
+        respuesta['alcance'] = 'worker'
+        respuesta['nota'] = ('Sin video_id solo se busca en las transcripciones que obtuvo o sirvió este worker; '
+                             'con varios workers el resultado puede variar entre peticiones')
+    return jsonify(respuesta)
+
+# Etiquetas, líneas de tiempo VTT y números de cue en una sola pasada
+_PATRON_RUIDO_SUBTITULOS = re.compile(
+    r'<[^>]+>|\d{2}:\d{2}:\d{2}\.\d{3}\s*-->\s*\d{2}:\d{2}:\d{2}\.\d{3}|^\d+\s*$',
+    re.MULTILINE
+)
+
 def limpiar_texto_subtitulos(texto):
     """Limpia el texto de subtítulos removiendo etiquetas y formatos"""
-    # Remueve etiquetas HTML/XML
-    texto = re.sub(r'<[^>]+>', '', texto)
-    # Remueve timestamps (formato 00:00:00.000)
-    texto = re.sub(r'\d{2}:\d{2}:\d{2}\.\d{3}\s*-->\s*\d{2}:\d{2}:\d{2}\.\d{3}', '', texto)
-    # Remueve números de línea
-    texto = re.sub(r'^\d+\s*$', '', texto, flags=re.MULTILINE)
-    # Remueve líneas vacías múltiples
-    texto = re.sub(r'\n\s*\n+', '\n', texto)
-    # Remueve espacios múltiples
-    texto = re.sub(r'\s+', ' ', texto)
-    return texto.strip()
+    texto = _PATRON_RUIDO_SUBTITULOS.sub(' ', texto)
+    # Colapsa saltos de línea y espacios múltiples
+    return ' '.join(texto.split())
 
-def parsear_json3(data):
-    """Parsea formato JSON3 de YouTube"""
-    try:
-        json_data = json.loads(data)
+class Transcripcion:
+    """Segmentos de subtítulos en forma compacta
+    
+    Guarda inicios y duraciones en arrays paralelos de floats y todo el texto
+    en un único buffer con offsets, así el texto plano no requiere copias y
+    SRT/VTT se generan sin volver a parsear el documento original.
+    """
+    
+    __slots__ = ('inicios', 'duraciones', 'offsets', '_partes', '_largo')
+    
+    def __init__(self):
+        self.inicios = array('d')
+        self.duraciones = array('d')
+        self.offsets = array('I')  # posición donde empieza cada segmento; 'I' mide 4 bytes en todas las plataformas
+        self._partes = []
+        self._largo = 0
+    
+    def agregar(self, inicio, duracion, texto):
+        texto = ' '.join(texto.split())
+        if not texto:
+            return
+        if self._largo:
+            self._partes.append(' ')
+            self._largo += 1
+        self.inicios.append(inicio)
+        self.duraciones.append(duracion)
+        self.offsets.append(self._largo)
+        self._partes.append(texto)
+        self._largo += len(texto)
+    
+    def texto_plano(self):
+        # Une las partes pendientes una sola vez
+        if len(self._partes) > 1:
+            self._partes = [''.join(self._partes)]
+        return self._partes[0] if self._partes else ''
+    
+    def __len__(self):
+        return len(self.inicios)
+    
+    def __iter__(self):
+        buffer = self.texto_plano()
+        total = len(self.offsets)
+        for i in range(total):
+            fin = self.offsets[i + 1] - 1 if i + 1 < total else len(buffer)
+            yield self.inicios[i], self.duraciones[i], buffer[self.offsets[i]:fin]
+    
+    def segmentos(self):
+        return [
+            {'inicio': round(inicio, 3), 'duracion': round(duracion, 3), 'texto': texto}
+            for inicio, duracion, texto in self
+        ]
+    
+    def huella(self):
+        """Hash del texto y los tiempos, para ETag"""
+        h = hashlib.blake2b(self.texto_plano().encode('utf-8'), digest_size=16)
+        h.update(self.inicios.tobytes())
+        h.update(self.duraciones.tobytes())
+        return h.hexdigest()
+    
+    def _bloques(self, separador_ms, cabecera, numerar):
+        def marca(segundos):
+            ms = int(round(segundos * 1000))
+            horas, ms = divmod(ms, 3600000)
+            minutos, ms = divmod(ms, 60000)
+            seg, ms = divmod(ms, 1000)
+            return f"{horas:02d}:{minutos:02d}:{seg:02d}{separador_ms}{ms:03d}"
+        
+        if cabecera:
+            yield cabecera
+        for i, (inicio, duracion, texto) in enumerate(self, 1):
+            numero = f"{i}\n" if numerar else ''
+            yield f"{numero}{marca(inicio)} --> {marca(inicio + duracion)}\n{texto}\n"
+    
+    def iterar_srt(self):
+        return self._bloques(',', None, True)
+    
+    def iterar_vtt(self):
+        return self._bloques('.', 'WEBVTT\n', False)
+    
+    def a_srt(self):
+        return '\n'.join(self.iterar_srt())
+    
+    def a_vtt(self):
+        return '\n'.join(self.iterar_vtt())
+    
+    def a_dict(self):
+        """Forma serializable (JSON) y compacta para la cache: los arrays van como bytes en base64"""
+        return {
+            'inicios': base64.b64encode(self.inicios.tobytes()).decode('ascii'),
+            'duraciones': base64.b64encode(self.duraciones.tobytes()).decode('ascii'),
+            'offsets': base64.b64encode(self.offsets.tobytes()).decode('ascii'),
+            'texto': self.texto_plano(),
+        }
+    
+    @classmethod
+    def desde_dict(cls, datos):
+        transcripcion = cls()
+        for nombre in ('inicios', 'duraciones', 'offsets'):
+            valores = datos[nombre]
+            arreglo = getattr(transcripcion, nombre)
+            if isinstance(valores, str):
+                arreglo.frombytes(base64.b64decode(valores))
+            else:
+                arreglo.extend(valores)  # entradas guardadas como listas antes del formato binario
+        transcripcion._partes = [datos['texto']] if datos['texto'] else []
+        transcripcion._largo = len(datos['texto'])
+        return transcripcion
+    
+    @classmethod
+    def desde_texto(cls, texto):
+        """Transcripción de un solo segmento cuando el origen no trae tiempos"""
+        transcripcion = cls()
+        transcripcion.agregar(0.0, 0.0, texto)
+        return transcripcion
+
+TAMAÑO_CHUNK = 64 * 1024
+
+def _chunks_texto(chunks):
+    """Normaliza la entrada de los parsers: str, bytes o iterable de chunks → chunks str"""
+    if isinstance(chunks, (str, bytes)):
+        chunks = [chunks]
+    decodificador = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    for chunk in chunks:
+        if isinstance(chunk, bytes):
+            chunk = decodificador.decode(chunk)
+        if chunk:
+            yield chunk
+    resto = decodificador.decode(b'', final=True)
+    if resto:
+        yield resto
+
+def _limpiar_segmento(texto):
+    if '<' in texto:
+        texto = re.sub(r'<[^>]+>', '', texto)
+    return texto
+
+def _segmento_json3(evento):
+    inicio = evento.get('tStartMs', 0) / 1000
+    duracion = evento.get('dDurationMs', 0) / 1000
+    # Estructura con segs
+    if 'segs' in evento:
+        return inicio, duracion, ''.join(seg.get('utf8', '') for seg in evento['segs'])
+    # Estructura directa con texto
+    if 'text' in evento:
+        return inicio, duracion, evento['text']
+    return None
+
+def iterar_segmentos_json3(chunks):
+    """Tokenizador incremental de JSON3: decodifica los eventos uno a uno a medida que llegan"""
+    decodificador = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    en_events = False
+    encontrado = False
+    
+    for chunk in _chunks_texto(chunks):
+        buffer = buffer[pos:] + chunk if encontrado else buffer + chunk
+        pos = 0
+        
+        if not en_events:
+            if encontrado:
+                continue  # ya se cerró el array de eventos
+            i = buffer.find('"events"')
+            j = buffer.find('[', i) if i >= 0 else -1
+            if j < 0:
+                continue
+            pos = j + 1
+            en_events = encontrado = True
+        
+        while True:
+            # Salta separadores entre eventos
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if buffer[pos] == ']':
+                en_events = False
+                break
+            try:
+                evento, pos = decodificador.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break  # evento incompleto, espera el siguiente chunk
+            segmento = _segmento_json3(evento) if isinstance(evento, dict) else None
+            if segmento is not None:
+                yield segmento
+    
+    # Sin array de eventos: recorre el documento completo buscando texto (sin tiempos)
+    if not encontrado and buffer.strip():
         textos = []
         
-        # Intenta diferentes estructuras de JSON3
-        if 'events' in json_data:
-            for event in json_data.get('events', []):
-                # Estructura con segs
-                if 'segs' in event:
-                    for seg in event['segs']:
-                        if 'utf8' in seg:
-                            textos.append(seg['utf8'])
-                # Estructura directa con texto
-                elif 'text' in event:
-                    textos.append(event['text'])
-        
-        # Si no encontró nada, busca recursivamente
-        if not textos:
-            def extraer_texto_recursivo(obj):
-                if isinstance(obj, dict):
-                    for key, value in obj.items():
-                        if key in ['utf8', 'text', 'simpleText']:
-                            if isinstance(value, str):
-                                textos.append(value)
-                        else:
-                            extraer_texto_recursivo(value)
-                elif isinstance(obj, list):
-                    for item in obj:
-                        extraer_texto_recursivo(item)
-            
-            extraer_texto_recursivo(json_data)
+        def extraer_texto_recursivo(obj):
+            if isinstance(obj, dict):
+                for key, value in obj.items():
+                    if key in ['utf8', 'text', 'simpleText']:
+                        if isinstance(value, str):
+                            textos.append(value)
+                    else:
+                        extraer_texto_recursivo(value)
+            elif isinstance(obj, list):
+                for item in obj:
+                    extraer_texto_recursivo(item)
         
-        texto_final = ' '.join(textos)
-        # Limpia caracteres especiales de YouTube
-        texto_final = texto_final.replace('\n', ' ')
-        texto_final = re.sub(r'\s+', ' ', texto_final)
-        return texto_final.strip()
+        extraer_texto_recursivo(json.loads(buffer))
+        yield 0.0, 0.0, ' '.join(textos)
+
+class ParserSrv3:
+    """Parser incremental (XMLPullParser) de timedtext XML: srv1 (<text start dur>) o srv3 (<p t d>)
+    
+    Recibe los chunks a medida que llegan (alimentar) y devuelve los
+    segmentos que ya se completaron; sirve tanto para iterar_segmentos_srv3
+    como para el modo ASGI, que no puede entregarle un iterador bloqueante.
+    """
+    
+    def __init__(self):
+        self._parser = ET.XMLPullParser(events=('start', 'end'))
+        self._pila = []
+        self._decodificador = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    
+    def alimentar(self, chunk):
+        if isinstance(chunk, bytes):
+            chunk = self._decodificador.decode(chunk)
+        if chunk:
+            self._parser.feed(chunk)
+        return list(self._segmentos())
+    
+    def cerrar(self):
+        resto = self._decodificador.decode(b'', final=True)
+        if resto:
+            self._parser.feed(resto)
+        segmentos = list(self._segmentos())
+        self._parser.close()
+        return segmentos
+    
+    def _segmentos(self):
+        for evento, elem in self._parser.read_events():
+            if evento == 'start':
+                self._pila.append(elem)
+                continue
+            self._pila.pop()
+            if elem.tag == 'text':
+                inicio = float(elem.get('start', 0))
+                duracion = float(elem.get('dur', 0))
+            elif elem.tag == 'p':
+                inicio = int(elem.get('t', 0)) / 1000
+                duracion = int(elem.get('d', 0)) / 1000
+            else:
+                continue
+            # srv1 trae entidades HTML escapadas dos veces (&amp;#39;)
+            yield inicio, duracion, _limpiar_segmento(html.unescape(''.join(elem.itertext())))
+            # Suelta el elemento ya procesado para no acumular el árbol entero
+            if self._pila:
+                self._pila[-1].remove(elem)
+
+def iterar_segmentos_srv3(chunks):
+    """Segmentos de timedtext XML a medida que se leen los chunks"""
+    parser = ParserSrv3()
+    for chunk in _chunks_texto(chunks):
+        yield from parser.alimentar(chunk)
+    yield from parser.cerrar()
+
+def _segundos_vtt(marca):
+    """Convierte 'HH:MM:SS.mmm' o 'MM:SS.mmm' a segundos"""
+    segundos = 0.0
+    for parte in marca.replace(',', '.').split(':'):
+        segundos = segundos * 60 + float(parte)
+    return segundos
+
+def iterar_segmentos_vtt(chunks):
+    """Parser VTT línea a línea: emite cada cue al encontrar la línea vacía que lo cierra"""
+    resto = ''
+    cue = None  # (inicio, fin, líneas de texto)
+    
+    def cerrar(cue):
+        inicio, fin, lineas = cue
+        texto = _limpiar_segmento(' '.join(lineas))
+        return inicio, max(fin - inicio, 0.0), html.unescape(texto)
+    
+    for chunk in _chunks_texto(chunks):
+        lineas = (resto + chunk).split('\n')
+        resto = lineas.pop()
+        for linea in lineas:
+            linea = linea.strip()
+            if '-->' in linea:
+                if cue is not None:
+                    yield cerrar(cue)
+                inicio, fin = linea.split('-->', 1)
+                cue = (_segundos_vtt(inicio.strip()), _segundos_vtt(fin.split()[0]), [])
+            elif not linea:
+                if cue is not None:
+                    yield cerrar(cue)
+                cue = None
+            elif cue is not None:
+                cue[2].append(linea)
+    
+    if resto.strip() and cue is not None:
+        cue[2].append(resto.strip())
+    if cue is not None:
+        yield cerrar(cue)
+
+def construir_transcripcion(segmentos):
+    transcripcion = Transcripcion()
+    for inicio, duracion, texto in segmentos:
+        transcripcion.agregar(inicio, duracion, texto)
+    return transcripcion
+
+def parsear_medido(formato, iterar_segmentos, data):
+    """Parsea registrando bytes recibidos y tiempo de parseo sin contar la espera de la red"""
+    medicion = {'espera': 0.0, 'bytes': 0}
+    
+    def fuente():
+        chunks = iter([data] if isinstance(data, (str, bytes)) else data)
+        while True:
+            inicio = time.monotonic()
+            chunk = next(chunks, None)
+            medicion['espera'] += time.monotonic() - inicio
+            if chunk is None:
+                return
+            medicion['bytes'] += len(chunk)
+            yield chunk
+    
+    inicio = time.monotonic()
+    transcripcion = construir_transcripcion(iterar_segmentos(fuente()))
+    registrar_parseo(formato, time.monotonic() - inicio - medicion['espera'], medicion['bytes'])
+    return transcripcion
+
+def registrar_parseo(formato, duracion, recibidos):
+    metricas.observar('transcripciones_parseo_duracion_segundos', duracion, formato=formato)
+    metricas.observar('transcripciones_descarga_bytes', recibidos, formato=formato)
+
+def parsear_json3(data):
+    """Parsea formato JSON3 de YouTube (str, bytes o iterable de chunks)"""
+    try:
+        return parsear_medido('json3', iterar_segmentos_json3, data)
+    except requests.RequestException:
+        raise  # la descarga falló a mitad del cuerpo: es un error de red, no un documento inválido
     except Exception as e:
-        print(f"❌ Error parseando JSON3: {e}")
+        log.warning('Error parseando JSON3: %s', e)
         return None
 
 def parsear_srv3(data):
-    """Parsea formato SRV3 (XML) de YouTube"""
+    """Parsea formato timedtext XML de YouTube (str, bytes o iterable de chunks)"""
     try:
-        # Extrae texto entre tags <text>
-        textos = re.findall(r'<text[^>]*>(.*?)</text>', data, re.DOTALL)
-        texto_limpio = ' '.join(textos)
-        return limpiar_texto_subtitulos(texto_limpio)
-    except:
+        return parsear_medido('srv3', iterar_segmentos_srv3, data)
+    except requests.RequestException:
+        raise
+    except Exception as e:
+        log.debug('Error parseando XML de subtítulos: %s', e)
         return None
 
 def parsear_vtt(data):
-    """Parsea formato VTT"""
+    """Parsea formato VTT (str, bytes o iterable de chunks)"""
     try:
-        # Remueve header WEBVTT
-        texto = re.sub(r'^WEBVTT.*?\n\n', '', data, flags=re.DOTALL)
-        return limpiar_texto_subtitulos(texto)
-    except:
+        return parsear_medido('vtt', iterar_segmentos_vtt, data)
+    except requests.RequestException:
+        raise
+    except Exception as e:
+        log.debug('Error parseando VTT: %s', e)
         return None
 
+# Parser según la extensión que informa yt-dlp para cada pista
+PARSERS_POR_FORMATO = {
+    'json3': parsear_json3,
+    'srv1': parsear_srv3,
+    'srv2': parsear_srv3,
+    'srv3': parsear_srv3,
+    'vtt': parsear_vtt,
+}
+
 @app.route('/transcript')
 def obtener_transcripcion():
     video_id = request.args.get('video_id')
@@ -315,196 +2152,1338 @@ def obtener_transcripcion():
         }), 400
     
     try:
-        print(f"📹 Obteniendo transcripción de: {video_id}")
-             
-        # Intenta método directo primero
-        print("🔄 Intentando método directo de API...")
-        texto_directo, idioma, nombre_idioma = obtener_subtitulos_directo(video_id)
-        
-        # Si el método directo detecta bloqueo de Google
-        if texto_directo and 'sorry' in texto_directo.lower():
-            print("⚠️ Google bloqueó el método directo, intentando RapidAPI...")
-            texto_directo = None
-        
-        # Si falló el método directo, intenta RapidAPI
-        if not texto_directo or len(texto_directo) < 50:
-            texto_rapid, idioma_rapid, metodo_rapid = obtener_subtitulos_rapidapi(video_id)
-            if texto_rapid and len(texto_rapid) > 50:
-                print(f"✅ Subtítulos obtenidos vía RapidAPI: {len(texto_rapid)} caracteres")
-                return jsonify({
-                    'exito': True,
-                    'video_id': video_id,
-                    'transcripcion': texto_rapid,
-                    'total_caracteres': len(texto_rapid),
-                    'tipo_subtitulos': 'API externa',
-                    'idioma': idioma_rapid,
-                    'metodo': metodo_rapid
-                })
-        
-        # Si el método directo funcionó
-        if texto_directo and len(texto_directo) > 50:
-            print(f"✅ Subtítulos obtenidos directamente: {len(texto_directo)} caracteres")
-            return jsonify({
-                'exito': True,
-                'video_id': video_id,
-                'transcripcion': texto_directo,
-                'total_caracteres': len(texto_directo),
-                'tipo_subtitulos': 'API directa',
-                'idioma': idioma,
-                'metodo': 'youtube_api_timedtext'
-            })
-        
-        print("⚠️ Método directo falló, intentando con yt-dlp...")
-        
-        # Continúa con yt-dlp
-        url = f"https://www.youtube.com/watch?v={video_id}"
-        
-        # Configuración mejorada
-        ydl_opts = {
-            'skip_download': True,
-            'writesubtitles': True,
-            'writeautomaticsub': True,
-            'subtitleslangs': ['es', 'es-ES', 'es-MX', 'es-419'],
-            'quiet': False,
-            'no_warnings': False,
-            'extractor_args': {
-                'youtube': {
-                    'player_client': ['android', 'web'],
-                    'skip': ['hls', 'dash']
-                }
-            }
-        }
+        config = leer_config_estrategia(request.args)
+    except ValueError as error:
+        return jsonify({
+            'exito': False,
+            'error': str(error)
+        }), 400
+    
+    formato = request.args.get('format', 'text')
+    if formato not in FORMATOS_RESPUESTA:
+        return jsonify({
+            'exito': False,
+            'error': f"format debe ser uno de: {', '.join(FORMATOS_RESPUESTA)}"
+        }), 400
+    
+    if 'langs' in request.args:
+        return obtener_transcripcion_multiidioma(video_id, config, formato)
+    
+    entrada, estado_cache = entrada_resuelta(video_id, config) or obtener_entrada(video_id, config)
+    
+    if entrada['status'] == 200:
+        # Cada formato es una representación distinta del mismo contenido
+        etag = f"{huella_de_entrada(entrada)}-{formato}"
+        if request.if_none_match.contains_weak(etag):
+            respuesta = Response(status=304)
+        else:
+            respuesta = respuesta_transcripcion(entrada, formato, request.args.get('stream') == '1')
+        respuesta.set_etag(etag, weak=True)
+    else:
+        respuesta = jsonify(payload_de_entrada(entrada))
+        respuesta.status_code = entrada['status']
+    
+    respuesta.headers['X-Cache'] = estado_cache
+    return respuesta
+
+def respuesta_transcripcion(entrada, formato, en_flujo=False):
+    """Respuesta para una entrada válida; en_flujo envía segments/srt/vtt por partes"""
+    if formato in ('srt', 'vtt'):
+        transcripcion = transcripcion_de_entrada(entrada)
+        bloques = transcripcion.iterar_srt() if formato == 'srt' else transcripcion.iterar_vtt()
+        mimetype = 'application/x-subrip' if formato == 'srt' else 'text/vtt'
+        if en_flujo:
+            partes = (bloque if i == 0 else '\n' + bloque for i, bloque in enumerate(bloques))
+            return Response(agrupar_texto(partes), mimetype=mimetype)
+        return Response('\n'.join(bloques), mimetype=mimetype)
+    
+    payload = payload_de_entrada(entrada)
+    if formato == 'segments':
+        if en_flujo:
+            partes = segmentos_json_en_flujo(payload, transcripcion_de_entrada(entrada))
+            return Response(agrupar_texto(partes), mimetype='application/json')
+        payload['segmentos'] = transcripcion_de_entrada(entrada).segmentos()
+    return jsonify(payload)
+
+def segmentos_json_en_flujo(payload, transcripcion):
+    """El mismo documento que format=segments, serializado segmento a segmento"""
+    cabecera = json.dumps(payload, ensure_ascii=False)
+    yield cabecera[:-1] + ', "segmentos": ['
+    for i, (inicio, duracion, texto) in enumerate(transcripcion):
+        segmento = json.dumps({'inicio': round(inicio, 3), 'duracion': round(duracion, 3), 'texto': texto},
+                              ensure_ascii=False)
+        yield segmento if i == 0 else ', ' + segmento
+    yield ']}'
+
+def agrupar_texto(partes, tamaño=TAMAÑO_CHUNK):
+    """Junta partes pequeñas en chunks de ~tamaño caracteres para no escribir al socket por cada segmento"""
+    lote = []
+    largo = 0
+    for parte in partes:
+        lote.append(parte)
+        largo += len(parte)
+        if largo >= tamaño:
+            yield ''.join(lote)
+            lote = []
+            largo = 0
+    if lote:
+        yield ''.join(lote)
+
+def obtener_transcripcion_multiidioma(video_id, config, formato):
+    """Varios idiomas en una respuesta: cada uno se descarga en paralelo y se cachea por separado
+    
+    Las pistas se descubren una sola vez: las descargas comparten el índice
+    de pistas del video y la extracción en curso, si la hay.
+    """
+    try:
+        idiomas = leer_idiomas(request.args.get('langs'), 'langs')
+    except ValueError as error:
+        return jsonify({'exito': False, 'error': str(error)}), 400
+    
+    if formato not in ('text', 'segments'):
+        return jsonify({
+            'exito': False,
+            'error': 'Con langs solo se admite format=text|segments'
+        }), 400
+    
+    configs = {idioma: dict(config, idiomas=[idioma]) for idioma in idiomas}
+    resueltas = {idioma: entrada_resuelta(video_id, c) for idioma, c in configs.items()}
+    futuros = {
+        idioma: enviar_con_contexto(ejecutor_lotes, obtener_entrada, video_id, c)
+        for idioma, c in configs.items() if resueltas[idioma] is None
+    }
+    resultados = {}
+    estados_cache = []
+    for idioma in idiomas:
+        entrada, estado_cache = resueltas[idioma] or futuros[idioma].result()
+        payload = payload_de_entrada(entrada)
+        if entrada['status'] == 200 and formato == 'segments':
+            payload['segmentos'] = transcripcion_de_entrada(entrada).segmentos()
+        payload['status'] = entrada['status']
+        resultados[idioma] = payload
+        estados_cache.append(f'{idioma}={estado_cache}')
+    
+    encontrados = [i for i, p in resultados.items() if p['status'] == 200]
+    respuesta = jsonify({
+        'exito': bool(encontrados),
+        'video_id': video_id,
+        'idiomas_encontrados': encontrados,
+        'idiomas': resultados
+    })
+    respuesta.status_code = 200 if encontrados else next(iter(resultados.values()))['status']
+    respuesta.headers['X-Cache'] = ', '.join(estados_cache)
+    return respuesta
+
+@app.route('/transcripts', methods=['POST'])
+def obtener_transcripciones_lote():
+    try:
+        video_ids, config = leer_lote(request.get_json(silent=True))
+    except ValueError as error:
+        return jsonify({
+            'exito': False,
+            'error': str(error)
+        }), 400
+    
+    trace_id = trace_id_actual.get()
+    
+    def generar():
+        # El generador corre después de que Flask cerró la petición
+        trace_id_actual.set(trace_id)
+        futuros = {enviar_con_contexto(ejecutor_lotes, obtener_entrada, v, config): v for v in video_ids}
+        try:
+            for futuro in as_completed(futuros):
+                try:
+                    payload = payload_de_entrada(futuro.result()[0])
+                except Exception as error:
+                    payload = payload_de_error(error, futuros[futuro])
+                yield json.dumps(payload, ensure_ascii=False) + '\n'
+        finally:
+            # Si el cliente se desconecta, no sigas trabajando para nadie
+            for futuro in futuros:
+                futuro.cancel()
+    
+    return Response(generar(), mimetype='application/x-ndjson')
+
+def leer_lote(datos):
+    """Valida el cuerpo de /transcripts; devuelve (video_ids sin duplicados, config) o lanza ValueError"""
+    video_ids = datos.get('video_ids') if isinstance(datos, dict) else datos
+    
+    if not isinstance(video_ids, list) or not video_ids:
+        raise ValueError('Necesitas proporcionar una lista video_ids')
+    
+    if len(video_ids) > BATCH_MAX_VIDEOS:
+        raise ValueError(f'Máximo {BATCH_MAX_VIDEOS} videos por lote')
+    
+    config = leer_config_estrategia({'lang': datos.get('lang')} if isinstance(datos, dict) else None)
+    
+    # Quita duplicados conservando el orden
+    return list(dict.fromkeys(str(v) for v in video_ids if v)), config
+
+def entrada_resuelta(video_id, config):
+    """(entrada, estado_cache) que el servidor ASGI ya resolvió sin bloquear, o None (ver asgi.py)"""
+    resueltas = request.environ.get('transcripciones.entradas')
+    if not resueltas:
+        return None
+    return resueltas.get(clave_cache(video_id, ','.join(config['idiomas'])))
+
+def obtener_entrada(video_id, config=None):
+    """Resuelve un video vía cache + single-flight; devuelve (entrada, estado_cache)
+    
+    La clave incluye la preferencia de idiomas completa, porque el resultado depende de ella.
+    """
+    config = config or leer_config_estrategia()
+    clave = clave_cache(video_id, ','.join(config['idiomas']))
+    puntaje = frecuencias.registrar(clave)
+    entrada = cache_transcripciones.obtener(clave)
+    if entrada is not None:
+        revisar_refresco(video_id, config, clave, puntaje, entrada)
+        indice_busqueda.encolar(entrada)  # puede venir de otro worker por la cache compartida
+        return entrada, 'HIT'
+    
+    (entrada, estado_cache), compartido = coalescedor.ejecutar(
+        clave, lambda: transcribir_y_cachear(video_id, clave, config)
+    )
+    return entrada, 'COALESCED' if compartido else estado_cache
+
+def revisar_refresco(video_id, config, clave, puntaje, entrada):
+    """Stale-while-revalidate: un video popular cerca de expirar se refresca en segundo plano"""
+    if REFRESCO_ACTIVO and puntaje >= REFRESCO_MIN_PUNTAJE and not entrada.get('negativo'):
+        restante = cache_transcripciones.vigencia(clave)
+        if restante is not None and restante < CACHE_TTL * REFRESCO_MARGEN:
+            refrescador.encolar(video_id, config, 'refresco')
+
+def crear_entrada(payload, status, transcripcion=None):
+    """Entrada de cache; el texto se guarda solo dentro de los segmentos para no duplicarlo"""
+    if transcripcion is None:
+        return {'payload': payload, 'status': status}
+    return {
+        'payload': {k: v for k, v in payload.items() if k != 'transcripcion'},
+        'status': status,
+        'segmentos': transcripcion.a_dict(),
+        'huella': transcripcion.huella()
+    }
+
+def payload_de_entrada(entrada):
+    """Payload JSON de una entrada de cache, con el texto plano reconstruido"""
+    if 'segmentos' not in entrada:
+        return dict(entrada['payload'])
+    return dict(entrada['payload'], transcripcion=entrada['segmentos']['texto'])
+
+def huella_de_entrada(entrada):
+    # Entradas guardadas en disco antes de existir la huella
+    return entrada.get('huella') or transcripcion_de_entrada(entrada).huella()
+
+def transcripcion_de_entrada(entrada):
+    if 'segmentos' in entrada:
+        return Transcripcion.desde_dict(entrada['segmentos'])
+    return Transcripcion.desde_texto(entrada['payload'].get('transcripcion', ''))
+
+def transcribir_y_cachear(video_id, clave, config=None):
+    """Obtiene la transcripción y la guarda en cache; devuelve (entrada, estado_cache)"""
+    # Otro hilo u otro worker pudo haberla guardado mientras esperábamos el turno
+    entrada = cache_transcripciones.obtener(clave, contar=False)
+    if entrada is not None:
+        return entrada, 'HIT'
+    
+    payload, status, transcripcion = transcribir(video_id, config)
+    return cachear_resultado(clave, payload, status, transcripcion), 'MISS'
+
+def cachear_resultado(clave, payload, status, transcripcion):
+    entrada = crear_entrada(payload, status, transcripcion)
+    
+    # Solo se cachean respuestas válidas y la ausencia de subtítulos en los idiomas pedidos
+    if status == 200:
+        cache_transcripciones.guardar(clave, entrada, CACHE_TTL)
+        indice_busqueda.encolar(entrada)
+    elif status == 404 and 'idiomas_disponibles' in payload:
+        entrada['negativo'] = True
+        cache_transcripciones.guardar(clave, entrada, CACHE_TTL_NEGATIVO)
+    
+    return entrada
+
+def refrescar_entrada(video_id, clave, config):
+    """Vuelve a obtener una transcripción antes de que expire; un fallo no pisa la entrada vigente"""
+    actual = cache_transcripciones.obtener(clave, contar=False)
+    restante = cache_transcripciones.vigencia(clave)
+    if actual is not None and restante is not None and restante >= CACHE_TTL * REFRESCO_MARGEN:
+        return actual, 'HIT'  # otro hilo u otro worker ya la refrescó
+    
+    # Con su propio presupuesto: ni la cubeta ni el pool de proveedores del tráfico en vivo
+    payload, status, transcripcion = transcribir(video_id, dict(config, refresco=True))
+    if status != 200 and actual is not None:
+        return actual, 'HIT'
+    return cachear_resultado(clave, payload, status, transcripcion), 'MISS'
+
+def parsear_por_contenido(sub_data):
+    """Detecta el formato mirando el contenido cuando yt-dlp no informa uno conocido"""
+    transcripcion = None
+    
+    # Intenta JSON3
+    if 'events' in sub_data or '"events"' in sub_data:
+        transcripcion = parsear_json3(sub_data)
+    
+    # Intenta XML/SRV3
+    if not transcripcion and ('<text' in sub_data or '<?xml' in sub_data):
+        transcripcion = parsear_srv3(sub_data)
+    
+    # Intenta VTT
+    if not transcripcion and 'WEBVTT' in sub_data:
+        transcripcion = parsear_vtt(sub_data)
+    
+    # Limpieza genérica
+    if not transcripcion:
+        transcripcion = Transcripcion.desde_texto(limpiar_texto_subtitulos(sub_data))
+    
+    return transcripcion
+
+def descargar_pista(sub_list, timeout=30):
+    """Descarga y parsea una pista de yt-dlp en una sola pasada; devuelve (transcripcion, muestra)"""
+    # Prefiere datos ya descargados y luego formatos con parser incremental
+    sub_format = next((f for f in sub_list if 'data' in f), None)
+    if sub_format is None:
+        por_formato = {f.get('ext'): f for f in reversed(sub_list)}
+        sub_format = next((por_formato[ext] for ext in PARSERS_POR_FORMATO if ext in por_formato), sub_list[0])
+    
+    parser = PARSERS_POR_FORMATO.get(sub_format.get('ext'))
+    
+    if 'data' in sub_format:
+        datos = sub_format['data']
+        muestra = {'tamaño': len(datos), 'inicio': datos[:200]}
+        return (parser or parsear_por_contenido)(datos) or Transcripcion(), muestra
+    
+    muestra = {'tamaño': 0, 'inicio': None}
+    
+    def medir(chunks):
+        for chunk in chunks:
+            if muestra['inicio'] is None:
+                muestra['inicio'] = chunk[:200].decode('utf-8', 'replace')
+            muestra['tamaño'] += len(chunk)
+            yield chunk
+    
+    with http_get(sub_format['url'], timeout=timeout, stream=True) as response:
+        chunks = medir(response.iter_content(TAMAÑO_CHUNK))
+        if parser is None:
+            # Formato desconocido: hace falta el documento completo para detectarlo
+            return parsear_por_contenido(''.join(_chunks_texto(chunks))), muestra
+        return parser(chunks) or Transcripcion(), muestra
+
+TIPOS_PISTA = {'manuales': 'manual', 'automaticos': 'automático'}
+
+def descargar_primera_pista(indice, idiomas, limite):
+    """Descarga la primera pista del índice según la preferencia de idiomas, antes de limite (time.monotonic())
+    
+    Devuelve (transcripcion, muestra, tipo, idioma) o cuatro None.
+    """
+    error_red = None
+    for clave, lang in pistas_preferidas(indice, idiomas):
+        sub_list = pista_de_indice(indice, clave, lang)
+        if sub_list is None:
+            continue
+        tipo = TIPOS_PISTA[clave]
+        log.debug('Encontrados subtítulos %s en %s', tipo, lang)
+        timeout = tiempo_restante(limite)  # sin tiempo no se prueba la pista siguiente
+        try:
+            transcripcion, muestra = descargar_pista(sub_list, timeout)
+            return transcripcion, muestra, tipo, lang
+        except requests.RequestException as e:
+            log.warning('Error de red con subtítulos %s %s: %s', tipo, lang, e)
+            error_red = e
+        except Exception as e:
+            log.warning('Error con subtítulos %s %s: %s', tipo, lang, e)
+    # Si alguna pista no se pudo descargar, es un fallo del proveedor y no un video sin subtítulos
+    if error_red is not None:
+        raise error_red
+    return None, None, None, None
+
+def obtener_subtitulos_ytdlp(video_id, cancelado=None, idiomas=None, timeout=60):
+    """Obtiene subtítulos con las pistas que descubre yt-dlp; devuelve un Resultado o lanza SinSubtitulos
+    
+    Con un índice de pistas completo y URLs vigentes se omite la extracción.
+    Las descargas de pistas usan lo que quede de timeout tras la extracción.
+    """
+    limite = time.monotonic() + timeout
+    indice = obtener_indice(video_id)
+    desde_indice = bool(indice and indice.get('completo') and urls_vigentes(indice))
+    if not desde_indice:
+        indice = descubrir_pistas_ytdlp(video_id)
+    
+    if cancelado is not None and cancelado.is_set():
+        return None
+    
+    log.debug('Subtítulos manuales disponibles: %s', list(indice['manuales']))
+    log.debug('Subtítulos automáticos disponibles: %s', list(indice['automaticos']))
+    
+    # Busca subtítulos según la preferencia de idiomas
+    idiomas = idiomas or leer_idiomas()
+    transcripcion, muestra, tipo, idioma_usado = descargar_primera_pista(indice, idiomas, limite)
+    
+    # Las URLs del índice pueden haber sido revocadas: una extracción nueva antes de rendirse
+    hay_pistas = next(pistas_preferidas(indice, idiomas), None) is not None
+    if transcripcion is None and desde_indice and hay_pistas:
+        indice = descubrir_pistas_ytdlp(video_id, forzar=True)
+        transcripcion, muestra, tipo, idioma_usado = descargar_primera_pista(indice, idiomas, limite)
+    
+    if transcripcion is None:
+        disponibles = list(indice['manuales']) + list(indice['automaticos'])
+        raise SinSubtitulos(f"No se encontraron subtítulos en los idiomas pedidos ({', '.join(idiomas)})",
+                            idiomas_disponibles=disponibles)
+    
+    log.debug('Datos de subtítulos descargados: %d bytes', muestra['tamaño'])
+    
+    texto = transcripcion.texto_plano()
+    if len(texto) < 10:
+        raise SinSubtitulos('Los subtítulos están vacíos o no se pudieron parsear',
+                            tipo=tipo, debug_tamaño=muestra['tamaño'], debug_inicio=muestra['inicio'])
+    
+    log.info('Transcripción obtenida con yt-dlp (%s, %s): %d caracteres', tipo, idioma_usado, len(texto))
+    return Resultado(transcripcion, idioma_usado, tipo, 'yt-dlp')
+
+class Proveedor(ABC):
+    """Interfaz de los proveedores de subtítulos
+    
+    obtener() devuelve un Resultado, None si no encontró nada (se prueba el
+    siguiente) o lanza ProveedorBloqueado / SinSubtitulos; timeout son los
+    segundos que le quedan para todas sus llamadas HTTP. Cada proveedor
+    tiene su propio tiempo límite dentro de la estrategia y reintenta los
+    errores de red con backoff exponencial mientras le quede tiempo.
+    """
+    
+    nombre = None
+    
+    def __init__(self, timeout=30.0, reintentos=0, espera=0.5):
+        self.timeout = timeout
+        self.reintentos = reintentos
+        self.espera = espera
+    
+    @abstractmethod
+    def obtener(self, video_id, idiomas, cancelado, timeout):
+        """Resultado, None o excepción; ver la docstring de la clase"""
+    
+    def ejecutar(self, video_id, idiomas, cancelado, timeout=None):
+        """obtener() con reintentos ante errores de red dentro de timeout (por defecto el del proveedor)
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            print("🔍 Extrayendo información del video...")
-            info = ydl.extract_info(url, download=False)
-            
-            subtitulos_manuales = info.get('subtitles', {})
-            subtitulos_auto = info.get('automatic_captions', {})
-            
-            print(f"📋 Subtítulos manuales disponibles: {list(subtitulos_manuales.keys())}")
-            print(f"📋 Subtítulos automáticos disponibles: {list(subtitulos_auto.keys())}")
-            
-            # Busca subtítulos en español
-            sub_data = None
-            tipo = None
-            idioma_usado = None
-            
-            idiomas_espanol = ['es', 'es-ES', 'es-MX', 'es-419', 'es-US']
-            
-            # Intenta manuales primero
-            for lang in idiomas_espanol:
-                if lang in subtitulos_manuales:
-                    print(f"✓ Encontrados subtítulos manuales en {lang}")
-                    try:
-                        sub_list = subtitulos_manuales[lang]
-                        # Busca el formato más fácil de parsear
-                        for sub_format in sub_list:
-                            if 'data' in sub_format:
-                                sub_data = sub_format['data']
-                                break
-                        
-                        if not sub_data:
-                            # Descarga manualmente
-                            import requests
-                            sub_url = sub_list[0]['url']
-                            response = requests.get(sub_url, timeout=30)
-                            sub_data = response.text
-                        
-                        tipo = 'manual'
-                        idioma_usado = lang
-                        break
-                    except Exception as e:
-                        print(f"⚠️ Error con subtítulos manuales {lang}: {e}")
+        None si se canceló mientras esperaba; si el reintento no cabe en el
+        tiempo que queda, el error de red es el resultado.
+        """
+        limite = time.monotonic() + (self.timeout if timeout is None else timeout)
+        for intento in range(self.reintentos + 1):
+            try:
+                return self.obtener(video_id, idiomas, cancelado, tiempo_restante(limite))
+            except requests.RequestException as error:
+                if intento == self.reintentos or cancelado.is_set():
+                    raise
+                espera = self.espera_reintento(intento, error)
+                if time.monotonic() + espera >= limite:
+                    raise
+                if cancelado.wait(espera):
+                    return None
+    
+    def espera_reintento(self, intento, error):
+        """Backoff exponencial con jitter antes del reintento número intento + 1"""
+        espera = self.espera * 2 ** intento * random.uniform(0.5, 1.5)
+        log.info('Reintentando %s en %.2f s tras %s', self.nombre, espera, type(error).__name__)
+        return espera
+    
+    def resumen(self):
+        return {'timeout': self.timeout, 'reintentos': self.reintentos, 'espera': self.espera}
+
+class ProveedorTimedtext(Proveedor):
+    nombre = 'timedtext'
+    
+    def obtener(self, video_id, idiomas, cancelado, timeout):
+        transcripcion, idioma, _ = obtener_subtitulos_directo(video_id, cancelado, idiomas, timeout)
+        return self.resultado(transcripcion, idioma)
+    
+    def resultado(self, transcripcion, idioma):
+        # Los bloqueos reales (429 o redirección a /sorry/) ya los detecta verificar_bloqueo_google
+        texto = transcripcion.texto_plano() if transcripcion else ''
+        if len(texto) <= 50:
+            return None
+        
+        log.info('Subtítulos obtenidos directamente: %d caracteres', len(texto))
+        return Resultado(transcripcion, idioma, 'API directa', 'youtube_api_timedtext')
+
+class ProveedorRapidAPI(Proveedor):
+    nombre = 'rapidapi'
+    
+    def obtener(self, video_id, idiomas, cancelado, timeout):
+        return self.resultado(*obtener_subtitulos_rapidapi(video_id, idiomas, timeout))
+    
+    def resultado(self, transcripcion, idioma, metodo):
+        if transcripcion is None:
+            return None
+        
+        log.info('Subtítulos obtenidos vía RapidAPI: %d caracteres', len(transcripcion.texto_plano()))
+        return Resultado(transcripcion, idioma, 'API externa', metodo)
+
+class ProveedorYtdlp(Proveedor):
+    nombre = 'ytdlp'
+    
+    def obtener(self, video_id, idiomas, cancelado, timeout):
+        return obtener_subtitulos_ytdlp(video_id, cancelado, idiomas, timeout)
+
+class ProveedorDirectorio(Proveedor):
+    """Transcripciones ya generadas en disco, p. ej. la salida de Whisper
+    
+    Busca {ruta}/{video_id}.{idioma}.{ext} y luego {ruta}/{video_id}.{ext},
+    con ext json (formato de Whisper), vtt o txt.
+    """
+    
+    nombre = 'whisper'
+    
+    def __init__(self, ruta, timeout=5.0, reintentos=0, espera=0.5, nombre=None):
+        super().__init__(timeout, reintentos, espera)
+        self.ruta = ruta
+        self.nombre = nombre or self.nombre
+    
+    def _leer(self, archivo):
+        with open(archivo, encoding='utf-8') as f:
+            if archivo.endswith('.json'):
+                datos = json.load(f)
+                return construir_transcripcion(
+                    (s['start'], s['end'] - s['start'], s['text']) for s in datos.get('segments', [])
+                ), datos.get('language')
+            if archivo.endswith('.vtt'):
+                return parsear_vtt(f.read()), None
+            return Transcripcion.desde_texto(f.read()), None
+    
+    def obtener(self, video_id, idiomas, cancelado, timeout):
+        # El video_id viene del cliente: nada de rutas relativas
+        if not re.fullmatch(r'[\w-]+', video_id):
+            return None
+        for idioma in idiomas:
+            for sufijo in (f'.{idioma}', ''):
+                for ext in ('json', 'vtt', 'txt'):
+                    archivo = os.path.join(self.ruta, f'{video_id}{sufijo}.{ext}')
+                    if not os.path.exists(archivo):
                         continue
-            
-            # Si no hay manuales, intenta automáticos
-            if not sub_data:
-                for lang in idiomas_espanol:
-                    if lang in subtitulos_auto:
-                        print(f"✓ Encontrados subtítulos automáticos en {lang}")
-                        try:
-                            sub_list = subtitulos_auto[lang]
-                            
-                            if 'data' in sub_list[0]:
-                                sub_data = sub_list[0]['data']
-                            else:
-                                import requests
-                                sub_url = sub_list[0]['url']
-                                response = requests.get(sub_url, timeout=30)
-                                sub_data = response.text
-                            
-                            tipo = 'automático'
-                            idioma_usado = lang
-                            break
-                        except Exception as e:
-                            print(f"⚠️ Error con subtítulos automáticos {lang}: {e}")
-                            continue
-            
-            if not sub_data:
-                disponibles = list(subtitulos_manuales.keys()) + list(subtitulos_auto.keys())
-                return jsonify({
-                    'exito': False,
-                    'error': 'No se encontraron subtítulos en español',
-                    'video_id': video_id,
-                    'idiomas_disponibles': disponibles
-                }), 404
-            
-            print(f"📄 Datos de subtítulos descargados: {len(sub_data)} bytes")
-            
-            # Parsea el texto
-            texto = None
-            
-            # Intenta JSON3
-            if 'events' in sub_data or '"events"' in sub_data:
-                texto = parsear_json3(sub_data)
-            
-            # Intenta XML/SRV3
-            if not texto and ('<text' in sub_data or '<?xml' in sub_data):
-                texto = parsear_srv3(sub_data)
-            
-            # Intenta VTT
-            if not texto and 'WEBVTT' in sub_data:
-                texto = parsear_vtt(sub_data)
-            
-            # Limpieza genérica
-            if not texto:
-                texto = limpiar_texto_subtitulos(sub_data)
-            
-            if not texto or len(texto) < 10:
-                return jsonify({
-                    'exito': False,
-                    'error': 'Los subtítulos están vacíos o no se pudieron parsear',
-                    'video_id': video_id,
-                    'tipo': tipo,
-                    'debug_tamaño': len(sub_data),
-                    'debug_inicio': sub_data[:200] if sub_data else None
-                }), 404
-            
-            print(f"✅ Transcripción obtenida ({tipo}, {idioma_usado}): {len(texto)} caracteres")
-            
-            return jsonify({
-                'exito': True,
-                'video_id': video_id,
-                'transcripcion': texto,
-                'total_caracteres': len(texto),
-                'tipo_subtitulos': tipo,
-                'idioma': idioma_usado
-            })
+                    transcripcion, idioma_archivo = self._leer(archivo)
+                    idioma_archivo = idioma_archivo or (idioma if sufijo else None)
+                    # Un archivo sin idioma en el nombre solo sirve si su contenido coincide
+                    if idioma_archivo and idioma_base(idioma_archivo) != idioma_base(idioma):
+                        continue
+                    if transcripcion:
+                        return Resultado(transcripcion, idioma_archivo or idioma, 'local', self.nombre)
+        return None
+
+class CubetaTokens:
+    """Token bucket con tasa adaptativa: se reduce a la mitad ante bloqueos y se recupera de a poco"""
+    
+    def __init__(self, tasa, rafaga):
+        self.tasa_max = tasa
+        self.tasa = tasa
+        self.rafaga = max(rafaga, 1.0)
+        self.tokens = self.rafaga
+        self._ultima = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def tomar(self):
+        """Consume un token sin esperar; False si el proveedor está por encima de su tasa"""
+        if self.tasa_max <= 0:
+            return True
+        with self._lock:
+            ahora = time.monotonic()
+            self.tokens = min(self.rafaga, self.tokens + (ahora - self._ultima) * self.tasa)
+            self._ultima = ahora
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+    
+    def reservar(self, espera_max):
+        """Reserva el próximo token; devuelve los segundos a esperar para usarlo o None si superan espera_max
         
+        Los tokens reservados se descuentan ya (el saldo puede quedar negativo),
+        así cada petición que espera recibe su propio turno.
+        """
+        if self.tasa_max <= 0:
+            return 0.0
+        with self._lock:
+            ahora = time.monotonic()
+            self.tokens = min(self.rafaga, self.tokens + (ahora - self._ultima) * self.tasa)
+            self._ultima = ahora
+            espera = max(0.0, (1 - self.tokens) / self.tasa)
+            if espera > espera_max:
+                return None
+            self.tokens -= 1
+            return espera
+    
+    def devolver(self):
+        """Devuelve un token reservado que no se llegó a usar"""
+        if self.tasa_max <= 0:
+            return
+        with self._lock:
+            self.tokens = min(self.rafaga, self.tokens + 1)
+    
+    def reducir(self):
+        with self._lock:
+            self.tasa = max(self.tasa / 2, self.tasa_max / 32)
+    
+    def recuperar(self):
+        with self._lock:
+            self.tasa = min(self.tasa_max, self.tasa + self.tasa_max / 20)
+    
+    def resumen(self):
+        with self._lock:
+            return {
+                'tasa': round(self.tasa, 3),
+                'tasa_max': self.tasa_max,
+                'rafaga': self.rafaga,
+                # Negativo: turnos ya reservados por peticiones que esperan
+                'tokens': round(min(self.rafaga, self.tokens + (time.monotonic() - self._ultima) * self.tasa), 2),
+            }
+
+ESTADOS_INTERRUPTOR = ('cerrado', 'semiabierto', 'abierto')
+
+class Interruptor:
+    """Circuit breaker: cerrado → abierto (por bloqueo o fallos seguidos) → semiabierto con una sonda"""
+    
+    def __init__(self, umbral, enfriamiento, enfriamiento_max):
+        self.umbral = umbral
+        self.enfriamiento_base = enfriamiento
+        self.enfriamiento_max = enfriamiento_max
+        self.enfriamiento = enfriamiento
+        self.estado = 'cerrado'
+        self.fallos_seguidos = 0
+        self.aperturas = 0
+        self.motivo = None
+        self._abierto_hasta = 0.0
+        self._sonda_en_curso = False
+        self._lock = threading.Lock()
+    
+    def permitir(self):
+        with self._lock:
+            if self.estado == 'cerrado':
+                return True
+            if self.estado == 'abierto':
+                if time.monotonic() < self._abierto_hasta:
+                    return False
+                self.estado = 'semiabierto'
+            # Semiabierto: deja pasar una sola petición de prueba
+            if self._sonda_en_curso:
+                return False
+            self._sonda_en_curso = True
+            return True
+    
+    def _abrir(self, motivo):
+        if self.estado == 'semiabierto':
+            self.enfriamiento = min(self.enfriamiento * 2, self.enfriamiento_max)
+        self.estado = 'abierto'
+        self.motivo = motivo
+        self.aperturas += 1
+        self._abierto_hasta = time.monotonic() + self.enfriamiento
+        self._sonda_en_curso = False
+    
+    def registrar_exito(self):
+        with self._lock:
+            self.estado = 'cerrado'
+            self.fallos_seguidos = 0
+            self.enfriamiento = self.enfriamiento_base
+            self.motivo = None
+            self._sonda_en_curso = False
+    
+    def registrar_fallo(self, motivo, bloqueo=False):
+        """Devuelve True si este fallo abrió el circuito"""
+        with self._lock:
+            self.fallos_seguidos += 1
+            if self.estado == 'abierto':
+                return False
+            if bloqueo or self.estado == 'semiabierto' or self.fallos_seguidos >= self.umbral:
+                self._abrir(motivo)
+                return True
+            return False
+    
+    def registrar_neutro(self):
+        """Resultado que no informa sobre la salud (p. ej. cancelado): libera la sonda"""
+        with self._lock:
+            self._sonda_en_curso = False
+    
+    def reiniciar(self):
+        self.registrar_exito()
+    
+    def resumen(self):
+        with self._lock:
+            return {
+                'estado': self.estado,
+                'fallos_seguidos': self.fallos_seguidos,
+                'aperturas': self.aperturas,
+                'motivo': self.motivo,
+                'reintento_en_segundos': round(max(0.0, self._abierto_hasta - time.monotonic()), 1)
+                    if self.estado == 'abierto' else 0,
+            }
+
+# Proveedores disponibles para la estrategia, por nombre, con su interruptor y limitador
+PROVEEDORES = {}
+INTERRUPTORES = {}
+CUBETAS = {}
+
+def registrar_proveedor(proveedor, posicion=None, concurrencia=None, tasa=None):
+    """Agrega un proveedor a la cadena sin tocar las rutas
+    
+    Queda disponible en ESTRATEGIA_ORDEN y en ?proveedores=, con su propio
+    circuit breaker y token bucket (tasa = (peticiones/s, ráfaga)).
+    """
+    if not isinstance(proveedor, Proveedor) or not proveedor.nombre:
+        raise TypeError(f'{type(proveedor).__name__} no es un Proveedor con nombre')
+    nombre = proveedor.nombre
+    nombres = [n for n in PROVEEDORES if n != nombre]
+    nombres.insert(len(nombres) if posicion is None else posicion, nombre)
+    registrados = dict(PROVEEDORES, **{nombre: proveedor})
+    PROVEEDORES.clear()
+    PROVEEDORES.update((n, registrados[n]) for n in nombres)
+    
+    INTERRUPTORES[nombre] = Interruptor(INTERRUPTOR_UMBRAL, INTERRUPTOR_ENFRIAMIENTO, INTERRUPTOR_ENFRIAMIENTO_MAX)
+    CUBETAS[nombre] = CubetaTokens(*(tasa or TASAS_PROVEEDOR.get(nombre, (0, 1))))
+    if concurrencia is not None:
+        CONCURRENCIA_PROVEEDOR[nombre] = concurrencia
+        LIMITES_PROVEEDOR[nombre] = threading.BoundedSemaphore(concurrencia)
+    return proveedor
+
+registrar_proveedor(ProveedorTimedtext(*POLITICAS_PROVEEDOR['timedtext']))
+registrar_proveedor(ProveedorRapidAPI(*POLITICAS_PROVEEDOR['rapidapi']))
+registrar_proveedor(ProveedorYtdlp(*POLITICAS_PROVEEDOR['ytdlp']))
+if WHISPER_DIR:
+    # Lo local va primero: no cuesta cuota ni latencia de red
+    registrar_proveedor(ProveedorDirectorio(WHISPER_DIR, *POLITICAS_PROVEEDOR['whisper']), posicion=0)
+
+def proveedor_disponible(nombre, espera_max=0.0, limitar=True):
+    """Reserva un turno del proveedor; devuelve (segundos hasta poder arrancar o None, motivo)
+    
+    Solo un circuito abierto lo descarta de inmediato; sin tokens se espera el
+    próximo si llega dentro de espera_max. Con limitar=False (refresco, que
+    tiene su propia cubeta) no se toca la cubeta del tráfico en vivo.
+    """
+    if not INTERRUPTORES[nombre].permitir():
+        return None, 'circuito_abierto'
+    if not limitar:
+        return 0.0, None
+    espera = CUBETAS[nombre].reservar(espera_max)
+    if espera is None:
+        INTERRUPTORES[nombre].registrar_neutro()  # libera la sonda si la había tomado
+        return None, 'limitado'
+    return espera, None
+
+def liberar_proveedor(nombre):
+    """Deshace proveedor_disponible para un turno reservado que no se usó"""
+    CUBETAS[nombre].devolver()
+    INTERRUPTORES[nombre].registrar_neutro()
+
+def registrar_salud(nombre, estado, detalle=None):
+    """Actualiza interruptor y limitador de un proveedor según el resultado de una llamada"""
+    interruptor = INTERRUPTORES[nombre]
+    if estado in ('exito', 'sin_resultado'):
+        interruptor.registrar_exito()
+        CUBETAS[nombre].recuperar()
+    elif estado == 'cancelado':
+        interruptor.registrar_neutro()
+    else:
+        bloqueo = estado == 'bloqueado'
+        if bloqueo:
+            CUBETAS[nombre].reducir()
+        if interruptor.registrar_fallo(detalle or estado, bloqueo=bloqueo):
+            log.warning('Circuito de %s abierto por %s (%s); se reintentará en %.0f s',
+                        nombre, estado, detalle, interruptor.enfriamiento)
+
+def leer_idiomas(valor=None, parametro='lang'):
+    """Lista ordenada de idiomas preferidos a partir de 'es,en' o 'es-MX,es'"""
+    idiomas = list(dict.fromkeys(i.strip() for i in (valor or IDIOMA_POR_DEFECTO).split(',') if i.strip()))
+    if not idiomas or len(idiomas) > IDIOMAS_MAX or not all(PATRON_IDIOMA.match(i) for i in idiomas):
+        raise ValueError(f'{parametro} debe ser una lista de hasta {IDIOMAS_MAX} códigos de idioma separados por comas (ej. es,en)')
+    return idiomas
+
+def leer_config_estrategia(args=None):
+    """Combina la configuración por defecto con los parámetros de la petición"""
+    args = args or {}
+    
+    modo = args.get('estrategia', ESTRATEGIA_MODO)
+    if modo not in MODOS_ESTRATEGIA:
+        raise ValueError(f"estrategia debe ser una de: {', '.join(MODOS_ESTRATEGIA)}")
+    
+    orden = list(dict.fromkeys(
+        p.strip() for p in args.get('proveedores', ESTRATEGIA_ORDEN or ','.join(PROVEEDORES)).split(',') if p.strip()
+    ))
+    desconocidos = [p for p in orden if p not in PROVEEDORES]
+    if not orden or desconocidos:
+        raise ValueError(f"proveedores válidos: {', '.join(PROVEEDORES)}")
+    
+    try:
+        retrasos = [float(r) for r in str(args.get('hedge', ESTRATEGIA_HEDGE)).split(',')]
+        deadline = float(args.get('deadline', ESTRATEGIA_DEADLINE))
+    except ValueError:
+        raise ValueError('hedge y deadline deben ser números (segundos)')
+    if not all(math.isfinite(r) and r >= 0 for r in retrasos):
+        raise ValueError('hedge debe ser un número finito de segundos mayor o igual a 0')
+    if not math.isfinite(deadline) or deadline <= 0:
+        raise ValueError('deadline debe ser un número finito de segundos mayor que 0')
+    # La petición puede acortar el deadline, nunca alargarlo más allá del configurado
+    deadline = min(deadline, ESTRATEGIA_DEADLINE)
+    
+    if modo == 'secuencial':
+        retrasos = [float('inf')]
+    elif modo == 'paralelo':
+        retrasos = [0.0]
+    
+    # El último retraso se repite para el resto de proveedores
+    retrasos = (retrasos + retrasos[-1:] * len(orden))[:len(orden)]
+    idiomas = leer_idiomas(args.get('lang'))
+    return {'modo': modo, 'orden': orden, 'retrasos': retrasos, 'deadline': deadline, 'idiomas': idiomas}
+
+class Cancelacion(threading.Event):
+    """Evento de cancelación de un intento; abandonar() lo marca además como ya contado por tiempo agotado"""
+    
+    abandonado = False
+    
+    def abandonar(self):
+        self.abandonado = True
+        self.set()
+
+def ejecutar_proveedor(nombre, video_id, cancelado, idiomas, timeout=None):
+    """Ejecuta un proveedor y normaliza su salida a (payload, status, transcripcion) o None"""
+    inicio = time.monotonic()
+    try:
+        resultado = PROVEEDORES[nombre].ejecutar(video_id, idiomas, cancelado, timeout)
     except Exception as error:
-        print(f"❌ Error completo: {type(error).__name__}: {str(error)}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({
+        return normalizar_resultado(nombre, video_id, inicio, cancelado, error=error)
+    return normalizar_resultado(nombre, video_id, inicio, cancelado, resultado)
+
+def normalizar_resultado(nombre, video_id, inicio, cancelado, resultado=None, error=None):
+    """Registra salud y métricas de una llamada a un proveedor y normaliza su salida
+    
+    SinSubtitulos se convierte en un 404 y cualquier otra excepción en un 500.
+    Un intento abandonado por tiempo agotado ya quedó registrado como fallo:
+    si termina después no vuelve a tocar el interruptor ni las métricas.
+    """
+    estado = 'error'
+    detalle = None
+    try:
+        if error is not None:
+            raise error
+        if resultado is None:
+            estado = 'cancelado' if cancelado.is_set() else 'sin_resultado'
+            return None
+        estado = 'exito'
+        resultado.duracion = time.monotonic() - inicio
+        return resultado.payload(video_id), 200, resultado.transcripcion
+    except SinSubtitulos as error:
+        estado = 'sin_resultado'
+        return dict({
+            'exito': False,
+            'error': str(error),
+            'video_id': video_id
+        }, **error.detalles), 404, None
+    except ProveedorBloqueado as error:
+        estado = 'bloqueado'
+        detalle = str(error)
+        log.warning('Proveedor %s bloqueado: %s', nombre, error)
+        return None
+    except Exception as error:
+        detalle = f'{type(error).__name__}: {str(error)}'
+        log.exception('Error en proveedor %s: %s: %s', nombre, type(error).__name__, error)
+        return {
             'exito': False,
             'error': f'{type(error).__name__}: {str(error)}',
             'video_id': video_id
-        }), 500
+        }, 500, None
+    finally:
+        duracion = time.monotonic() - inicio
+        if getattr(cancelado, 'abandonado', False):
+            estado = 'abandonado'
+        else:
+            registrar_salud(nombre, estado, detalle)
+            metricas.observar('transcripciones_proveedor_duracion_segundos', duracion, proveedor=nombre)
+            metricas.incrementar('transcripciones_proveedor_resultados_total', proveedor=nombre, resultado=estado)
+        log.debug('Proveedor %s terminó (%s) en %.0f ms', nombre, estado, duracion * 1000,
+                  extra={'campos': {'video_id': video_id, 'proveedor': nombre, 'resultado': estado,
+                                    'duracion_ms': round(duracion * 1000)}})
+
+class Estrategia:
+    """Estado y decisiones de la estrategia de proveedores para un video
+    
+    No crea hilos ni tareas: transcribir (hilos) y asgi.transcribir (asyncio)
+    le preguntan qué proveedor arrancar y cuánto esperar, y le informan lo
+    que termina. Cada proveedor arranca cuando el anterior falla, cuando
+    vence su retraso de hedge o cuando el que está en curso agota su propio
+    tiempo límite; gana el primer resultado válido.
+    """
+    
+    def __init__(self, video_id, config):
+        self.video_id = video_id
+        self.config = config
+        self.pendientes = list(config['orden'])
+        self.retrasos = list(config['retrasos'])
+        self.en_curso = {}  # nombre del proveedor -> instante límite
+        self.fallos = {}  # nombre del proveedor -> (payload, status)
+        self.omitidos = []
+        self.limite = time.monotonic() + config['deadline']
+        self.proximo_inicio = 0.0
+        self.reserva = None  # (nombre, instante) del proveedor que espera un token del limitador
+        self.ganador = None
+        log.info('Obteniendo transcripción de %s [%s] (%s: %s)', video_id, ','.join(config['idiomas']),
+                 config['modo'], ', '.join(config['orden']),
+                 extra={'campos': {'video_id': video_id, 'estrategia': config['modo'], 'idiomas': config['idiomas']}})
+    
+    def vencidos(self, ahora):
+        """Proveedores que agotaron su tiempo límite: se abandonan y cuentan como fallo
+        
+        Los cortados por el deadline de la petición no cuentan: no es culpa del proveedor.
+        """
+        nombres = [nombre for nombre, vence in self.en_curso.items() if ahora >= vence and vence < self.limite]
+        for nombre in nombres:
+            del self.en_curso[nombre]
+            self.fallos[nombre] = fallo_por_tiempo(nombre, self.video_id)
+        return nombres
+    
+    def siguiente(self, ahora):
+        """Proveedor que debe arrancar ya, o None si no toca arrancar ninguno"""
+        if ahora >= self.limite:
+            return None
+        if self.reserva is not None:
+            nombre, inicio = self.reserva
+            if ahora < inicio:
+                return None
+            self.reserva = None
+            return self._arrancar(nombre, ahora)
+        
+        # Arranca el siguiente si no hay nada en curso o si venció el hedge
+        while self.pendientes and (not self.en_curso or ahora >= self.proximo_inicio):
+            nombre = self.pendientes.pop(0)
+            retraso = self.retrasos.pop(0)
+            # Sin token se espera el próximo solo un rato corto si queda otro proveedor al que pasar
+            # (un proveedor limitado no cuesta latencia); el último espera hasta su tiempo límite
+            espera_max = min(self.limite - ahora, PROVEEDORES[nombre].timeout)
+            if self.pendientes:
+                espera_max = min(espera_max, retraso, TASA_ESPERA_MAX)
+            espera = reservar_proveedor(nombre, espera_max, limitar=not self.config.get('refresco'))
+            if espera is None:
+                # Circuito abierto o sin token a tiempo: pasa al siguiente
+                self.omitidos.append(nombre)
+                continue
+            self.proximo_inicio = ahora + espera + retraso
+            if espera > 0:
+                self.reserva = (nombre, ahora + espera)
+                return None
+            return self._arrancar(nombre, ahora)
+        return None
+    
+    def _arrancar(self, nombre, ahora):
+        log.debug('Intentando con %s', nombre)
+        self.en_curso[nombre] = min(ahora + PROVEEDORES[nombre].timeout, self.limite)
+        return nombre
+    
+    def timeout(self, nombre, ahora):
+        """Segundos que tiene un proveedor recién arrancado: su tiempo límite o lo que quede del deadline"""
+        return self.en_curso[nombre] - ahora
+    
+    def espera(self, ahora):
+        """Segundos hasta la próxima decisión, o None si la estrategia terminó"""
+        if ahora >= self.limite or not (self.pendientes or self.en_curso or self.reserva):
+            return None
+        espera = min([self.limite] + list(self.en_curso.values())) - ahora
+        if self.reserva is not None:
+            espera = min(espera, self.reserva[1] - ahora)
+        elif self.pendientes:
+            espera = min(espera, self.proximo_inicio - ahora)
+        return max(espera, 0.0)
+    
+    def terminado(self, nombre, resultado):
+        """Registra lo que devolvió un proveedor; True si es el resultado ganador"""
+        del self.en_curso[nombre]
+        if resultado is not None and resultado[1] == 200:
+            self.ganador = resultado
+            return True
+        if resultado is not None:
+            self.fallos[nombre] = resultado
+        log.info('%s no obtuvo subtítulos', nombre)
+        return False
+    
+    def cerrar(self):
+        """Devuelve el turno reservado que ya no se va a usar"""
+        if self.reserva is not None:
+            liberar_proveedor(self.reserva[0])
+            self.reserva = None
+    
+    def resultado(self):
+        """(payload, status, transcripcion) final"""
+        if self.ganador is not None:
+            return self.ganador
+        return resultado_fallido(self.video_id, self.config, bool(self.pendientes or self.en_curso or self.reserva),
+                                 self.fallos, self.omitidos)
+
+def transcribir(video_id, config=None):
+    """Ejecuta los proveedores según la estrategia y devuelve (payload, status, transcripcion)
+    
+    Los proveedores corren en el pool de proveedores (o en el del refresco si
+    config['refresco']); ganado el resultado se cancela al resto.
+    """
+    plan = Estrategia(video_id, config or leer_config_estrategia())
+    ejecutor = ejecutor_proveedores_refresco if plan.config.get('refresco') else ejecutor_proveedores
+    en_curso = {}  # nombre del proveedor -> (futuro, evento de cancelación)
+    
+    try:
+        while True:
+            ahora = time.monotonic()
+            for nombre in plan.vencidos(ahora):
+                en_curso.pop(nombre)[1].abandonar()
+            
+            nombre = plan.siguiente(ahora)
+            while nombre is not None:
+                cancelado = Cancelacion()
+                futuro = enviar_con_contexto(ejecutor, ejecutar_proveedor, nombre, video_id, cancelado,
+                                             plan.config['idiomas'], plan.timeout(nombre, ahora))
+                en_curso[nombre] = (futuro, cancelado)
+                nombre = plan.siguiente(ahora)
+            
+            espera = plan.espera(ahora)
+            if espera is None:
+                break
+            
+            futuros = {futuro: nombre for nombre, (futuro, _) in en_curso.items()}
+            if not futuros:
+                time.sleep(espera)
+                continue
+            terminados, _ = wait(futuros, timeout=espera, return_when=FIRST_COMPLETED)
+            for futuro in terminados:
+                nombre = futuros[futuro]
+                del en_curso[nombre]
+                if plan.terminado(nombre, futuro.result()):
+                    return plan.resultado()
+        return plan.resultado()
+    finally:
+        plan.cerrar()
+        for futuro, cancelado in en_curso.values():
+            cancelado.set()
+            futuro.cancel()
+
+def reservar_proveedor(nombre, espera_max=0.0, limitar=True):
+    """Segundos hasta que el proveedor puede arrancar, o None si se omite (registra por qué)"""
+    espera, motivo = proveedor_disponible(nombre, espera_max, limitar)
+    if espera is None:
+        log.info('Omitiendo %s (%s)', nombre, motivo)
+        metricas.incrementar('transcripciones_proveedor_resultados_total', proveedor=nombre, resultado=motivo)
+    elif espera > 0:
+        log.debug('Esperando %.2f s un token de %s', espera, nombre)
+        metricas.observar('transcripciones_limitador_espera_segundos', espera, proveedor=nombre)
+    return espera
+
+def fallo_por_tiempo(nombre, video_id):
+    """Resultado (504) de un proveedor abandonado al agotar su tiempo límite"""
+    log.warning('%s superó su tiempo límite de %g s', nombre, PROVEEDORES[nombre].timeout)
+    registrar_salud(nombre, 'error', 'tiempo límite agotado')
+    metricas.incrementar('transcripciones_proveedor_resultados_total', proveedor=nombre,
+                         resultado='tiempo_agotado')
+    return {
+        'exito': False,
+        'error': f'{nombre} superó su tiempo límite de {PROVEEDORES[nombre].timeout:g}s',
+        'video_id': video_id
+    }, 504, None
+
+def resultado_fallido(video_id, config, agotado, fallos, omitidos):
+    """(payload, status, None) cuando ningún proveedor obtuvo la transcripción"""
+    if agotado:
+        log.warning('Tiempo límite agotado para %s', video_id)
+        return {
+            'exito': False,
+            'error': f"Tiempo límite de {config['deadline']:g}s agotado",
+            'video_id': video_id
+        }, 504, None
+    
+    # Devuelve el error más informativo: el del último proveedor que lo dio
+    for nombre in reversed(config['orden']):
+        if nombre in fallos:
+            return fallos[nombre]
+    
+    if len(omitidos) == len(config['orden']):
+        return {
+            'exito': False,
+            'error': 'Todos los proveedores están temporalmente no disponibles',
+            'video_id': video_id,
+            'proveedores_omitidos': omitidos
+        }, 503, None
+    
+    return {
+        'exito': False,
+        'error': 'Ningún proveedor pudo obtener la transcripción',
+        'video_id': video_id
+    }, 502, None
+
+class FrecuenciaVideos:
+    """Popularidad por clave: peticiones con decaimiento exponencial, acotada a las claves más recientes"""
+    
+    def __init__(self, vida_media, max_claves):
+        self.vida_media = vida_media
+        self.max_claves = max_claves
+        self._puntajes = OrderedDict()  # clave -> (puntaje, instante)
+        self._lock = threading.Lock()
+    
+    def _decaer(self, puntaje, instante, ahora):
+        return puntaje * 0.5 ** ((ahora - instante) / self.vida_media)
+    
+    def registrar(self, clave):
+        """Suma una petición y devuelve el puntaje actual"""
+        ahora = time.monotonic()
+        with self._lock:
+            puntaje, instante = self._puntajes.pop(clave, (0.0, ahora))
+            puntaje = self._decaer(puntaje, instante, ahora) + 1
+            self._puntajes[clave] = (puntaje, ahora)
+            while len(self._puntajes) > self.max_claves:
+                self._puntajes.popitem(last=False)
+        return puntaje
+    
+    def populares(self, n=10):
+        ahora = time.monotonic()
+        with self._lock:
+            puntajes = [(clave, self._decaer(p, t, ahora)) for clave, (p, t) in self._puntajes.items()]
+        puntajes.sort(key=lambda x: x[1], reverse=True)
+        return [{'clave': clave, 'puntaje': round(p, 2)} for clave, p in puntajes[:n]]
+
+class Refrescador:
+    """Refresca y precarga transcripciones en segundo plano
+    
+    Usa sus propios pools (REFRESCO_HILOS) y su propia cubeta de tokens
+    (TASA_REFRESCO) en lugar de las de cada proveedor, así nunca compite por
+    hilos ni por ráfagas con el tráfico en vivo. Sí comparte los límites de
+    concurrencia por proveedor, que protegen al upstream, y el interruptor.
+    Se coalesce con las peticiones de la misma clave.
+    """
+    
+    def __init__(self, tasa, rafaga, max_pendientes):
+        self.cubeta = CubetaTokens(tasa, rafaga)
+        self.max_pendientes = max_pendientes
+        self._pendientes = set()
+        self._lock = threading.Lock()
+        self.estadisticas = {'encolados': 0, 'descartados': 0, 'refrescados': 0, 'sin_cambios': 0, 'fallidos': 0}
+    
+    def _contar(self, nombre):
+        with self._lock:
+            self.estadisticas[nombre] += 1
+    
+    def encolar(self, video_id, config, motivo):
+        """Agenda una obtención; False si ya estaba pendiente o la cola está llena"""
+        clave = clave_cache(video_id, ','.join(config['idiomas']))
+        with self._lock:
+            if clave in self._pendientes or len(self._pendientes) >= self.max_pendientes:
+                self.estadisticas['descartados'] += 1
+                return False
+            self._pendientes.add(clave)
+            self.estadisticas['encolados'] += 1
+        ejecutor_refresco.submit(self._ejecutar, video_id, clave, config, motivo)
+        return True
+    
+    def _ejecutar(self, video_id, clave, config, motivo):
+        trace_id_actual.set(f'{motivo}-{uuid.uuid4().hex[:8]}')
+        try:
+            while not self.cubeta.tomar():
+                time.sleep(1 / self.cubeta.tasa)
+            (entrada, estado), _ = coalescedor.ejecutar(clave, lambda: refrescar_entrada(video_id, clave, config))
+            if estado == 'HIT':
+                self._contar('sin_cambios')
+            else:
+                self._contar('refrescados' if entrada['status'] == 200 else 'fallidos')
+            log.info('%s de %s terminado (%s, %s)', motivo, video_id, estado, entrada['status'],
+                     extra={'campos': {'video_id': video_id, 'motivo': motivo, 'status': entrada['status']}})
+        except Exception as error:
+            self._contar('fallidos')
+            log.exception('Error en %s de %s: %s', motivo, video_id, error)
+        finally:
+            with self._lock:
+                self._pendientes.discard(clave)
+    
+    def resumen(self):
+        with self._lock:
+            datos = dict(self.estadisticas)
+            datos['pendientes'] = len(self._pendientes)
+        datos['tasa'] = self.cubeta.tasa
+        datos['activo'] = REFRESCO_ACTIVO
+        return datos
+
+frecuencias = FrecuenciaVideos(REFRESCO_VIDA_MEDIA, CACHE_MAX_ENTRADAS * 4)
+refrescador = Refrescador(TASA_REFRESCO, RAFAGA_REFRESCO, REFRESCO_MAX_PENDIENTES)
+
+# Letras latinas con tilde, diéresis, etc. → letra base; la ñ también pasa a n
+# porque se suele escribir sin ella al buscar. Conserva el largo del texto.
+_SIN_ACENTOS = {
+    codigo: unicodedata.normalize('NFD', chr(codigo))[0]
+    for codigo in range(0xC0, 0x250)
+    if len(unicodedata.normalize('NFD', chr(codigo))) > 1 and unicodedata.normalize('NFD', chr(codigo))[0].isascii()
+}
+_PALABRA = re.compile(r'\w+')
+
+def normalizar_busqueda(texto):
+    return texto.lower().translate(_SIN_ACENTOS)
+
+def terminos_busqueda(texto):
+    return set(_PALABRA.findall(normalizar_busqueda(texto)))
+
+class IndiceBusqueda:
+    """Índice invertido incremental sobre los segmentos de las transcripciones obtenidas
+    
+    Cada transcripción (video + idioma) se indexa una vez, en segundo plano
+    (encolar), al guardarse o al servirse por primera vez desde la cache
+    compartida; la búsqueda devuelve los segmentos que contienen todos los
+    términos, sin volver a pedir nada upstream.
+    Acotado a max_videos transcripciones, expulsando la usada hace más tiempo.
+    Vive en cada worker: una búsqueda con video_id lo completa desde la cache
+    compartida, una búsqueda entre videos solo ve lo que indexó este worker.
+    """
+    
+    def __init__(self, max_videos):
+        self.max_videos = max_videos
+        self._documentos = OrderedDict()  # (video_id, idioma) -> documento
+        self._por_termino = {}  # término -> claves de documentos que lo contienen
+        self._por_video = {}  # video_id -> claves de documentos
+        self._encolados = set()  # (clave, huella) esperando en ejecutor_indice
+        self._lock = threading.Lock()
+        self.estadisticas = {'indexados': 0, 'expulsados': 0, 'busquedas': 0}
+    
+    def _pendiente(self, entrada):
+        """(clave, huella) si la entrada es válida y no está indexada con ese contenido; si lo está, la marca como usada"""
+        if not self.max_videos or entrada.get('status') != 200 or 'segmentos' not in entrada:
+            return None
+        payload = entrada['payload']
+        clave = (payload.get('video_id'), payload.get('idioma'))
+        huella = huella_de_entrada(entrada)
+        with self._lock:
+            documento = self._documentos.get(clave)
+            if documento is not None and documento['huella'] == huella:
+                self._documentos.move_to_end(clave)
+                return None
+        return clave, huella
+    
+    def encolar(self, entrada):
+        """Indexa en ejecutor_indice si la entrada es nueva o cambió; no retrasa la respuesta que la sirve"""
+        pendiente = self._pendiente(entrada)
+        if pendiente is None:
+            return False
+        with self._lock:
+            if pendiente in self._encolados:
+                return False
+            self._encolados.add(pendiente)
+        ejecutor_indice.submit(self._indexar_encolada, entrada, pendiente)
+        return True
+    
+    def _indexar_encolada(self, entrada, pendiente):
+        try:
+            self.agregar(entrada)
+        except Exception as error:
+            log.exception('Error indexando %s para búsqueda: %s', pendiente[0], error)
+        finally:
+            with self._lock:
+                self._encolados.discard(pendiente)
+    
+    def agregar(self, entrada):
+        """Indexa ya una entrada válida de la cache si no está indexada con el mismo contenido"""
+        pendiente = self._pendiente(entrada)
+        if pendiente is None:
+            return False
+        clave, huella = pendiente
+        
+        # Se construye fuera del lock: búsquedas y otros hilos siguen mientras tanto
+        transcripcion = transcripcion_de_entrada(entrada)
+        postings = {}
+        for i, (_, _, texto) in enumerate(transcripcion):
+            for termino in terminos_busqueda(texto):
+                lista = postings.get(termino)
+                if lista is None:
+                    lista = postings[termino] = array('I')
+                lista.append(i)
+        
+        with self._lock:
+            self._quitar(clave)
+            self._documentos[clave] = {'huella': huella, 'transcripcion': transcripcion, 'postings': postings}
+            self._por_video.setdefault(clave[0], set()).add(clave)
+            for termino in postings:
+                self._por_termino.setdefault(termino, set()).add(clave)
+            self.estadisticas['indexados'] += 1
+            while len(self._documentos) > self.max_videos:
+                self._quitar(next(iter(self._documentos)))
+                self.estadisticas['expulsados'] += 1
+        return True
+    
+    def _quitar(self, clave):
+        documento = self._documentos.pop(clave, None)
+        if documento is None:
+            return
+        for termino in documento['postings']:
+            claves = self._por_termino[termino]
+            claves.discard(clave)
+            if not claves:
+                del self._por_termino[termino]
+        claves = self._por_video[clave[0]]
+        claves.discard(clave)
+        if not claves:
+            del self._por_video[clave[0]]
+    
+    def contiene(self, video_id, idioma=None):
+        """True si el video está indexado (en ese idioma, si se indica)"""
+        with self._lock:
+            claves = self._por_video.get(video_id, ())
+            if idioma is None:
+                return bool(claves)
+            return any(idioma_base(c[1] or '') == idioma_base(idioma) for c in claves)
+    
+    def buscar(self, consulta, video_id=None, idioma=None, limite=20, contexto=0):
+        """Segmentos que contienen todos los términos; devuelve (total de coincidencias, resultados)"""
+        terminos = terminos_busqueda(consulta)
+        total = 0
+        resultados = []
+        with self._lock:
+            self.estadisticas['busquedas'] += 1
+            if not terminos:
+                return 0, []
+            # Videos que contienen todos los términos, empezando por el menos frecuente
+            candidatos = None
+            for termino in sorted(terminos, key=lambda t: len(self._por_termino.get(t, ()))):
+                claves = self._por_termino.get(termino, set())
+                candidatos = claves.copy() if candidatos is None else candidatos & claves
+                if not candidatos:
+                    return 0, []
+            if video_id is not None:
+                candidatos &= self._por_video.get(video_id, set())
+            if idioma is not None:
+                candidatos = {c for c in candidatos if idioma_base(c[1] or '') == idioma_base(idioma)}
+            
+            for clave in sorted(candidatos, key=lambda c: (c[0] or '', c[1] or '')):
+                documento = self._documentos[clave]
+                listas = sorted((documento['postings'][t] for t in terminos), key=len)
+                indices = set(listas[0]).intersection(*listas[1:])
+                total += len(indices)
+                for i in sorted(indices)[:max(0, limite - len(resultados))]:
+                    resultados.append(self._resultado(clave, documento['transcripcion'], i, contexto))
+        return total, resultados
+    
+    @staticmethod
+    def _resultado(clave, transcripcion, i, contexto):
+        buffer = transcripcion.texto_plano()
+        offsets = transcripcion.offsets
+        
+        def texto(j):
+            fin = offsets[j + 1] - 1 if j + 1 < len(offsets) else len(buffer)
+            return buffer[offsets[j]:fin]
+        
+        resultado = {
+            'video_id': clave[0],
+            'idioma': clave[1],
+            'inicio': round(transcripcion.inicios[i], 3),
+            'duracion': round(transcripcion.duraciones[i], 3),
+            'texto': texto(i)
+        }
+        if contexto:
+            vecinos = range(max(0, i - contexto), min(len(offsets), i + contexto + 1))
+            resultado['contexto'] = ' '.join(texto(j) for j in vecinos)
+        return resultado
+    
+    def resumen(self):
+        with self._lock:
+            datos = dict(self.estadisticas)
+            datos['transcripciones'] = len(self._documentos)
+            datos['videos'] = len(self._por_video)
+            datos['terminos'] = len(self._por_termino)
+        datos['max_videos'] = self.max_videos
+        return datos
+
+indice_busqueda = IndiceBusqueda(BUSQUEDA_MAX_VIDEOS)
 
 if __name__ == '__main__':
-    import os
     port = int(os.environ.get('PORT', 5000))
-    print("🚀 Servidor iniciando con yt-dlp...")
-    print(f"📍 Puerto: {port}")
+    log.info('Servidor iniciando en el puerto %s', port)
     app.run(host='0.0.0.0', port=port, debug=False)
\ No newline at end of file
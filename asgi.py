@@ -0,0 +1,484 @@
+"""Modo ASGI: miles de peticiones en vuelo por proceso sin un hilo por petición
+
+Las rutas y las respuestas son las de app.py. /transcript y /transcripts
+resuelven la transcripción en el event loop: cache, coalescencia y
+estrategia de proveedores se esperan sin bloquear, timedtext y RapidAPI se
+consultan con aiohttp, y yt-dlp (o cualquier proveedor sin versión
+asíncrona) corre en el pool acotado de proveedores. Con la entrada ya
+resuelta, Flask arma la respuesta (formatos, ETag, compresión) a través de
+a2wsgi, en un pool pequeño de hilos que no espera a la red. El resto de
+rutas pasa tal cual a Flask por ese mismo pool, salvo /check, que puede
+esperar a yt-dlp y usa uno propio.
+
+Sin aiohttp todos los proveedores corren en el pool de hilos.
+
+Uso: SERVIDOR_MODO=asgi gunicorn (ver gunicorn.conf.py)
+     uvicorn asgi:app --workers 2
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+import xml.etree.ElementTree as ET
+from urllib.parse import parse_qsl
+
+import requests
+from a2wsgi import WSGIMiddleware
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import parse_accept_header
+
+import app as aplicacion
+
+try:
+    import aiohttp
+except ImportError:  # sin aiohttp los proveedores HTTP también van al pool de hilos
+    aiohttp = None
+
+log = logging.getLogger('transcripciones.asgi')
+
+# Hilos para armar respuestas y servir las rutas que no tienen versión asíncrona
+ASGI_HILOS = int(os.environ.get('ASGI_HILOS', 16))
+# Rutas que pueden esperar a yt-dlp durante decenas de segundos: van a su propio pool
+# para no dejar sin hilos a las respuestas de /transcript
+RUTAS_LENTAS = ('/check',)
+ASGI_HILOS_LENTOS = int(os.environ.get('ASGI_HILOS_LENTOS', 4))
+
+
+class EstadoLoop:
+    """Recursos ligados al event loop del proceso: cliente HTTP, semáforos y vuelos en curso"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        # Flask corre en el pool de cada puente WSGI; en_hilo usa el mismo pool
+        self.flask = WSGIMiddleware(flask_con_extras, workers=ASGI_HILOS)
+        self.flask_lento = WSGIMiddleware(flask_con_extras, workers=ASGI_HILOS_LENTOS)
+        self.ejecutor = self.flask.executor
+        self.ejecutor_lento = self.flask_lento.executor
+        self.vuelos = {}  # clave de cache o de índice -> tarea que la está obteniendo
+        # Mismos límites por proveedor que los semáforos de los hilos, contados aparte
+        self.limites = {nombre: asyncio.Semaphore(n) for nombre, n in aplicacion.CONCURRENCIA_PROVEEDOR.items()}
+        self.lotes = asyncio.Semaphore(aplicacion.BATCH_MAX_HILOS)
+        self.cliente = None
+        if aiohttp is not None:
+            # Sigue redirecciones como requests: el bloqueo de Google se ve en la URL final /sorry/
+            self.cliente = aiohttp.ClientSession(connector=aiohttp.TCPConnector(
+                limit=aplicacion.HTTP_POOL_HOSTS * aplicacion.HTTP_POOL_POR_HOST,
+                limit_per_host=aplicacion.HTTP_POOL_POR_HOST
+            ))
+
+    async def cerrar(self):
+        if self.cliente is not None:
+            await self.cliente.close()
+        self.ejecutor.shutdown(wait=False)
+        self.ejecutor_lento.shutdown(wait=False)
+
+
+_estado = None
+
+
+def estado():
+    """Estado del loop actual; se crea en la primera petición de cada worker"""
+    global _estado
+    loop = asyncio.get_running_loop()
+    if _estado is None or _estado.loop is not loop:
+        _estado = EstadoLoop(loop)
+    return _estado
+
+
+async def en_hilo(funcion, *args, ejecutor=None):
+    """Ejecuta funcion en el pool del servidor (u otro) conservando el trace id"""
+    ejecutor = ejecutor or estado().ejecutor
+    return await asyncio.wrap_future(aplicacion.enviar_con_contexto(ejecutor, funcion, *args))
+
+
+async def en_cache(funcion, *args):
+    """Cache e índice de pistas: en memoria responden al instante; sqlite, redis o disco pueden bloquear"""
+    if aplicacion.cache_transcripciones.almacen is None:
+        return funcion(*args)
+    return await en_hilo(funcion, *args)
+
+
+# --- Proveedores sin bloqueo ---
+
+# Errores de red que se reintentan, como requests.RequestException en los proveedores en hilos
+# (incluida, por los status de error que detecta app.verificar_status)
+ERRORES_RED = (aiohttp.ClientError, asyncio.TimeoutError, requests.RequestException) if aiohttp is not None else ()
+
+
+class Respuesta:
+    """Respuesta ya leída, con la interfaz de requests que usan los helpers de app.py"""
+
+    def __init__(self, status_code, url, content):
+        self.status_code = status_code
+        self.url = url
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', 'replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+async def http_get(url, params, headers, timeout):
+    async with estado().cliente.get(url, params=params, headers=headers,
+                                    timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+        return Respuesta(response.status, str(response.url), await response.read())
+
+
+async def obtener_timedtext(video_id, idiomas, cancelado, timeout):
+    """Versión asíncrona de obtener_subtitulos_directo"""
+    try:
+        transcripcion, lang_code = await _descargar_timedtext(video_id, idiomas, cancelado,
+                                                              time.monotonic() + timeout)
+    except (aplicacion.ProveedorBloqueado,) + ERRORES_RED:
+        raise
+    except Exception as e:
+        log.warning('Error en obtener_timedtext: %s', e)
+        return None
+    return aplicacion.PROVEEDORES['timedtext'].resultado(transcripcion, lang_code)
+
+
+async def _descargar_timedtext(video_id, idiomas, cancelado, limite):
+    headers = aplicacion.cabeceras_timedtext(idiomas)
+    indice = (await en_cache(aplicacion.obtener_indice, video_id)
+              or await descubrir_timedtext(video_id, headers, aplicacion.tiempo_restante(limite)))
+    if indice is None:
+        return None, None
+
+    lang_code = aplicacion.idioma_timedtext(indice, idiomas)
+    if not lang_code or cancelado.is_set():
+        return None, None
+
+    # Parsea el XML a medida que se descarga, como obtener_subtitulos_directo
+    async with estado().limites['timedtext']:
+        async with estado().cliente.get(aplicacion.TIMEDTEXT_URL,
+                                        params={'v': video_id, 'lang': lang_code, 'fmt': 'srv3'},
+                                        headers=headers,
+                                        timeout=aiohttp.ClientTimeout(
+                                            total=aplicacion.tiempo_restante(limite))) as response:
+            respuesta = Respuesta(response.status, str(response.url), None)
+            aplicacion.verificar_bloqueo_google(respuesta)
+            aplicacion.verificar_status(respuesta, 'timedtext')
+            if response.status != 200:
+                return None, None
+            return await parsear_srv3_en_flujo(response), lang_code
+
+
+async def descubrir_timedtext(video_id, headers, timeout):
+    """app.descubrir_pistas_timedtext sin bloquear: una sola lista type=list por video en este proceso"""
+    async def descubrir():
+        indice = await en_cache(aplicacion.indice_pistas.obtener, aplicacion.clave_indice(video_id), False)
+        if indice is not None:
+            return indice
+        async with estado().limites['timedtext']:
+            response = await http_get(aplicacion.TIMEDTEXT_URL, {'v': video_id, 'type': 'list'}, headers, timeout)
+        aplicacion.verificar_bloqueo_google(response)
+        aplicacion.verificar_status(response, 'timedtext')
+        if response.status_code != 200:
+            return None
+        return await en_cache(aplicacion.indexar_lista_timedtext, video_id, ET.fromstring(response.text))
+
+    return (await coalescer(aplicacion.clave_indice(video_id), descubrir))[0]
+
+
+async def parsear_srv3_en_flujo(response):
+    """app.parsear_srv3 sobre el cuerpo de aiohttp, chunk a chunk a medida que llega"""
+    parser = aplicacion.ParserSrv3()
+    transcripcion = aplicacion.Transcripcion()
+    recibidos = 0
+    duracion = 0.0
+    try:
+        async for chunk in response.content.iter_chunked(aplicacion.TAMAÑO_CHUNK):
+            recibidos += len(chunk)
+            inicio = time.monotonic()
+            for segmento in parser.alimentar(chunk):
+                transcripcion.agregar(*segmento)
+            duracion += time.monotonic() - inicio
+        for segmento in parser.cerrar():
+            transcripcion.agregar(*segmento)
+    except ERRORES_RED:
+        raise
+    except Exception as e:
+        log.debug('Error parseando XML de subtítulos: %s', e)
+        return None
+    aplicacion.registrar_parseo('srv3', duracion, recibidos)
+    return transcripcion
+
+
+async def obtener_rapidapi(video_id, idiomas, cancelado, timeout):
+    """Versión asíncrona de obtener_subtitulos_rapidapi"""
+    idioma, headers, querystring = aplicacion.peticion_rapidapi(video_id, idiomas)
+    async with estado().limites['rapidapi']:
+        response = await http_get(aplicacion.RAPIDAPI_URL, querystring, headers, timeout)
+    try:
+        resultado = aplicacion.leer_respuesta_rapidapi(response, idioma)
+    except (aplicacion.ProveedorBloqueado, requests.RequestException):
+        raise
+    except Exception as e:
+        log.exception('Error con RapidAPI: %s: %s', type(e).__name__, e)
+        return None
+    return aplicacion.PROVEEDORES['rapidapi'].resultado(*resultado)
+
+
+# Versión asíncrona por clase de proveedor; el resto corre en el pool de proveedores
+OBTENER_ASYNC = {
+    aplicacion.ProveedorTimedtext: obtener_timedtext,
+    aplicacion.ProveedorRapidAPI: obtener_rapidapi,
+}
+
+
+async def ejecutar_proveedor(nombre, video_id, cancelado, idiomas, timeout):
+    """Como app.ejecutar_proveedor, esperando sin ocupar un hilo cuando el proveedor lo permite"""
+    proveedor = aplicacion.PROVEEDORES[nombre]
+    obtener = OBTENER_ASYNC.get(type(proveedor)) if aiohttp is not None else None
+    if obtener is None:
+        futuro = aplicacion.enviar_con_contexto(aplicacion.ejecutor_proveedores, aplicacion.ejecutar_proveedor,
+                                                nombre, video_id, cancelado, idiomas, timeout)
+        return await asyncio.wrap_future(futuro)
+
+    inicio = time.monotonic()
+    limite = inicio + timeout
+    try:
+        for intento in range(proveedor.reintentos + 1):
+            try:
+                resultado = await obtener(video_id, idiomas, cancelado, aplicacion.tiempo_restante(limite))
+                break
+            except ERRORES_RED as error:
+                if intento == proveedor.reintentos or cancelado.is_set():
+                    raise
+                espera = proveedor.espera_reintento(intento, error)
+                if time.monotonic() + espera >= limite:
+                    raise
+                await asyncio.sleep(espera)
+    except asyncio.CancelledError:
+        cancelado.set()
+        aplicacion.normalizar_resultado(nombre, video_id, inicio, cancelado)
+        raise
+    except Exception as error:
+        return aplicacion.normalizar_resultado(nombre, video_id, inicio, cancelado, error=error)
+    return aplicacion.normalizar_resultado(nombre, video_id, inicio, cancelado, resultado)
+
+
+async def transcribir(video_id, config):
+    """app.transcribir con tareas asyncio en lugar de hilos; las decisiones son de app.Estrategia"""
+    plan = aplicacion.Estrategia(video_id, config)
+    en_curso = {}  # nombre del proveedor -> (tarea, evento de cancelación)
+
+    try:
+        while True:
+            ahora = time.monotonic()
+            for nombre in plan.vencidos(ahora):
+                tarea, cancelado = en_curso.pop(nombre)
+                cancelado.abandonar()
+                tarea.cancel()
+
+            nombre = plan.siguiente(ahora)
+            while nombre is not None:
+                cancelado = aplicacion.Cancelacion()  # los proveedores en hilos lo consultan
+                tarea = asyncio.ensure_future(ejecutar_proveedor(nombre, video_id, cancelado, config['idiomas'],
+                                                                 plan.timeout(nombre, ahora)))
+                en_curso[nombre] = (tarea, cancelado)
+                nombre = plan.siguiente(ahora)
+
+            espera = plan.espera(ahora)
+            if espera is None:
+                break
+
+            tareas = {tarea: nombre for nombre, (tarea, _) in en_curso.items()}
+            if not tareas:
+                await asyncio.sleep(espera)
+                continue
+            terminados, _ = await asyncio.wait(tareas, timeout=espera, return_when=asyncio.FIRST_COMPLETED)
+            for tarea in terminados:
+                nombre = tareas[tarea]
+                del en_curso[nombre]
+                if plan.terminado(nombre, tarea.result()):
+                    return plan.resultado()
+        return plan.resultado()
+    finally:
+        plan.cerrar()
+        for tarea, cancelado in en_curso.values():
+            cancelado.set()
+            tarea.cancel()
+
+
+async def transcribir_y_cachear(video_id, clave, config):
+    entrada = await en_cache(aplicacion.cache_transcripciones.obtener, clave, False)
+    if entrada is not None:
+        return entrada, 'HIT'
+
+    payload, status, transcripcion = await transcribir(video_id, config)
+    return await en_cache(aplicacion.cachear_resultado, clave, payload, status, transcripcion), 'MISS'
+
+
+async def obtener_entrada(video_id, config):
+    """Como app.obtener_entrada; la coalescencia es por proceso (sin locks entre workers)"""
+    clave = aplicacion.clave_cache(video_id, ','.join(config['idiomas']))
+    puntaje = aplicacion.frecuencias.registrar(clave)
+    entrada = await en_cache(aplicacion.cache_transcripciones.obtener, clave)
+    if entrada is not None:
+        aplicacion.revisar_refresco(video_id, config, clave, puntaje, entrada)
+        aplicacion.indice_busqueda.encolar(entrada)
+        return entrada, 'HIT'
+
+    (entrada, estado_cache), compartido = await coalescer(
+        clave, lambda: transcribir_y_cachear(video_id, clave, config))
+    return entrada, 'COALESCED' if compartido else estado_cache
+
+
+async def coalescer(clave, crear):
+    """Una sola corrutina crear() por clave en este proceso; devuelve (resultado, compartido)"""
+    vuelos = estado().vuelos
+    vuelo = vuelos.get(clave)
+    compartido = vuelo is not None
+    if vuelo is None:
+        vuelo = vuelos[clave] = asyncio.ensure_future(crear())
+        vuelo.add_done_callback(lambda _: vuelos.pop(clave, None))
+    # shield: si este cliente se va, los demás que esperan la misma clave siguen
+    return await asyncio.shield(vuelo), compartido
+
+
+# --- Puente con Flask ---
+
+def flask_con_extras(environ, start_response):
+    """Flask con lo que el event loop ya resolvió (inicio, trace id, entradas), que viaja en el scope"""
+    environ.update(environ['asgi.scope'].get('transcripciones', {}))
+    return aplicacion.app(environ, start_response)
+
+
+async def servir_flask(scope, receive, send, extra, lenta=False):
+    puente = estado().flask_lento if lenta else estado().flask
+    await puente(dict(scope, transcripciones=extra), receive, send)
+
+
+def repetir_cuerpo(cuerpo):
+    """receive() para Flask cuando el cuerpo ya se leyó en el event loop"""
+    async def receive():
+        return {'type': 'http.request', 'body': cuerpo, 'more_body': False}
+    return receive
+
+
+async def leer_cuerpo(receive):
+    partes = []
+    while True:
+        mensaje = await receive()
+        if mensaje['type'] == 'http.disconnect':
+            return None
+        partes.append(mensaje.get('body', b''))
+        if not mensaje.get('more_body'):
+            return b''.join(partes)
+
+
+def _cabecera(scope, nombre):
+    for clave, valor in scope['headers']:
+        if clave == nombre:
+            return valor.decode('latin-1')
+    return None
+
+
+# --- Rutas resueltas en el event loop ---
+
+async def resolver_transcript(args):
+    """Entradas de /transcript resueltas sin bloquear; None si la validación la hace Flask"""
+    video_id = args.get('video_id')
+    if not video_id or args.get('format', 'text') not in aplicacion.FORMATOS_RESPUESTA:
+        return None
+    try:
+        config = aplicacion.leer_config_estrategia(args)
+        configs = [config]
+        if 'langs' in args:
+            if args.get('format', 'text') not in ('text', 'segments'):
+                return None
+            configs = [dict(config, idiomas=[i]) for i in aplicacion.leer_idiomas(args.get('langs'), 'langs')]
+    except ValueError:
+        return None
+
+    resultados = await asyncio.gather(*(obtener_entrada(video_id, c) for c in configs))
+    return {aplicacion.clave_cache(video_id, ','.join(c['idiomas'])): r for c, r in zip(configs, resultados)}
+
+
+async def servir_lote(scope, receive, send, inicio, trace_id):
+    """/transcripts en NDJSON: cada video se escribe en cuanto termina, como en app.py"""
+    cuerpo = await leer_cuerpo(receive)
+    if cuerpo is None:
+        return
+    tipo = (_cabecera(scope, b'content-type') or '').split(';')[0].strip().lower()
+    try:
+        if tipo != 'application/json' and not (tipo.startswith('application/') and tipo.endswith('+json')):
+            raise ValueError(tipo)
+        video_ids, config = aplicacion.leer_lote(json.loads(cuerpo))
+    except ValueError:  # también JSON inválido o sin Content-Type JSON: Flask responde el 400
+        await servir_flask(scope, repetir_cuerpo(cuerpo), send, {'transcripciones.inicio': inicio,
+                                                                 'transcripciones.trace_id': trace_id})
+        return
+
+    async def resolver(video_id):
+        async with estado().lotes:
+            try:
+                return aplicacion.payload_de_entrada((await obtener_entrada(video_id, config))[0])
+            except Exception as error:
+                return aplicacion.payload_de_error(error, video_id)
+
+    aceptadas = parse_accept_header(_cabecera(scope, b'accept-encoding'))
+    codificacion = aplicacion.elegir_codificacion(aceptadas)
+    agregar, terminar = aplicacion.compresor_flujo(codificacion) if codificacion else (lambda d: d, lambda: b'')
+    headers = [(b'content-type', b'application/x-ndjson'), (b'vary', b'Accept-Encoding'),
+               (b'x-request-id', trace_id.encode('latin-1'))]
+    if codificacion:
+        headers.append((b'content-encoding', codificacion.encode('latin-1')))
+
+    tareas = [asyncio.ensure_future(resolver(v)) for v in video_ids]
+    # Tras leer el cuerpo, receive() solo vuelve cuando el cliente corta la conexión
+    vigia = asyncio.ensure_future(receive())
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+        for siguiente in asyncio.as_completed(tareas):
+            linea = json.dumps(await siguiente, ensure_ascii=False) + '\n'
+            if vigia.done():
+                break
+            datos = agregar(linea.encode('utf-8'))
+            if datos:
+                await send({'type': 'http.response.body', 'body': datos, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': terminar()})
+    finally:
+        vigia.cancel()
+        for tarea in tareas:
+            tarea.cancel()
+        aplicacion.metricas.incrementar('transcripciones_peticiones_total', endpoint='obtener_transcripciones_lote',
+                                        status='200')
+        aplicacion.metricas.observar('transcripciones_peticion_duracion_segundos', time.monotonic() - inicio,
+                                     endpoint='obtener_transcripciones_lote')
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            mensaje = await receive()
+            if mensaje['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif mensaje['type'] == 'lifespan.shutdown':
+                if _estado is not None:
+                    await _estado.cerrar()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+
+    inicio = time.monotonic()
+    trace_id = (_cabecera(scope, b'x-request-id') or '')[:64] or uuid.uuid4().hex[:16]
+    aplicacion.trace_id_actual.set(trace_id)
+    extra = {'transcripciones.inicio': inicio, 'transcripciones.trace_id': trace_id}
+    if scope['path'] == '/transcript' and scope['method'] == 'GET':
+        args = MultiDict(parse_qsl(scope['query_string'].decode('utf-8', 'replace'), keep_blank_values=True))
+        entradas = await resolver_transcript(args)
+        if entradas:
+            extra['transcripciones.entradas'] = entradas
+    elif scope['path'] == '/transcripts' and scope['method'] == 'POST':
+        await servir_lote(scope, receive, send, inicio, trace_id)
+        return
+
+    await servir_flask(scope, receive, send, extra, lenta=scope['path'] in RUTAS_LENTAS)
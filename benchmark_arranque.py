@@ -0,0 +1,81 @@
+"""Benchmark de arranque del worker
+
+Mide en procesos nuevos el tiempo de importar app.py y el tiempo hasta
+responder la primera petición, y aparte el costo de importar yt-dlp (que
+ahora se difiere hasta la primera petición que lo necesita).
+
+Uso: python benchmark_arranque.py [--repeticiones 5] [--json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+
+SCRIPT_APP = """
+import json, sys, time
+inicio = time.perf_counter()
+import app
+importado = time.perf_counter()
+respuesta = app.app.test_client().get('/')
+assert respuesta.status_code == 200
+listo = time.perf_counter()
+print(json.dumps({
+    'importar_app_ms': (importado - inicio) * 1000,
+    'primera_peticion_ms': (listo - inicio) * 1000,
+    'yt_dlp_cargado': 'yt_dlp' in sys.modules,
+}))
+"""
+
+SCRIPT_YTDLP = """
+import json, time
+inicio = time.perf_counter()
+import yt_dlp
+print(json.dumps({'importar_yt_dlp_ms': (time.perf_counter() - inicio) * 1000}))
+"""
+
+
+def ejecutar(script):
+    salida = subprocess.run(
+        [sys.executable, '-c', script],
+        cwd=DIRECTORIO, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(salida.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeticiones', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='salida JSON para CI')
+    args = parser.parse_args()
+
+    muestras = [ejecutar(SCRIPT_APP) for _ in range(args.repeticiones)]
+    muestras_ytdlp = [ejecutar(SCRIPT_YTDLP) for _ in range(args.repeticiones)]
+
+    resultado = {
+        'importar_app_ms': round(statistics.median(m['importar_app_ms'] for m in muestras), 1),
+        'primera_peticion_ms': round(statistics.median(m['primera_peticion_ms'] for m in muestras), 1),
+        'importar_yt_dlp_ms': round(statistics.median(m['importar_yt_dlp_ms'] for m in muestras_ytdlp), 1),
+        'yt_dlp_cargado_al_arrancar': any(m['yt_dlp_cargado'] for m in muestras),
+        'repeticiones': args.repeticiones,
+    }
+
+    if args.json:
+        print(json.dumps(resultado))
+        return
+
+    filas = [
+        ('Importar app.py', f"{resultado['importar_app_ms']:.1f} ms"),
+        ('Hasta la primera petición', f"{resultado['primera_peticion_ms']:.1f} ms"),
+        ('Importar yt-dlp (diferido)', f"{resultado['importar_yt_dlp_ms']:.1f} ms"),
+        ('yt-dlp cargado al arrancar', 'sí' if resultado['yt_dlp_cargado_al_arrancar'] else 'no'),
+    ]
+    for nombre, valor in filas:
+        print(f"{nombre + ':':<30}{valor:>12}")
+
+
+if __name__ == '__main__':
+    main()
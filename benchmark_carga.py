@@ -0,0 +1,328 @@
+"""Benchmark de carga sin red
+
+Levanta un servidor HTTP local que imita la API timedtext de YouTube,
+RapidAPI y las pistas que entrega yt-dlp (srv3, json3 y vtt), con latencia,
+errores y bloqueos "sorry" configurables. app.py apunta a él con
+TIMEDTEXT_URL y RAPIDAPI_URL; la extracción de yt-dlp se reemplaza por una
+consulta al mismo servidor, que devuelve la información grabada del video.
+
+Escenarios:
+  repetido  pocos videos populares, casi todo se resuelve en cache
+  frio      cada petición es un video nuevo
+  lote      POST /transcripts con muchos videos por petición
+  caida     timedtext bloqueado ("sorry") y RapidAPI devolviendo errores
+
+Las respuestas grabadas se generan con benchmark_parsers.generar o se leen
+de --grabaciones DIR (lista.xml, srv3.xml, json3.json, vtt.vtt, rapidapi.json).
+
+Se mide la configuración por defecto de app.py (limitadores incluidos); las
+variables de entorno que la cambian se muestran en el reporte.
+
+Uso: python benchmark_carga.py [--escenarios repetido,frio] [--peticiones 400] [--hilos 16] [--json]
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+ESCENARIOS = ('repetido', 'frio', 'lote', 'caida')
+ARCHIVOS_GRABACION = {
+    'lista': 'lista.xml',
+    'srv3': 'srv3.xml',
+    'json3': 'json3.json',
+    'vtt': 'vtt.vtt',
+    'rapidapi': 'rapidapi.json',
+}
+# Variables de entorno que cambian el comportamiento medido; se reportan si están definidas
+PREFIJOS_CONFIGURACION = ('TASA_', 'RAFAGA_', 'ESTRATEGIA_', 'LIMITE_', 'TIMEOUT_', 'REINTENTOS_', 'CACHE_',
+                          'PROVEEDORES_MAX_HILOS', 'BATCH_MAX_HILOS', 'HTTP_POOL_', 'INTERRUPTOR_')
+
+
+# --- Servidor upstream local ---
+
+class Upstream:
+    """Comportamiento configurable del servidor falso y conteo de llamadas por ruta"""
+
+    def __init__(self, grabaciones, latencia=0.0, tasa_errores=0.0):
+        self.grabaciones = grabaciones
+        self.latencia = latencia
+        self.tasa_errores = tasa_errores
+        self.bloquear_timedtext = False
+        self.errores_rapidapi = False
+        self.llamadas = Counter()
+        self._lock = threading.Lock()
+
+    def contar(self, ruta):
+        with self._lock:
+            self.llamadas[ruta] += 1
+
+    def reiniciar(self):
+        self.bloquear_timedtext = False
+        self.errores_rapidapi = False
+        with self._lock:
+            self.llamadas.clear()
+
+
+class ManejadorUpstream(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, como los upstream reales
+
+    def log_message(self, *args):
+        pass
+
+    def responder(self, status, tipo, cuerpo):
+        if isinstance(cuerpo, str):
+            cuerpo = cuerpo.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def redirigir(self, ruta):
+        self.send_response(302)
+        self.send_header('Location', ruta)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        upstream = self.server.upstream
+        grabaciones = upstream.grabaciones
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        upstream.contar(url.path)
+
+        if upstream.latencia:
+            time.sleep(upstream.latencia)
+
+        if url.path == '/sorry/index':
+            return self.responder(429, 'text/html', '<html>Our systems have detected unusual traffic</html>')
+        if upstream.tasa_errores and random.random() < upstream.tasa_errores:
+            return self.responder(500, 'text/plain', 'error')
+
+        if url.path == '/api/timedtext':
+            if upstream.bloquear_timedtext:
+                return self.redirigir('/sorry/index')
+            if params.get('type') == 'list':
+                return self.responder(200, 'text/xml', grabaciones['lista'])
+            return self.responder(200, 'text/xml', grabaciones['srv3'])
+
+        if url.path == '/rapidapi/transcript':
+            if upstream.errores_rapidapi:
+                return self.responder(503, 'application/json', '{"message": "Service Unavailable"}')
+            return self.responder(200, 'application/json', grabaciones['rapidapi'])
+
+        if url.path == '/ytdlp/info':
+            base = f"http://{self.headers['Host']}/pistas/{params.get('v', '')}"
+            info = {
+                'id': params.get('v'),
+                'title': 'Video de prueba',
+                'subtitles': {'es': [{'ext': 'json3', 'url': base + '.json3', 'name': 'Español'},
+                                     {'ext': 'vtt', 'url': base + '.vtt', 'name': 'Español'}]},
+                'automatic_captions': {},
+            }
+            return self.responder(200, 'application/json', json.dumps(info))
+
+        if url.path.startswith('/pistas/'):
+            if url.path.endswith('.json3'):
+                return self.responder(200, 'application/json', grabaciones['json3'])
+            return self.responder(200, 'text/vtt', grabaciones['vtt'])
+
+        self.responder(404, 'text/plain', 'no encontrado')
+
+
+def iniciar_upstream(upstream):
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), ManejadorUpstream)
+    servidor.daemon_threads = True
+    servidor.upstream = upstream
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+def cargar_grabaciones(horas, directorio=None):
+    from benchmark_parsers import generar
+
+    documentos = generar(horas)
+    eventos = json.loads(documentos['json3'])['events']
+    grabaciones = {
+        'lista': '<?xml version="1.0" encoding="utf-8" ?><transcript_list docid="0">'
+                 '<track id="0" name="" lang_code="es" lang_original="Español" lang_translated="Español"/>'
+                 '</transcript_list>',
+        'srv3': documentos['srv1'],
+        'json3': documentos['json3'],
+        'vtt': documentos['vtt'],
+        'rapidapi': json.dumps([
+            {'text': e['segs'][0]['utf8'], 'start': e['tStartMs'] / 1000, 'duration': e['dDurationMs'] / 1000}
+            for e in eventos
+        ]),
+    }
+    if directorio:
+        for clave, nombre in ARCHIVOS_GRABACION.items():
+            ruta = os.path.join(directorio, nombre)
+            if os.path.exists(ruta):
+                with open(ruta, encoding='utf-8') as f:
+                    grabaciones[clave] = f.read()
+    return grabaciones
+
+
+# --- Escenarios ---
+
+def peticiones_escenario(nombre, total, azar):
+    """Lista de (método, ruta, cuerpo JSON) que ejecuta cada escenario"""
+    if nombre == 'repetido':
+        # Popularidad tipo Zipf sobre 20 videos
+        videos = [f'rep{i:03d}' for i in range(20)]
+        pesos = [1 / (i + 1) for i in range(len(videos))]
+        return [('GET', f'/transcript?video_id={v}', None) for v in azar.choices(videos, pesos, k=total)]
+    if nombre == 'lote':
+        tamaño = 50
+        return [
+            ('POST', '/transcripts', {'video_ids': [f'lote{i:03d}-{j:02d}' for j in range(tamaño)]})
+            for i in range(max(1, total // tamaño))
+        ]
+    return [('GET', f'/transcript?video_id={nombre}{i:05d}', None) for i in range(total)]
+
+
+def reiniciar_estado(app, upstream):
+    app.cache_transcripciones = app.crear_cache()
+    app.indice_pistas = app.crear_cache()
+    for interruptor in app.INTERRUPTORES.values():
+        interruptor.reiniciar()
+    for cubeta in app.CUBETAS.values():
+        cubeta.tasa = cubeta.tasa_max
+        cubeta.tokens = cubeta.rafaga
+    upstream.reiniciar()
+
+
+def configuracion_modificada():
+    return {k: v for k, v in sorted(os.environ.items()) if k.startswith(PREFIJOS_CONFIGURACION)}
+
+
+def items_fallidos(respuesta):
+    """Videos con exito false en una respuesta NDJSON de /transcripts (el status HTTP siempre es 200)"""
+    if respuesta.mimetype != 'application/x-ndjson':
+        return 0, 0
+    items = [json.loads(linea) for linea in respuesta.get_data(as_text=True).splitlines() if linea.strip()]
+    return len(items), sum(1 for item in items if not item.get('exito'))
+
+
+def percentil(valores, p):
+    if len(valores) < 2:
+        return valores[0] if valores else 0.0
+    return statistics.quantiles(valores, n=100, method='inclusive')[p - 1]
+
+
+def ejecutar_escenario(app, upstream, nombre, peticiones, hilos, medir_memoria):
+    reiniciar_estado(app, upstream)
+    if nombre == 'caida':
+        upstream.bloquear_timedtext = True
+        upstream.errores_rapidapi = True
+
+    local = threading.local()
+
+    def ejecutar(peticion):
+        if not hasattr(local, 'cliente'):
+            local.cliente = app.app.test_client()
+        metodo, ruta, cuerpo = peticion
+        inicio = time.perf_counter()
+        respuesta = local.cliente.open(ruta, method=metodo, json=cuerpo)
+        respuesta.get_data()  # consume también las respuestas en streaming
+        return (time.perf_counter() - inicio, respuesta.status_code) + items_fallidos(respuesta)
+
+    if medir_memoria:
+        tracemalloc.start()
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=hilos) as ejecutor:
+        resultados = list(ejecutor.map(ejecutar, peticiones))
+    duracion = time.perf_counter() - inicio
+    pico = tracemalloc.get_traced_memory()[1] if medir_memoria else 0
+    if medir_memoria:
+        tracemalloc.stop()
+
+    latencias = [r[0] for r in resultados]
+    estados = Counter(r[1] for r in resultados)
+    return {
+        'escenario': nombre,
+        'peticiones': len(peticiones),
+        'errores': sum(n for status, n in estados.items() if status != 200),
+        'items_lote': sum(r[2] for r in resultados),
+        'items_fallidos': sum(r[3] for r in resultados),
+        'peticiones_por_segundo': round(len(peticiones) / duracion, 1),
+        'p50_ms': round(percentil(latencias, 50) * 1000, 1),
+        'p99_ms': round(percentil(latencias, 99) * 1000, 1),
+        'pico_memoria_kb': round(pico / 1024),
+        'llamadas_upstream': sum(upstream.llamadas.values()),
+        'estados': {str(k): v for k, v in sorted(estados.items())},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--escenarios', default=','.join(ESCENARIOS))
+    parser.add_argument('--peticiones', type=int, default=400)
+    parser.add_argument('--hilos', type=int, default=16)
+    parser.add_argument('--latencia', type=float, default=20, help='latencia upstream en ms')
+    parser.add_argument('--tasa-errores', type=float, default=0.0, help='proporción de respuestas 500 upstream')
+    parser.add_argument('--horas', type=float, default=0.5, help='duración de los subtítulos grabados')
+    parser.add_argument('--grabaciones', help='directorio con respuestas grabadas')
+    parser.add_argument('--sin-memoria', action='store_true', help='no medir memoria (tracemalloc ralentiza)')
+    parser.add_argument('--semilla', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help='salida JSON para CI')
+    args = parser.parse_args()
+
+    escenarios = [e.strip() for e in args.escenarios.split(',') if e.strip()]
+    desconocidos = [e for e in escenarios if e not in ESCENARIOS]
+    if desconocidos:
+        parser.error(f"escenarios válidos: {', '.join(ESCENARIOS)}")
+
+    random.seed(args.semilla)
+    upstream = Upstream({}, latencia=args.latencia / 1000, tasa_errores=args.tasa_errores)
+    servidor = iniciar_upstream(upstream)
+    base = f'http://127.0.0.1:{servidor.server_address[1]}'
+
+    # app lee la configuración al importarse (también vía benchmark_parsers)
+    os.environ['TIMEDTEXT_URL'] = f'{base}/api/timedtext'
+    os.environ['RAPIDAPI_URL'] = f'{base}/rapidapi/transcript'
+    os.environ.setdefault('CACHE_BACKEND', 'memoria')
+    os.environ.setdefault('LOG_LEVEL', 'ERROR')
+    configuracion = configuracion_modificada()
+    import app
+    upstream.grabaciones.update(cargar_grabaciones(args.horas, args.grabaciones))
+
+    def extraer_info_local(video_id):
+        return app.http_get(f'{base}/ytdlp/info', params={'v': video_id}, timeout=30).json()
+
+    app.extraer_info_subtitulos = extraer_info_local
+
+    azar = random.Random(args.semilla)
+    resultados = []
+    try:
+        for nombre in escenarios:
+            peticiones = peticiones_escenario(nombre, args.peticiones, azar)
+            resultados.append(ejecutar_escenario(app, upstream, nombre, peticiones, args.hilos, not args.sin_memoria))
+    finally:
+        servidor.shutdown()
+
+    if args.json:
+        print(json.dumps({'configuracion': configuracion, 'resultados': resultados}))
+        return
+
+    print('Configuración: ' + (', '.join(f'{k}={v}' for k, v in configuracion.items()) or 'por defecto'))
+    print(f"{'escenario':<10}{'peticiones':>11}{'errores':>9}{'fallidos lote':>15}{'pet/s':>9}{'p50 (ms)':>10}"
+          f"{'p99 (ms)':>10}{'pico (KB)':>11}{'upstream':>10}")
+    for r in resultados:
+        lote = f"{r['items_fallidos']}/{r['items_lote']}" if r['items_lote'] else '-'
+        print(f"{r['escenario']:<10}{r['peticiones']:>11}{r['errores']:>9}{lote:>15}"
+              f"{r['peticiones_por_segundo']:>9.1f}{r['p50_ms']:>10.1f}{r['p99_ms']:>10.1f}"
+              f"{r['pico_memoria_kb']:>11}{r['llamadas_upstream']:>10}")
+
+
+if __name__ == '__main__':
+    main()
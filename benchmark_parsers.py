@@ -0,0 +1,136 @@
+"""Benchmark de los parsers de subtítulos
+
+Compara los parsers incrementales de app.py con las versiones anteriores
+(regex y documento completo) sobre subtítulos sintéticos de varias horas.
+
+Uso: python benchmark_parsers.py [--horas 4] [--repeticiones 3]
+"""
+import argparse
+import json
+import re
+import time
+import tracemalloc
+
+import app
+
+
+# --- Versiones anteriores (solo texto, documento completo) ---
+
+def limpiar_texto_subtitulos_anterior(texto):
+    texto = re.sub(r'<[^>]+>', '', texto)
+    texto = re.sub(r'\d{2}:\d{2}:\d{2}\.\d{3}\s*-->\s*\d{2}:\d{2}:\d{2}\.\d{3}', '', texto)
+    texto = re.sub(r'^\d+\s*$', '', texto, flags=re.MULTILINE)
+    texto = re.sub(r'\n\s*\n+', '\n', texto)
+    texto = re.sub(r'\s+', ' ', texto)
+    return texto.strip()
+
+
+def parsear_json3_anterior(data):
+    json_data = json.loads(data)
+    textos = []
+    for event in json_data.get('events', []):
+        if 'segs' in event:
+            for seg in event['segs']:
+                if 'utf8' in seg:
+                    textos.append(seg['utf8'])
+        elif 'text' in event:
+            textos.append(event['text'])
+    texto_final = ' '.join(textos).replace('\n', ' ')
+    return re.sub(r'\s+', ' ', texto_final).strip()
+
+
+def parsear_srv3_anterior(data):
+    textos = re.findall(r'<text[^>]*>(.*?)</text>', data, re.DOTALL)
+    return limpiar_texto_subtitulos_anterior(' '.join(textos))
+
+
+def parsear_vtt_anterior(data):
+    texto = re.sub(r'^WEBVTT.*?\n\n', '', data, flags=re.DOTALL)
+    return limpiar_texto_subtitulos_anterior(texto)
+
+
+# --- Datos sintéticos ---
+
+FRASES = [
+    'hola a todos y bienvenidos a un nuevo video',
+    'hoy vamos a hablar de cómo funciona el sistema',
+    'si te gusta el contenido no olvides suscribirte',
+    'esto es muy importante &amp; hay que tenerlo en cuenta',
+]
+
+
+def _marca(segundos):
+    ms = int(segundos * 1000)
+    return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d}.{ms % 1000:03d}"
+
+
+def generar(horas):
+    total = int(horas * 3600 / 2)  # un segmento cada 2 segundos
+    frases = [FRASES[i % len(FRASES)] for i in range(total)]
+
+    json3 = json.dumps({
+        'wireMagic': 'pb3',
+        'events': [
+            {'tStartMs': i * 2000, 'dDurationMs': 2000, 'segs': [{'utf8': f}]}
+            for i, f in enumerate(frases)
+        ]
+    })
+    srv1 = '<?xml version="1.0" encoding="utf-8" ?><transcript>' + ''.join(
+        f'<text start="{i * 2}" dur="2">{f}</text>' for i, f in enumerate(frases)
+    ) + '</transcript>'
+    vtt = 'WEBVTT\nKind: captions\nLanguage: es\n\n' + ''.join(
+        f'{_marca(i * 2)} --> {_marca(i * 2 + 2)}\n{f}\n\n' for i, f in enumerate(frases)
+    )
+    return {'json3': json3, 'srv1': srv1, 'vtt': vtt}
+
+
+def en_chunks(data, tamaño=app.TAMAÑO_CHUNK):
+    """Simula el cuerpo de una respuesta HTTP consumida con iter_content"""
+    datos = data.encode('utf-8')
+    return (datos[i:i + tamaño] for i in range(0, len(datos), tamaño))
+
+
+# --- Medición ---
+
+def medir(funcion, repeticiones):
+    mejor = float('inf')
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        mejor = min(mejor, time.perf_counter() - inicio)
+
+    tracemalloc.start()
+    funcion()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return mejor, pico
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--horas', type=float, default=4)
+    parser.add_argument('--repeticiones', type=int, default=3)
+    args = parser.parse_args()
+
+    documentos = generar(args.horas)
+    casos = [
+        ('json3', parsear_json3_anterior, app.parsear_json3),
+        ('srv1', parsear_srv3_anterior, app.parsear_srv3),
+        ('vtt', parsear_vtt_anterior, app.parsear_vtt),
+    ]
+
+    print(f"{'formato':<8}{'tamaño':>10}  {'parser':<22}{'tiempo (ms)':>12}{'pico (KB)':>12}")
+    for formato, anterior, nuevo in casos:
+        data = documentos[formato]
+        mediciones = [
+            ('anterior (str)', lambda: anterior(data)),
+            ('incremental (str)', lambda: nuevo(data)),
+            ('incremental (chunks)', lambda: nuevo(en_chunks(data))),
+        ]
+        for nombre, funcion in mediciones:
+            tiempo, pico = medir(funcion, args.repeticiones)
+            print(f"{formato:<8}{len(data) // 1024:>8}KB  {nombre:<22}{tiempo * 1000:>12.1f}{pico / 1024:>12.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,26 @@
+"""Configuración de gunicorn (se carga automáticamente desde el directorio de trabajo)
+
+Con preload_app el módulo app se importa una sola vez en el master y los
+workers se crean con fork, compartiendo esas páginas de memoria
+copy-on-write. Los recursos por proceso (sesión HTTP, pool de yt-dlp,
+pools de hilos) se recrean en cada worker.
+
+SERVIDOR_MODO=asgi sirve asgi:app con workers de uvicorn (ver asgi.py);
+por defecto se sirve la app WSGI de app.py.
+"""
+import os
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+if os.environ.get('SERVIDOR_MODO', 'wsgi') == 'asgi':
+    wsgi_app = 'asgi:app'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+else:
+    wsgi_app = 'app:app'
+
+
+def when_ready(server):
+    # Importar yt-dlp en el master evita pagarlo en cada worker y en cada reinicio
+    if preload_app and os.environ.get('PRECARGAR_YTDLP', '0') == '1':
+        import app
+        app.cargar_yt_dlp()
@@ -0,0 +1,53 @@
+"""Fixtures comunes: app.py apunta a un upstream falso local, sin red"""
+import os
+
+import pytest
+
+import upstream_falso
+
+UPSTREAM = upstream_falso.Upstream()
+BASE = upstream_falso.iniciar(UPSTREAM)
+
+# app lee la configuración al importarse
+os.environ.update({
+    'TIMEDTEXT_URL': f'{BASE}/api/timedtext',
+    'RAPIDAPI_URL': f'{BASE}/rapidapi/transcript',
+    'CACHE_BACKEND': 'memoria',
+    'SINGLEFLIGHT_LOCK_DIR': '',
+    'REFRESCO_ACTIVO': '0',
+    'LOG_LEVEL': 'ERROR',
+})
+
+import app  # noqa: E402
+
+
+def extraer_info_local(video_id):
+    return app.http_get(f'{BASE}/ytdlp/info', params={'v': video_id}, timeout=30).json()
+
+
+@pytest.fixture(autouse=True)
+def estado_limpio(monkeypatch):
+    """Cada test parte con caches vacías, interruptores cerrados y la cadena de proveedores original"""
+    monkeypatch.setattr(app, 'extraer_info_subtitulos', extraer_info_local)
+    # registrar_proveedor modifica estos dicts: cada test trabaja sobre una copia
+    for nombre in ('PROVEEDORES', 'INTERRUPTORES', 'CUBETAS'):
+        monkeypatch.setattr(app, nombre, dict(getattr(app, nombre)))
+    monkeypatch.setattr(app, 'cache_transcripciones', app.crear_cache())
+    monkeypatch.setattr(app, 'indice_pistas', app.crear_cache())
+    monkeypatch.setattr(app, 'indice_busqueda', app.IndiceBusqueda(app.BUSQUEDA_MAX_VIDEOS))
+    for nombre in app.INTERRUPTORES:
+        app.INTERRUPTORES[nombre] = app.Interruptor(app.INTERRUPTOR_UMBRAL, app.INTERRUPTOR_ENFRIAMIENTO,
+                                                    app.INTERRUPTOR_ENFRIAMIENTO_MAX)
+        app.CUBETAS[nombre] = app.CubetaTokens(*app.TASAS_PROVEEDOR.get(nombre, (0, 1)))
+    UPSTREAM.reiniciar()
+    yield
+
+
+@pytest.fixture
+def upstream():
+    return UPSTREAM
+
+
+@pytest.fixture
+def cliente():
+    return app.app.test_client()
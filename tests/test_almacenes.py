@@ -0,0 +1,115 @@
+"""Backends compartidos de la cache: serialización, sqlite y Redis"""
+import os
+import time
+
+import pytest
+
+import app
+
+VALOR = {'payload': {'texto': 'ñandú ' * 50, 'segmentos': 3}, 'inicios': [0.0, 1.5, 3.25], 'negativo': False}
+
+
+@pytest.mark.parametrize('con_msgpack', [True, False])
+@pytest.mark.parametrize('con_zstd', [True, False])
+def test_serializacion_ida_y_vuelta(monkeypatch, con_msgpack, con_zstd):
+    if con_msgpack:
+        pytest.importorskip('msgpack')
+        monkeypatch.setattr(app, 'msgpack', __import__('msgpack'))
+    else:
+        monkeypatch.setattr(app, 'msgpack', None)
+    if con_zstd:
+        pytest.importorskip('zstandard')
+        monkeypatch.setattr(app, 'zstandard', __import__('zstandard'))
+    else:
+        monkeypatch.setattr(app, 'zstandard', None)
+
+    datos = app.serializar(VALOR)
+
+    assert datos[:2] == (b'M' if con_msgpack else b'J') + (b'Z' if con_zstd else b'z')
+    assert app.deserializar(datos) == VALOR
+
+
+def test_formato_sin_libreria_no_se_puede_leer(monkeypatch):
+    monkeypatch.setattr(app, 'msgpack', None)
+    with pytest.raises(ValueError):
+        app.deserializar(b'Mz' + __import__('zlib').compress(b'\x80'))
+
+
+@pytest.fixture
+def sqlite(tmp_path):
+    return app.AlmacenSqlite(str(tmp_path / 'cache.sqlite3'), max_bytes=2000)
+
+
+def test_sqlite_ida_y_vuelta(sqlite):
+    expira = time.time() + 60
+    sqlite.escribir('a', expira, VALOR)
+    assert sqlite.leer('a') == (expira, VALOR)
+    sqlite.borrar('a')
+    assert sqlite.leer('a') is None
+
+
+def test_sqlite_entre_workers(sqlite):
+    otro = app.AlmacenSqlite(sqlite.ruta, max_bytes=2000)
+    sqlite.escribir('a', time.time() + 60, VALOR)
+    assert otro.leer('a')[1] == VALOR
+
+
+def test_sqlite_no_supera_max_bytes_entre_revisiones(sqlite):
+    texto = os.urandom(200).hex()  # no comprime
+    for i in range(sqlite.REVISAR_CADA - 1):
+        sqlite.escribir(f'clave{i}', time.time() + 60, {'texto': texto})
+        assert sqlite._total() <= sqlite.max_bytes
+    assert sqlite.leer(f'clave{sqlite.REVISAR_CADA - 2}') is not None
+
+
+def test_sqlite_expulsa_vencidas_antes_que_vigentes(sqlite):
+    texto = os.urandom(200).hex()
+    sqlite.escribir('vencida', time.time() - 1, {'texto': texto})
+    sqlite.escribir('vigente', time.time() + 60, {'texto': texto})
+    sqlite.max_bytes = sqlite._total() - 1
+
+    assert sqlite.acotar() == 0
+    assert sqlite.leer('vencida') is None
+    assert sqlite.leer('vigente') is not None
+
+
+def test_sqlite_expulsa_la_menos_usada(sqlite):
+    texto = os.urandom(200).hex()
+    for clave in ('a', 'b', 'c'):
+        sqlite.escribir(clave, time.time() + 60, {'texto': texto})
+    sqlite._conexion().execute("UPDATE cache SET usado = 0 WHERE clave = 'b'")
+    sqlite.max_bytes = sqlite._total() - 1
+
+    assert sqlite.acotar() == 1
+    assert sqlite.leer('b') is None
+    assert sqlite.leer('a') is not None and sqlite.leer('c') is not None
+
+
+@pytest.fixture
+def redis_almacen():
+    redis = pytest.importorskip('redis')
+    url = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    try:
+        redis.Redis.from_url(url, socket_connect_timeout=0.2).ping()
+    except redis.RedisError:
+        pytest.skip(f'sin servidor Redis en {url}')
+    almacen = app.AlmacenRedis(url, prefijo=f'test:{os.getpid()}:')
+    yield almacen
+    for clave in almacen.cliente.scan_iter(almacen.prefijo + '*'):
+        almacen.cliente.delete(clave)
+
+
+def test_redis_ida_y_vuelta_con_ttl(redis_almacen):
+    expira = time.time() + 60
+    redis_almacen.escribir('a', expira, VALOR)
+
+    assert redis_almacen.leer('a') == (expira, VALOR)
+    assert 0 < redis_almacen.cliente.ttl(redis_almacen.prefijo + 'a') <= 60
+    redis_almacen.borrar('a')
+    assert redis_almacen.leer('a') is None
+
+
+def test_redis_sin_libreria_falla_al_crear(monkeypatch):
+    monkeypatch.setattr(app, 'redis', None)
+    with pytest.raises(RuntimeError):
+        app.AlmacenRedis()
@@ -0,0 +1,87 @@
+"""Modo ASGI: mismas respuestas que Flask, con /transcript y /transcripts resueltos en el event loop"""
+import asyncio
+import json
+
+import pytest
+
+httpx = pytest.importorskip('httpx')
+pytest.importorskip('a2wsgi')
+
+import app  # noqa: E402
+import asgi  # noqa: E402
+
+
+def pedir(metodo, url, **kwargs):
+    """Una petición en un loop propio; al terminar se cierran el cliente HTTP y los pools del loop"""
+    async def principal():
+        transporte = httpx.ASGITransport(app=asgi.app)
+        async with httpx.AsyncClient(transport=transporte, base_url='http://prueba') as cliente:
+            try:
+                return await cliente.request(metodo, url, **kwargs)
+            finally:
+                if asgi._estado is not None:
+                    await asgi._estado.cerrar()
+    return asyncio.run(principal())
+
+
+def test_transcript_igual_que_flask(cliente, upstream):
+    respuesta = pedir('GET', '/transcript?video_id=asgi1', headers={'X-Request-ID': 'traza-asgi1'})
+
+    assert respuesta.status_code == 200
+    assert respuesta.headers['x-cache'] == 'MISS'
+    assert respuesta.headers['x-request-id'] == 'traza-asgi1'
+    desde_flask = cliente.get('/transcript?video_id=asgi1')
+    assert desde_flask.headers['X-Cache'] == 'HIT'
+    assert desde_flask.get_json() == respuesta.json()
+
+
+def test_etag_y_304(cliente):
+    etag = pedir('GET', '/transcript?video_id=asgi2').headers['etag']
+    respuesta = pedir('GET', '/transcript?video_id=asgi2', headers={'If-None-Match': etag})
+    assert respuesta.status_code == 304
+    assert respuesta.content == b''
+
+
+def test_srt_en_flujo_comprimido():
+    respuesta = pedir('GET', '/transcript?video_id=asgi3&format=srt&stream=1', headers={'Accept-Encoding': 'gzip'})
+    assert respuesta.headers['content-encoding'] == 'gzip'
+    assert respuesta.text.startswith('1\n00:00:00,000 --> 00:00:02,000\n')
+    assert len(respuesta.text.split('\n\n')) == 20
+
+
+def test_validacion_la_hace_flask():
+    respuesta = pedir('GET', '/transcript?video_id=asgi4&estrategia=otra')
+    assert respuesta.status_code == 400
+    assert respuesta.json()['exito'] is False
+
+
+def test_lote_ndjson():
+    respuesta = pedir('POST', '/transcripts', json={'video_ids': ['asgi5', 'asgi6']})
+    lineas = [json.loads(linea) for linea in respuesta.text.splitlines()]
+    assert respuesta.headers['content-type'] == 'application/x-ndjson'
+    assert sorted(linea['video_id'] for linea in lineas) == ['asgi5', 'asgi6']
+    assert all(linea['exito'] for linea in lineas)
+
+
+def test_lote_invalido_llega_a_flask_con_el_cuerpo():
+    respuesta = pedir('POST', '/transcripts', content=b'{"video_ids": 3}',
+                      headers={'Content-Type': 'application/json'})
+    assert respuesta.status_code == 400
+    assert 'video_ids' in respuesta.json()['error']
+
+
+def test_rutas_sin_version_asincrona(upstream):
+    assert pedir('GET', '/check?video_id=asgi7').status_code == 200
+    assert upstream.llamadas['/ytdlp/info'] == 1
+    assert pedir('GET', '/no-existe').status_code == 404
+
+
+def test_excepcion_no_controlada_responde_json(monkeypatch):
+    def romper(*args, **kwargs):
+        raise RuntimeError('fallo inesperado')
+
+    monkeypatch.setattr(app, 'payload_de_entrada', romper)
+    respuesta = pedir('GET', '/transcript?video_id=asgi8')
+
+    assert respuesta.status_code == 500
+    assert respuesta.json() == {'exito': False, 'error': 'RuntimeError: fallo inesperado', 'video_id': 'asgi8'}
@@ -0,0 +1,66 @@
+"""/search sobre las transcripciones ya obtenidas"""
+import app
+
+
+def esperar_indice():
+    app.ejecutor_indice.submit(lambda: None).result(timeout=10)
+
+
+def test_busca_en_lo_obtenido(cliente):
+    cliente.get('/transcript?video_id=bus1')
+    esperar_indice()
+
+    datos = cliente.get('/search?q=frase 3&contexto=1').get_json()
+    assert datos['alcance'] == 'worker'
+    assert datos['total_coincidencias'] == 1
+    resultado, = datos['resultados']
+    assert resultado['video_id'] == 'bus1'
+    assert resultado['idioma'] == 'es'
+    assert resultado['inicio'] == 6
+    assert resultado['texto'].startswith('Frase 3 en es')
+    assert 'Frase 2' in resultado['contexto'] and 'Frase 4' in resultado['contexto']
+
+
+def test_todos_los_terminos_y_limite(cliente):
+    cliente.get('/transcript?video_id=bus2')
+    esperar_indice()
+    datos = cliente.get('/search?q=frase prueba&limite=3').get_json()
+    assert datos['total_coincidencias'] == 20
+    assert len(datos['resultados']) == 3
+    assert cliente.get('/search?q=frase inexistente').get_json()['total_coincidencias'] == 0
+
+
+def test_los_aciertos_de_cache_no_reindexan(cliente):
+    for _ in range(5):
+        cliente.get('/transcript?video_id=bus3')
+    esperar_indice()
+    assert app.indice_busqueda.estadisticas['indexados'] == 1
+
+
+def test_con_video_id_completa_desde_la_cache(cliente, monkeypatch):
+    cliente.get('/transcript?video_id=bus4')
+    esperar_indice()
+    # Como si la hubiera obtenido otro worker: está en la cache compartida pero no en este índice
+    monkeypatch.setattr(app, 'indice_busqueda', app.IndiceBusqueda(app.BUSQUEDA_MAX_VIDEOS))
+
+    datos = cliente.get('/search?q=frase 5&video_id=bus4').get_json()
+    assert datos['total_coincidencias'] == 1
+    assert 'alcance' not in datos
+
+
+def test_con_preferencia_de_varios_idiomas(cliente, upstream, monkeypatch):
+    upstream.idiomas = ['en']
+    assert cliente.get('/transcript?video_id=bus5&lang=es,en').get_json()['idioma'] == 'en'
+    monkeypatch.setattr(app, 'indice_busqueda', app.IndiceBusqueda(app.BUSQUEDA_MAX_VIDEOS))
+
+    datos = cliente.get('/search?q=frase 5&video_id=bus5&lang=es,en').get_json()
+    assert [r['idioma'] for r in datos['resultados']] == ['en']
+
+
+def test_errores(cliente):
+    assert cliente.get('/search').status_code == 400
+    assert cliente.get('/search?q=frase&limite=x').status_code == 400
+    assert cliente.get('/search?q=frase&lang=!!').status_code == 400
+    respuesta = cliente.get('/search?q=frase&video_id=nunca')
+    assert respuesta.status_code == 404
+    assert respuesta.get_json()['video_id'] == 'nunca'
@@ -0,0 +1,114 @@
+"""Cache de transcripciones: vencimiento, cache negativa, LRU en memoria y almacén en disco"""
+import os
+import time
+
+import app
+
+
+def test_entrada_vencida_no_se_devuelve(monkeypatch):
+    cache = app.CacheTranscripciones(max_entradas=10)
+    cache.guardar('a', {'payload': {}}, ttl=60)
+    assert cache.obtener('a') is not None
+
+    ahora = time.time()
+    monkeypatch.setattr(app.time, 'time', lambda: ahora + 61)
+    assert cache.obtener('a') is None
+    assert cache.resumen()['entradas_memoria'] == 0
+
+
+def test_memoria_expulsa_la_menos_usada():
+    cache = app.CacheTranscripciones(max_entradas=2)
+    cache.guardar('a', {'payload': {}}, ttl=60)
+    cache.guardar('b', {'payload': {}}, ttl=60)
+    cache.obtener('a')
+    cache.guardar('c', {'payload': {}}, ttl=60)
+
+    assert cache.obtener('b') is None
+    assert cache.obtener('a') is not None
+    assert cache.resumen()['expulsiones'] == 1
+
+
+def test_respuesta_positiva_se_sirve_de_cache(cliente, upstream):
+    primera = cliente.get('/transcript?video_id=cache1')
+    segunda = cliente.get('/transcript?video_id=cache1')
+
+    assert primera.headers['X-Cache'] == 'MISS'
+    assert segunda.headers['X-Cache'] == 'HIT'
+    assert segunda.get_json() == primera.get_json()
+    assert upstream.llamadas['/api/timedtext'] == 2
+
+
+def test_idioma_inexistente_se_cachea_como_negativo(cliente, upstream, monkeypatch):
+    guardados = []
+    guardar = app.cache_transcripciones.guardar
+    monkeypatch.setattr(app.cache_transcripciones, 'guardar',
+                        lambda clave, valor, ttl: guardados.append(ttl) or guardar(clave, valor, ttl))
+
+    primera = cliente.get('/transcript?video_id=cache2&lang=fr&proveedores=ytdlp')
+    segunda = cliente.get('/transcript?video_id=cache2&lang=fr&proveedores=ytdlp')
+
+    assert primera.status_code == segunda.status_code == 404
+    assert segunda.get_json()['idiomas_disponibles'] == ['es']
+    assert segunda.headers['X-Cache'] == 'HIT'
+    assert upstream.llamadas['/ytdlp/info'] == 1
+    assert guardados == [app.CACHE_TTL_NEGATIVO]
+    assert app.cache_transcripciones.resumen()['aciertos_negativos'] == 1
+
+
+def test_error_del_proveedor_no_se_cachea(cliente, upstream):
+    upstream.status['/api/timedtext'] = 500
+    assert cliente.get('/transcript?video_id=cache3&proveedores=timedtext').status_code >= 500
+
+    del upstream.status['/api/timedtext']
+    assert cliente.get('/transcript?video_id=cache3&proveedores=timedtext').headers['X-Cache'] == 'MISS'
+
+
+def test_disco_sobrevive_a_la_memoria(tmp_path):
+    almacen = app.AlmacenDirectorio(str(tmp_path))
+    app.CacheTranscripciones(max_entradas=10, almacen=almacen).guardar('a', {'payload': {'x': 'ñ'}}, ttl=60)
+
+    otra = app.CacheTranscripciones(max_entradas=10, almacen=almacen)
+    assert otra.obtener('a') == {'payload': {'x': 'ñ'}}
+    assert otra.resumen()['aciertos_disco'] == 1
+
+
+def test_disco_ignora_archivos_corruptos(tmp_path):
+    almacen = app.AlmacenDirectorio(str(tmp_path))
+    with open(almacen._archivo('a'), 'wb') as f:
+        f.write(b'no es gzip')
+    assert almacen.leer('a') is None
+
+
+def test_disco_limpia_los_vencidos(tmp_path):
+    almacen = app.AlmacenDirectorio(str(tmp_path))
+    almacen.escribir('vencida', time.time() - 1, {'x': 1})
+    almacen.escribir('vigente', time.time() + 60, {'x': 2})
+    with open(os.path.join(tmp_path, 'resto.json.gz.1.2.tmp'), 'w') as f:
+        f.write('a medias')
+    os.utime(os.path.join(tmp_path, 'resto.json.gz.1.2.tmp'), (0, 0))
+
+    almacen.acotar()
+
+    assert sorted(os.listdir(tmp_path)) == [os.path.basename(almacen._archivo('vigente'))]
+
+
+def test_disco_acota_por_cantidad_de_archivos(tmp_path):
+    almacen = app.AlmacenDirectorio(str(tmp_path), max_archivos=10)
+    for i in range(25):
+        almacen.escribir(f'clave{i}', time.time() + 60, {'i': i})
+        os.utime(almacen._archivo(f'clave{i}'), (i, time.time() + 60))  # atime = orden de uso
+
+    archivos = os.listdir(tmp_path)
+    assert len(archivos) <= 10
+    assert almacen.leer('clave24') is not None
+    assert almacen.leer('clave0') is None
+
+
+def test_disco_acota_por_bytes_sin_esperar_la_limpieza_periodica(tmp_path):
+    almacen = app.AlmacenDirectorio(str(tmp_path), max_bytes=4000)
+    texto = os.urandom(300).hex()  # no comprime
+    for i in range(20):
+        almacen.escribir(f'clave{i}', time.time() + 60, {'texto': texto})
+
+    total = sum(os.path.getsize(os.path.join(tmp_path, nombre)) for nombre in os.listdir(tmp_path))
+    assert total <= 4000
@@ -0,0 +1,234 @@
+"""Estrategia de proveedores: fallback, hedge, tiempos límite, interruptores y limitador"""
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+import app
+
+
+class Falso(app.Proveedor):
+    """Proveedor de prueba que tarda demora segundos y devuelve texto, None o un bloqueo"""
+
+    def __init__(self, nombre, demora=0.0, resultado='texto', timeout=5.0, ignora_cancelacion=False):
+        super().__init__(timeout)
+        self.nombre = nombre
+        self.demora = demora
+        self.resultado = resultado
+        self.ignora_cancelacion = ignora_cancelacion
+        self.llamadas = 0
+        self.timeouts = []
+        self.terminadas = threading.Event()
+
+    def obtener(self, video_id, idiomas, cancelado, timeout):
+        self.llamadas += 1
+        self.timeouts.append(timeout)
+        try:
+            if self.ignora_cancelacion:
+                time.sleep(self.demora)
+            elif cancelado.wait(self.demora):
+                return None
+            if self.resultado == 'bloqueo':
+                raise app.ProveedorBloqueado('429')
+            if self.resultado is None:
+                return None
+            texto = f'{self.resultado} de {self.nombre}'
+            return app.Resultado(app.Transcripcion.desde_texto(texto), idiomas[0], 'prueba', self.nombre)
+        finally:
+            self.terminadas.set()
+
+
+def registrar(*proveedores, tasa=(0, 1)):
+    app.PROVEEDORES.clear()
+    for proveedor in proveedores:
+        app.registrar_proveedor(proveedor, tasa=tasa)
+    return proveedores
+
+
+def config(**args):
+    args.setdefault('proveedores', ','.join(app.PROVEEDORES))
+    return app.leer_config_estrategia({k: str(v) for k, v in args.items()})
+
+
+def test_secuencial_pasa_al_siguiente():
+    a, b = registrar(Falso('a', resultado=None), Falso('b'))
+    payload, status, transcripcion = app.transcribir('vid', config())
+    assert status == 200
+    assert payload['metodo'] == 'b'
+    assert (a.llamadas, b.llamadas) == (1, 1)
+    assert transcripcion.texto_plano() == 'texto de b'
+
+
+def test_secuencial_no_llama_de_mas():
+    a, b = registrar(Falso('a'), Falso('b'))
+    assert app.transcribir('vid', config())[0]['metodo'] == 'a'
+    assert b.llamadas == 0
+
+
+def test_hedge_arranca_el_siguiente_sin_esperar_al_lento():
+    registrar(Falso('lento', demora=2), Falso('rapido'))
+    inicio = time.monotonic()
+    payload, status, _ = app.transcribir('vid', config(estrategia='hedged', hedge=0.1))
+    assert status == 200
+    assert payload['metodo'] == 'rapido'
+    assert time.monotonic() - inicio < 1
+
+
+def test_paralelo_gana_el_primero():
+    registrar(Falso('a', demora=0.3), Falso('b', demora=0.05))
+    assert app.transcribir('vid', config(estrategia='paralelo'))[0]['metodo'] == 'b'
+
+
+def test_timeout_de_proveedor_pasa_al_siguiente():
+    registrar(Falso('colgado', demora=5, timeout=0.1), Falso('b'))
+    payload, status, _ = app.transcribir('vid', config())
+    assert status == 200
+    assert payload['metodo'] == 'b'
+
+
+def test_timeout_del_unico_proveedor_es_504():
+    registrar(Falso('colgado', demora=5, timeout=0.1))
+    payload, status, _ = app.transcribir('vid', config())
+    assert status == 504
+    assert 'tiempo límite' in payload['error']
+
+
+def test_proveedor_recibe_lo_que_queda_del_deadline():
+    proveedor, = registrar(Falso('a', timeout=5))
+    assert app.transcribir('vid', config(deadline=0.5))[1] == 200
+    assert 0.4 < proveedor.timeouts[0] <= 0.5
+
+
+def test_deadline_global_es_504():
+    registrar(Falso('lento', demora=5))
+    inicio = time.monotonic()
+    payload, status, _ = app.transcribir('vid', config(deadline=0.2))
+    assert status == 504
+    assert time.monotonic() - inicio < 1
+    assert payload['error'] == 'Tiempo límite de 0.2s agotado'
+
+
+def test_circuito_abierto_se_omite():
+    registrar(Falso('a'), Falso('b'))
+    app.INTERRUPTORES['a'].registrar_fallo('429', bloqueo=True)
+    assert app.transcribir('vid', config())[0]['metodo'] == 'b'
+
+
+def test_todos_los_circuitos_abiertos_es_503():
+    registrar(Falso('a'), Falso('b'))
+    for interruptor in app.INTERRUPTORES.values():
+        interruptor.registrar_fallo('429', bloqueo=True)
+    payload, status, _ = app.transcribir('vid', config())
+    assert status == 503
+    assert payload['proveedores_omitidos'] == ['a', 'b']
+
+
+def test_bloqueo_abre_el_circuito():
+    registrar(Falso('a', resultado='bloqueo'), Falso('b'))
+    assert app.transcribir('vid', config())[1] == 200
+    assert app.INTERRUPTORES['a'].estado == 'abierto'
+
+
+def test_sin_tokens_espera_en_lugar_de_503():
+    proveedor, = registrar(Falso('a'), tasa=(10, 1))
+    resultados = [app.transcribir('vid', config())[1] for _ in range(3)]
+    assert resultados == [200, 200, 200]
+    assert proveedor.llamadas == 3
+
+
+def test_sin_tokens_por_mucho_tiempo_pasa_al_siguiente():
+    registrar(Falso('a'), tasa=(0.5, 1))  # el próximo token llega en 2 s
+    app.registrar_proveedor(Falso('b'))
+    assert app.transcribir('vid', config())[0]['metodo'] == 'a'
+
+    inicio = time.monotonic()
+    assert app.transcribir('vid', config())[0]['metodo'] == 'b'
+    assert time.monotonic() - inicio < app.TASA_ESPERA_MAX
+
+
+def test_sin_tokens_dentro_del_deadline_se_omite():
+    registrar(Falso('a'), tasa=(0.1, 1))
+    assert app.transcribir('vid', config())[1] == 200
+    payload, status, _ = app.transcribir('vid', config(deadline=1))
+    assert status == 503
+    # El turno no usado no queda reservado
+    assert app.CUBETAS['a'].resumen()['tokens'] >= 0
+
+
+def test_exito_tardio_abandonado_no_cierra_el_circuito():
+    proveedor, = registrar(Falso('colgado', demora=0.3, timeout=0.1, ignora_cancelacion=True))
+    app.INTERRUPTORES['colgado'] = app.Interruptor(1, 30, 600)
+    assert app.transcribir('vid', config())[1] == 504
+    assert app.INTERRUPTORES['colgado'].estado == 'abierto'
+
+    assert proveedor.terminadas.wait(2)
+    time.sleep(0.05)
+    assert app.INTERRUPTORES['colgado'].estado == 'abierto'
+
+
+@pytest.mark.parametrize('args, error', [
+    ({'deadline': 'nan'}, 'deadline'),
+    ({'deadline': '0'}, 'deadline'),
+    ({'deadline': '-2'}, 'deadline'),
+    ({'deadline': 'inf'}, 'deadline'),
+    ({'hedge': '-1'}, 'hedge'),
+    ({'hedge': '1,nan'}, 'hedge'),
+    ({'hedge': 'rapido'}, 'hedge'),
+    ({'estrategia': 'aleatoria'}, 'estrategia'),
+    ({'proveedores': 'timedtext,nadie'}, 'proveedores'),
+])
+def test_config_invalida(args, error):
+    with pytest.raises(ValueError, match=error):
+        app.leer_config_estrategia(args)
+
+
+def test_config_limita_deadline_y_deduplica():
+    datos = app.leer_config_estrategia({'deadline': '1e9', 'proveedores': 'rapidapi,timedtext,rapidapi',
+                                        'estrategia': 'hedged', 'hedge': '0.5'})
+    assert datos['deadline'] == app.ESTRATEGIA_DEADLINE
+    assert datos['orden'] == ['rapidapi', 'timedtext']
+    assert datos['retrasos'] == [0.5, 0.5]
+
+
+def test_asgi_toma_las_mismas_decisiones():
+    asgi = pytest.importorskip('asgi')
+    registrar(Falso('a', resultado=None), Falso('lento', demora=2), Falso('c'))
+    payload, status, _ = asyncio.run(asgi.transcribir('vid', config(estrategia='hedged', hedge=0.1)))
+    assert status == 200
+    assert payload['metodo'] == 'c'
+
+    registrar(Falso('colgado', demora=5, timeout=0.1))
+    assert asyncio.run(asgi.transcribir('vid', config()))[1] == 504
+
+
+# --- De punta a punta contra el upstream falso de benchmark_carga ---
+
+def test_transcript_miss_y_hit(cliente, upstream):
+    respuesta = cliente.get('/transcript?video_id=e2e00001')
+    assert respuesta.status_code == 200
+    assert respuesta.headers['X-Cache'] == 'MISS'
+    assert respuesta.get_json()['metodo'] == 'youtube_api_timedtext'
+
+    llamadas = sum(upstream.llamadas.values())
+    respuesta = cliente.get('/transcript?video_id=e2e00001')
+    assert respuesta.headers['X-Cache'] == 'HIT'
+    assert sum(upstream.llamadas.values()) == llamadas
+
+
+def test_timedtext_bloqueado_pasa_a_rapidapi(cliente, upstream):
+    upstream.bloquear_timedtext = True
+    respuesta = cliente.get('/transcript?video_id=e2e00002')
+    assert respuesta.status_code == 200
+    assert respuesta.get_json()['tipo_subtitulos'] == 'API externa'
+    assert app.INTERRUPTORES['timedtext'].estado == 'abierto'
+
+
+def test_lote_ndjson(cliente):
+    respuesta = cliente.post('/transcripts', json={'video_ids': [f'e2e1{i:04d}' for i in range(5)]})
+    assert respuesta.status_code == 200
+    assert respuesta.mimetype == 'application/x-ndjson'
+    items = [json.loads(linea) for linea in respuesta.get_data(as_text=True).splitlines() if linea]
+    assert len(items) == 5
+    assert all(item['exito'] for item in items)
@@ -0,0 +1,85 @@
+"""Formatos de respuesta (text, segments, srt, vtt) y forma de la transcripción en la cache"""
+import json
+
+import pytest
+
+import app
+from upstream_falso import frases
+
+
+def transcripcion_de_prueba():
+    transcripcion = app.Transcripcion()
+    transcripcion.agregar(0.0, 1.5, 'Hola  mundo')
+    transcripcion.agregar(1.5, 2.25, '  ')  # los segmentos vacíos se descartan
+    transcripcion.agregar(3661.0, 0.5, 'ñandú\nfinal')
+    return transcripcion
+
+
+def test_segmentos_normalizan_espacios_y_descartan_vacios():
+    transcripcion = transcripcion_de_prueba()
+    assert transcripcion.texto_plano() == 'Hola mundo ñandú final'
+    assert transcripcion.segmentos() == [
+        {'inicio': 0.0, 'duracion': 1.5, 'texto': 'Hola mundo'},
+        {'inicio': 3661.0, 'duracion': 0.5, 'texto': 'ñandú final'},
+    ]
+
+
+def test_srt_y_vtt():
+    transcripcion = transcripcion_de_prueba()
+    assert transcripcion.a_srt() == ('1\n00:00:00,000 --> 00:00:01,500\nHola mundo\n\n'
+                                     '2\n01:01:01,000 --> 01:01:01,500\nñandú final\n')
+    assert transcripcion.a_vtt() == ('WEBVTT\n\n00:00:00.000 --> 00:00:01.500\nHola mundo\n\n'
+                                     '01:01:01.000 --> 01:01:01.500\nñandú final\n')
+
+
+def test_dict_de_cache_ida_y_vuelta_por_json():
+    transcripcion = transcripcion_de_prueba()
+    copia = app.Transcripcion.desde_dict(json.loads(json.dumps(transcripcion.a_dict())))
+
+    assert list(copia) == list(transcripcion)
+    assert copia.huella() == transcripcion.huella()
+
+
+def test_entradas_viejas_con_listas_se_siguen_leyendo():
+    viejo = {'inicios': [0.0, 3661.0], 'duraciones': [1.5, 0.5], 'offsets': [0, 11],
+             'texto': 'Hola mundo ñandú final'}
+    assert list(app.Transcripcion.desde_dict(viejo)) == list(transcripcion_de_prueba())
+
+
+@pytest.mark.parametrize('cache', ['MISS', 'HIT'])
+def test_format_segments(cliente, cache):
+    respuesta = cliente.get('/transcript?video_id=fmt1&format=segments')
+    if cache == 'HIT':
+        respuesta = cliente.get('/transcript?video_id=fmt1&format=segments')
+
+    assert respuesta.headers['X-Cache'] == cache
+    datos = respuesta.get_json()
+    assert datos['segmentos'][:2] == [
+        {'inicio': 0.0, 'duracion': 2.0, 'texto': frases('es', 2)[0]},
+        {'inicio': 2.0, 'duracion': 2.0, 'texto': frases('es', 2)[1]},
+    ]
+    assert len(datos['segmentos']) == datos['total_segmentos'] == 20
+    assert datos['transcripcion'] == ' '.join(frases('es', 20))
+
+
+def test_format_srt(cliente):
+    respuesta = cliente.get('/transcript?video_id=fmt2&format=srt')
+    assert respuesta.mimetype == 'application/x-subrip'
+    bloques = respuesta.get_data(as_text=True).split('\n\n')
+    assert len(bloques) == 20
+    assert bloques[1] == f"2\n00:00:02,000 --> 00:00:04,000\n{frases('es', 2)[1]}"
+
+
+def test_format_vtt(cliente):
+    respuesta = cliente.get('/transcript?video_id=fmt3&format=vtt')
+    assert respuesta.mimetype == 'text/vtt'
+    texto = respuesta.get_data(as_text=True)
+    assert texto.startswith('WEBVTT\n\n00:00:00.000 --> 00:00:02.000\n')
+    assert texto.rstrip().endswith(frases('es', 20)[-1])
+
+
+def test_format_desconocido(cliente, upstream):
+    respuesta = cliente.get('/transcript?video_id=fmt4&format=pdf')
+    assert respuesta.status_code == 400
+    assert respuesta.get_json()['exito'] is False
+    assert not upstream.llamadas
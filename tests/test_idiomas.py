@@ -0,0 +1,91 @@
+"""Preferencia de idiomas (lang) y varios idiomas en una respuesta (langs)"""
+import pytest
+
+import app
+
+
+def test_leer_idiomas():
+    assert app.leer_idiomas('es-MX, es,,es') == ['es-MX', 'es']
+    assert app.leer_idiomas(None) == app.IDIOMA_POR_DEFECTO.split(',')
+    for invalido in ('español', 'es;q=1', ','.join(f'a{chr(97 + i)}' for i in range(app.IDIOMAS_MAX + 1))):
+        with pytest.raises(ValueError):
+            app.leer_idiomas(invalido)
+
+
+def test_candidatos_incluyen_variantes_regionales():
+    disponibles = ['en', 'es-419', 'es-ES', 'pt']
+    assert app.candidatos_idioma('es', disponibles) == ['es-419', 'es-ES']
+    assert app.candidatos_idioma('es-ES', disponibles) == ['es-ES', 'es-419']
+    assert app.candidatos_idioma('fr', disponibles) == []
+
+
+def test_accept_language_sigue_la_preferencia():
+    cabeceras = app.cabeceras_timedtext(['es-MX', 'es', 'en'])
+    assert cabeceras['Accept-Language'] == 'es-MX,es;q=0.9,en;q=0.8'
+
+
+@pytest.mark.parametrize('proveedor', ['timedtext', 'ytdlp'])
+def test_primer_idioma_disponible_en_orden_de_preferencia(cliente, upstream, proveedor):
+    upstream.idiomas = ['en', 'es']
+    respuesta = cliente.get(f'/transcript?video_id=idi1{proveedor}&lang=fr,es,en&proveedores={proveedor}')
+    assert respuesta.get_json()['idioma'] == 'es'
+    assert 'Frase 0 en es' in respuesta.get_json()['transcripcion']
+
+
+def test_variante_regional_cuando_falta_el_idioma_base(cliente, upstream):
+    upstream.idiomas = ['es-419']
+    respuesta = cliente.get('/transcript?video_id=idi2&lang=es&proveedores=timedtext')
+    assert respuesta.get_json()['idioma'] == 'es-419'
+
+
+def test_preferencia_pesa_mas_que_el_tipo_de_pista(cliente, upstream):
+    upstream.idiomas = ['es']
+    upstream.automaticos = ['en']
+    respuesta = cliente.get('/transcript?video_id=idi3&lang=en,es&proveedores=ytdlp')
+    assert respuesta.get_json()['idioma'] == 'en'
+
+
+def test_cada_preferencia_tiene_su_clave_de_cache(cliente):
+    assert cliente.get('/transcript?video_id=idi4&lang=es').headers['X-Cache'] == 'MISS'
+    assert cliente.get('/transcript?video_id=idi4&lang=es,en').headers['X-Cache'] == 'MISS'
+    assert cliente.get('/transcript?video_id=idi4&lang=es').headers['X-Cache'] == 'HIT'
+
+
+def test_lang_invalido(cliente, upstream):
+    respuesta = cliente.get('/transcript?video_id=idi5&lang=<script>')
+    assert respuesta.status_code == 400
+    assert not upstream.llamadas
+
+
+def test_langs_descarga_cada_idioma(cliente, upstream):
+    upstream.idiomas = ['es', 'en']
+    respuesta = cliente.get('/transcript?video_id=idi6&langs=es,en&proveedores=timedtext')
+    datos = respuesta.get_json()
+
+    assert datos['idiomas_encontrados'] == ['es', 'en']
+    assert 'Frase 0 en en' in datos['idiomas']['en']['transcripcion']
+    assert respuesta.headers['X-Cache'] == 'es=MISS, en=MISS'
+    assert upstream.llamadas['/api/timedtext'] == 3  # una lista compartida y dos pistas
+
+    segunda = cliente.get('/transcript?video_id=idi6&lang=en&proveedores=timedtext')
+    assert segunda.headers['X-Cache'] == 'HIT'
+
+
+def test_langs_con_un_idioma_faltante(cliente, upstream):
+    respuesta = cliente.get('/transcript?video_id=idi7&langs=es,fr&proveedores=ytdlp&format=segments')
+    datos = respuesta.get_json()
+
+    assert respuesta.status_code == 200
+    assert datos['idiomas_encontrados'] == ['es']
+    assert datos['idiomas']['fr']['status'] == 404
+    assert len(datos['idiomas']['es']['segmentos']) == 20
+
+
+def test_langs_sin_ningun_idioma(cliente):
+    respuesta = cliente.get('/transcript?video_id=idi8&langs=fr,de&proveedores=ytdlp')
+    assert respuesta.status_code == 404
+    assert respuesta.get_json()['exito'] is False
+
+
+def test_langs_solo_admite_text_y_segments(cliente):
+    assert cliente.get('/transcript?video_id=idi9&langs=es,en&format=srt').status_code == 400
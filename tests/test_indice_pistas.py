@@ -0,0 +1,67 @@
+"""Índice de pistas por video: una sola lista o extracción para todos los idiomas"""
+import time
+
+import app
+
+
+def test_timedtext_lista_idiomas_una_sola_vez(cliente, upstream):
+    upstream.idiomas = ['es', 'en']
+    assert cliente.get('/transcript?video_id=ind1&lang=es&proveedores=timedtext').status_code == 200
+    assert upstream.llamadas['/api/timedtext'] == 2  # lista y pista
+
+    respuesta = cliente.get('/transcript?video_id=ind1&lang=en&proveedores=timedtext')
+    assert respuesta.get_json()['idioma'] == 'en'
+    assert upstream.llamadas['/api/timedtext'] == 3  # solo la pista nueva
+
+    indice = app.obtener_indice('ind1')
+    assert indice['fuente'] == 'timedtext' and not indice['completo']
+    assert list(indice['manuales']) == ['es', 'en']
+
+
+def test_ytdlp_reutiliza_el_indice_completo(cliente, upstream):
+    upstream.idiomas = ['es']
+    upstream.automaticos = ['en']
+    cliente.get('/transcript?video_id=ind2&lang=es&proveedores=ytdlp')
+    respuesta = cliente.get('/transcript?video_id=ind2&lang=en&proveedores=ytdlp')
+
+    assert respuesta.get_json()['idioma'] == 'en'
+    assert upstream.llamadas['/ytdlp/info'] == 1
+    assert upstream.llamadas['/pistas/ind2.en.json3'] == 1
+
+
+def test_indice_parcial_no_evita_la_extraccion(cliente, upstream):
+    upstream.automaticos = ['en']
+    cliente.get('/transcript?video_id=ind3&lang=es&proveedores=timedtext')
+    respuesta = cliente.get('/transcript?video_id=ind3&lang=en&proveedores=ytdlp')
+
+    assert respuesta.get_json()['idioma'] == 'en'
+    assert upstream.llamadas['/ytdlp/info'] == 1
+    assert app.obtener_indice('ind3')['completo']
+
+
+def test_urls_vencidas_fuerzan_otra_extraccion(cliente, upstream, monkeypatch):
+    cliente.get('/transcript?video_id=ind4&lang=es&proveedores=ytdlp')
+    app.guardar_indice('ind4', dict(app.obtener_indice('ind4'), expira_urls=time.time()))
+
+    monkeypatch.setattr(app, 'cache_transcripciones', app.crear_cache())  # que no responda la cache
+    assert cliente.get('/transcript?video_id=ind4&lang=es&proveedores=ytdlp').status_code == 200
+    assert upstream.llamadas['/ytdlp/info'] == 2
+
+
+def test_traducciones_guardan_una_sola_url_plantilla():
+    url = 'https://www.youtube.com/api/timedtext?v=x&lang=en&tlang={}&fmt=json3&expire=2000000000'
+    info = {'title': 'Video', 'subtitles': {},
+            'automatic_captions': {lang: [{'ext': 'json3', 'url': url.format(lang)}] for lang in ('fr', 'de', 'it')}}
+    indice = app.indexar_info('ind5', info)
+
+    assert indice['traduccion'] == url.format('fr')
+    assert indice['expira_urls'] == 2000000000
+    assert all('url' not in pista for pista in indice['automaticos'].values())
+    pista = app.pista_de_indice(indice, 'automaticos', 'de')
+    assert 'tlang=de' in pista[0]['url']
+
+
+def test_url_que_expira_pronto_no_esta_vigente():
+    indice = {'expira_urls': time.time() + app.INDICE_MARGEN_URL - 1}
+    assert not app.urls_vigentes(indice)
+    assert app.urls_vigentes({'expira_urls': None})
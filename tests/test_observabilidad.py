@@ -0,0 +1,34 @@
+"""Errores no controlados, trace id y /metrics"""
+import app
+
+
+def romper(*args, **kwargs):
+    raise RuntimeError('fallo inesperado')
+
+
+def test_excepcion_no_controlada_responde_json(cliente, monkeypatch):
+    monkeypatch.setattr(app, 'obtener_entrada', romper)
+    respuesta = cliente.get('/transcript?video_id=obs1', headers={'X-Request-ID': 'traza-obs1'})
+
+    assert respuesta.status_code == 500
+    assert respuesta.get_json() == {'exito': False, 'error': 'RuntimeError: fallo inesperado', 'video_id': 'obs1'}
+    assert respuesta.headers['X-Request-ID'] == 'traza-obs1'
+    metricas = cliente.get('/metrics').get_data(as_text=True)
+    assert 'transcripciones_peticiones_total{endpoint="obtener_transcripcion",status="500"}' in metricas
+
+
+def test_errores_http_conservan_su_status(cliente):
+    assert cliente.get('/no-existe').status_code == 404
+    assert cliente.post('/transcript?video_id=obs2').status_code == 405
+
+
+def test_trace_id_generado_si_no_viene(cliente):
+    respuesta = cliente.get('/transcript?video_id=obs3')
+    assert len(respuesta.headers['X-Request-ID']) == 16
+
+
+def test_metricas_por_proveedor(cliente):
+    cliente.get('/transcript?video_id=obs4&proveedores=timedtext')
+    metricas = cliente.get('/metrics').get_data(as_text=True)
+    assert metricas.startswith('# HELP')
+    assert 'proveedor="timedtext"' in metricas
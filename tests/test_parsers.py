@@ -0,0 +1,68 @@
+"""Parsers incrementales: el resultado no depende de cómo lleguen los chunks"""
+import json
+
+import pytest
+
+import app
+
+SRV1 = ('<?xml version="1.0" encoding="utf-8" ?><transcript>'
+        '<text start="0.5" dur="1.5">Año &amp;amp; niño</text>'
+        '<text start="2" dur="2.25">está &amp;#39;aquí&amp;#39;</text>'
+        '</transcript>')
+SRV3 = ('<?xml version="1.0" encoding="utf-8" ?><timedtext format="3"><body>'
+        '<p t="500" d="1500">Año &amp; niño</p>'
+        '<p t="2000" d="2250">está <s>aquí</s></p>'
+        '</body></timedtext>')
+JSON3 = json.dumps({'events': [
+    {'tStartMs': 500, 'dDurationMs': 1500, 'segs': [{'utf8': 'Año '}, {'utf8': 'niño'}]},
+    {'tStartMs': 1000},
+    {'tStartMs': 2000, 'dDurationMs': 2250, 'text': 'está aquí'},
+]}, ensure_ascii=False)
+VTT = ('WEBVTT\n\n'
+       '00:00:00.500 --> 00:00:02.000 align:start\nAño <c>niño</c>\n\n'
+       '00:00:02.000 --> 00:00:04.250\nestá\naquí\n')
+
+CASOS = {
+    'srv1': (app.parsear_srv3, SRV1, ["Año & niño", "está 'aquí'"]),
+    'srv3': (app.parsear_srv3, SRV3, ['Año & niño', 'está aquí']),
+    'json3': (app.parsear_json3, JSON3, ['Año niño', 'está aquí']),
+    'vtt': (app.parsear_vtt, VTT, ['Año niño', 'está aquí']),
+}
+
+
+def en_chunks(texto, tamaño):
+    data = texto.encode('utf-8')
+    return (data[i:i + tamaño] for i in range(0, len(data), tamaño))
+
+
+@pytest.mark.parametrize('formato', CASOS)
+def test_parser_str_bytes_y_chunks(formato):
+    parsear, documento, textos = CASOS[formato]
+    esperado = [(0.5, 1.5, textos[0]), (2.0, 2.25, textos[1])]
+
+    assert list(parsear(documento)) == esperado
+    assert list(parsear(documento.encode('utf-8'))) == esperado
+    # Chunks de 1 y 3 bytes parten los caracteres multibyte (ñ, á) por la mitad
+    for tamaño in (1, 3, 7):
+        assert list(parsear(en_chunks(documento, tamaño))) == esperado
+
+
+def test_parser_srv3_push():
+    parser = app.ParserSrv3()
+    datos = SRV3.encode('utf-8')
+    mitad = datos.index('niño'.encode('utf-8')) + 2  # en medio de la ñ
+    assert parser.alimentar(datos[:mitad]) == []
+    segmentos = parser.alimentar(datos[mitad:])
+    segmentos += parser.cerrar()
+    assert [texto for _, _, texto in segmentos] == ['Año & niño', 'está aquí']
+
+
+@pytest.mark.parametrize('parsear', [app.parsear_srv3, app.parsear_json3])
+def test_parser_basura(parsear):
+    assert parsear('esto no es <un documento') is None
+
+
+def test_por_contenido_sin_eventos():
+    transcripcion = app.parsear_por_contenido('{"events" mal formado}')
+    assert transcripcion.texto_plano()
+    assert len(transcripcion) == 1
@@ -0,0 +1,83 @@
+"""Proveedores reales contra el upstream falso: tiempos límite y reintentos"""
+import time
+
+import pytest
+import requests
+
+import app
+
+
+def test_timeout_del_proveedor_llega_a_la_llamada_http(upstream):
+    upstream.latencia = 2
+    proveedor = app.ProveedorRapidAPI(timeout=0.3, reintentos=0)
+    inicio = time.monotonic()
+    with pytest.raises(requests.Timeout):
+        proveedor.ejecutar('vid', ['es'], app.Cancelacion())
+    assert time.monotonic() - inicio < 1
+
+
+def test_timedtext_reparte_el_tiempo_entre_lista_y_descarga(upstream):
+    upstream.latencia = 0.2
+    proveedor = app.ProveedorTimedtext(timeout=0.3, reintentos=0)
+    inicio = time.monotonic()
+    with pytest.raises(requests.RequestException):
+        proveedor.ejecutar('vid', ['es'], app.Cancelacion())
+    assert time.monotonic() - inicio < 0.6
+
+
+def test_ytdlp_descarga_pistas_con_el_tiempo_restante(upstream, monkeypatch):
+    monkeypatch.setattr(app, 'extraer_info_subtitulos', lambda video_id: (time.sleep(0.3), {
+        'id': video_id, 'title': '', 'automatic_captions': {},
+        'subtitles': {'es': [{'ext': 'vtt', 'url': app.TIMEDTEXT_URL.replace('/api/timedtext', '/pistas/v.es.vtt')}]},
+    })[1])
+    upstream.latencia = 1
+    inicio = time.monotonic()
+    with pytest.raises(requests.RequestException):
+        app.ProveedorYtdlp(timeout=0.5, reintentos=0).ejecutar('vid', ['es'], app.Cancelacion())
+    assert time.monotonic() - inicio < 0.9
+
+
+class Caido(app.Proveedor):
+    nombre = 'caido'
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.llamadas = 0
+
+    def obtener(self, video_id, idiomas, cancelado, timeout):
+        self.llamadas += 1
+        raise requests.ConnectionError('conexión rechazada')
+
+
+def test_reintenta_dentro_del_tiempo():
+    proveedor = Caido(timeout=5, reintentos=2, espera=0.01)
+    with pytest.raises(requests.ConnectionError):
+        proveedor.ejecutar('vid', ['es'], app.Cancelacion())
+    assert proveedor.llamadas == 3
+
+
+def test_no_reintenta_si_no_queda_tiempo():
+    proveedor = Caido(timeout=0.2, reintentos=3, espera=1)
+    inicio = time.monotonic()
+    with pytest.raises(requests.ConnectionError):
+        proveedor.ejecutar('vid', ['es'], app.Cancelacion())
+    assert proveedor.llamadas == 1
+    assert time.monotonic() - inicio < 0.1
+
+
+def test_plugin_sin_obtener_falla_al_registrarse():
+    class Incompleto(app.Proveedor):
+        nombre = 'incompleto'
+
+    with pytest.raises(TypeError):
+        app.registrar_proveedor(Incompleto())
+
+
+class SinNombre(Caido):
+    nombre = None
+
+
+@pytest.mark.parametrize('proveedor', [object(), SinNombre()])
+def test_registrar_exige_un_proveedor_con_nombre(proveedor):
+    with pytest.raises(TypeError):
+        app.registrar_proveedor(proveedor)
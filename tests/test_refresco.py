@@ -0,0 +1,84 @@
+"""Refresco en segundo plano de videos populares y precarga con /prefetch"""
+import time
+
+import pytest
+
+import app
+
+
+def esperar_refrescador(timeout=10):
+    limite = time.monotonic() + timeout
+    while app.refrescador.resumen()['pendientes']:
+        assert time.monotonic() < limite, 'el refresco no terminó'
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def refresco(monkeypatch):
+    """Refresco activo desde la primera petición, con todas las entradas a punto de expirar"""
+    monkeypatch.setattr(app, 'REFRESCO_ACTIVO', True)
+    monkeypatch.setattr(app, 'REFRESCO_MIN_PUNTAJE', 1)
+    monkeypatch.setattr(app.cache_transcripciones, 'vigencia', lambda clave: 1)
+    yield
+    esperar_refrescador()  # que ningún refresco siga corriendo en el test siguiente
+
+
+def test_video_popular_se_refresca_sin_gastar_la_cubeta(cliente, upstream, refresco):
+    assert cliente.get('/transcript?video_id=pop1').headers['X-Cache'] == 'MISS'
+    esperar_refrescador()  # la primera petición ya lo ve cerca de expirar
+    antes = dict(app.refrescador.estadisticas)
+    tokens = app.CUBETAS['timedtext'].resumen()['tokens']
+    llamadas = upstream.llamadas['/api/timedtext']
+
+    assert cliente.get('/transcript?video_id=pop1').headers['X-Cache'] == 'HIT'
+    esperar_refrescador()
+
+    assert app.refrescador.estadisticas['refrescados'] == antes['refrescados'] + 1
+    assert upstream.llamadas['/api/timedtext'] > llamadas
+    assert app.CUBETAS['timedtext'].resumen()['tokens'] >= tokens
+
+
+def test_refresco_fallido_conserva_la_entrada(cliente, upstream, refresco):
+    respuesta = cliente.get('/transcript?video_id=pop2&proveedores=timedtext')
+    esperar_refrescador()
+    antes = dict(app.refrescador.estadisticas)
+
+    upstream.status['/api/timedtext'] = 500
+    cliente.get('/transcript?video_id=pop2&proveedores=timedtext')
+    esperar_refrescador()
+
+    assert app.refrescador.estadisticas['sin_cambios'] == antes['sin_cambios'] + 1
+    segunda = cliente.get('/transcript?video_id=pop2&proveedores=timedtext')
+    assert segunda.status_code == 200
+    assert segunda.get_json() == respuesta.get_json()
+
+
+def test_sin_refresco_no_hay_trabajo_en_segundo_plano(cliente, upstream):
+    for _ in range(5):
+        cliente.get('/transcript?video_id=pop3')
+    assert upstream.llamadas['/api/timedtext'] == 2  # lista de idiomas y pista, una sola vez
+
+
+def test_prefetch_exige_admin_token(cliente, monkeypatch):
+    monkeypatch.setattr(app, 'ADMIN_TOKEN', '')
+    assert cliente.post('/prefetch', json={'video_ids': ['pre1']}).status_code == 403
+
+    monkeypatch.setattr(app, 'ADMIN_TOKEN', 'secreto')
+    assert cliente.post('/prefetch', json={'video_ids': ['pre1']}).status_code == 403
+    assert cliente.post('/prefetch', json={'video_ids': ['pre1']},
+                        headers={'X-Admin-Token': 'otro'}).status_code == 403
+
+
+def test_prefetch_precarga_lo_que_no_esta_en_cache(cliente, monkeypatch):
+    monkeypatch.setattr(app, 'ADMIN_TOKEN', 'secreto')
+    cabeceras = {'X-Admin-Token': 'secreto'}
+    cliente.get('/transcript?video_id=pre2')
+
+    respuesta = cliente.post('/prefetch', json={'video_ids': ['pre2', 'pre3', 'pre3']}, headers=cabeceras)
+    assert respuesta.status_code == 202
+    assert respuesta.get_json()['encolados'] == ['pre3']
+    assert respuesta.get_json()['omitidos'] == ['pre2']
+    esperar_refrescador()
+
+    assert cliente.get('/transcript?video_id=pre3').headers['X-Cache'] == 'HIT'
+    assert cliente.post('/prefetch', json={'video_ids': 'pre4'}, headers=cabeceras).status_code == 400
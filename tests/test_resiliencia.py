@@ -0,0 +1,149 @@
+"""Token bucket e interruptor de los proveedores"""
+import time
+
+import pytest
+
+import app
+
+
+def test_cubeta_sin_tasa_no_limita():
+    cubeta = app.CubetaTokens(0, 1)
+    assert all(cubeta.tomar() for _ in range(100))
+    assert cubeta.reservar(0) == 0.0
+
+
+def test_cubeta_reserva_turnos():
+    cubeta = app.CubetaTokens(10, 3)
+    assert [cubeta.reservar(0) for _ in range(3)] == [0.0, 0.0, 0.0]
+
+    # Sin ráfaga: el siguiente token llega en 1/tasa y el otro en 2/tasa
+    assert cubeta.reservar(1) == pytest.approx(0.1, abs=0.02)
+    assert cubeta.reservar(1) == pytest.approx(0.2, abs=0.02)
+    assert cubeta.resumen()['tokens'] < 0
+
+    # Por encima de espera_max no reserva nada
+    tokens = cubeta.tokens
+    assert cubeta.reservar(0.05) is None
+    assert cubeta.tokens == pytest.approx(tokens, abs=0.1)
+
+    cubeta.devolver()
+    assert cubeta.reservar(1) == pytest.approx(0.2, abs=0.02)
+
+
+def test_cubeta_se_recarga():
+    cubeta = app.CubetaTokens(50, 1)
+    assert cubeta.tomar()
+    assert not cubeta.tomar()
+    time.sleep(0.05)
+    assert cubeta.tomar()
+
+
+def test_cubeta_tasa_adaptativa():
+    cubeta = app.CubetaTokens(8, 1)
+    cubeta.reducir()
+    assert cubeta.tasa == 4
+    for _ in range(100):
+        cubeta.reducir()
+    assert cubeta.tasa == 8 / 32
+    for _ in range(100):
+        cubeta.recuperar()
+    assert cubeta.tasa == 8
+
+
+def test_interruptor_abre_por_fallos_seguidos():
+    interruptor = app.Interruptor(3, 30, 600)
+    assert not interruptor.registrar_fallo('error')
+    assert not interruptor.registrar_fallo('error')
+    assert interruptor.registrar_fallo('error')
+    assert interruptor.estado == 'abierto'
+    assert not interruptor.permitir()
+
+
+def test_interruptor_exito_reinicia_la_cuenta():
+    interruptor = app.Interruptor(2, 30, 600)
+    interruptor.registrar_fallo('error')
+    interruptor.registrar_exito()
+    assert not interruptor.registrar_fallo('error')
+    assert interruptor.estado == 'cerrado'
+
+
+def test_interruptor_bloqueo_abre_de_inmediato():
+    interruptor = app.Interruptor(5, 30, 600)
+    assert interruptor.registrar_fallo('429', bloqueo=True)
+    assert interruptor.resumen()['motivo'] == '429'
+
+
+def test_interruptor_semiabierto_una_sola_sonda():
+    interruptor = app.Interruptor(1, 0.05, 1)
+    interruptor.registrar_fallo('error')
+    time.sleep(0.06)
+
+    assert interruptor.permitir()
+    assert interruptor.estado == 'semiabierto'
+    assert not interruptor.permitir()
+
+    # Una sonda sin información (cancelada, limitada) deja probar a otra
+    interruptor.registrar_neutro()
+    assert interruptor.permitir()
+
+    interruptor.registrar_exito()
+    assert interruptor.estado == 'cerrado'
+    assert interruptor.permitir() and interruptor.permitir()
+
+
+def test_interruptor_sonda_fallida_duplica_enfriamiento():
+    interruptor = app.Interruptor(1, 0.05, 0.15)
+    interruptor.registrar_fallo('error')
+    for esperado in (0.1, 0.15):
+        time.sleep(interruptor.enfriamiento + 0.01)
+        assert interruptor.permitir()
+        assert interruptor.registrar_fallo('error')
+        assert interruptor.enfriamiento == pytest.approx(esperado)
+
+
+def test_proveedor_limitado_libera_la_sonda():
+    app.CUBETAS['timedtext'] = app.CubetaTokens(1, 1)
+    interruptor = app.INTERRUPTORES['timedtext'] = app.Interruptor(1, 0.01, 1)
+    interruptor.registrar_fallo('error')
+    time.sleep(0.02)
+    app.CUBETAS['timedtext'].tomar()
+
+    assert app.proveedor_disponible('timedtext') == (None, 'limitado')
+    assert interruptor.permitir()  # la sonda quedó libre
+
+
+@pytest.mark.parametrize('proveedor, ruta, status', [
+    (app.ProveedorRapidAPI(timeout=5), '/rapidapi/transcript', 503),
+    (app.ProveedorRapidAPI(timeout=5), '/rapidapi/transcript', 401),
+    (app.ProveedorTimedtext(timeout=5), '/api/timedtext', 500),
+])
+def test_rafaga_de_errores_upstream_abre_el_circuito(upstream, proveedor, ruta, status):
+    app.registrar_proveedor(proveedor)
+    app.CUBETAS[proveedor.nombre] = cubeta = app.CubetaTokens(100, 100)
+    cubeta.reducir()
+    upstream.status[ruta] = status
+    config = app.leer_config_estrategia({'proveedores': proveedor.nombre})
+
+    for _ in range(app.INTERRUPTOR_UMBRAL):
+        payload, codigo, _ = app.transcribir('vid', config)
+        assert codigo == 500
+        assert str(status) in payload['error']
+    assert app.INTERRUPTORES[proveedor.nombre].estado == 'abierto'
+    assert cubeta.tasa == 50  # los errores no cuentan como éxito para el limitador
+    assert app.transcribir('vid', config)[1] == 503
+
+
+def test_404_de_rapidapi_no_es_un_fallo(upstream):
+    app.registrar_proveedor(app.ProveedorRapidAPI(timeout=5))
+    upstream.status['/rapidapi/transcript'] = 404
+    config = app.leer_config_estrategia({'proveedores': 'rapidapi'})
+    for _ in range(app.INTERRUPTOR_UMBRAL):
+        assert app.transcribir('vid', config)[1] == 502
+    assert app.INTERRUPTORES['rapidapi'].estado == 'cerrado'
+
+
+def test_subtitulos_que_dicen_sorry_no_son_bloqueo():
+    texto = "I'm so sorry, I didn't mean to say that. " * 3
+    resultado = app.ProveedorTimedtext().resultado(app.Transcripcion.desde_texto(texto), 'en')
+    assert resultado is not None
+    assert 'sorry' in resultado.transcripcion.texto_plano()
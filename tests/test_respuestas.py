@@ -0,0 +1,78 @@
+"""Compresión gzip/br, ETag con 304 y respuestas en streaming"""
+import gzip
+import json
+
+import pytest
+
+import app
+
+
+def test_gzip_cuando_el_cliente_lo_acepta(cliente):
+    normal = cliente.get('/transcript?video_id=res1')
+    comprimida = cliente.get('/transcript?video_id=res1', headers={'Accept-Encoding': 'gzip'})
+
+    assert 'Content-Encoding' not in normal.headers
+    assert comprimida.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in comprimida.headers['Vary']
+    assert json.loads(gzip.decompress(comprimida.get_data())) == normal.get_json()
+
+
+def test_brotli_preferido_en_empate(cliente):
+    brotli = pytest.importorskip('brotli')
+    respuesta = cliente.get('/transcript?video_id=res2', headers={'Accept-Encoding': 'gzip, br'})
+    assert respuesta.headers['Content-Encoding'] == 'br'
+    assert json.loads(brotli.decompress(respuesta.get_data()))['exito']
+
+
+def test_respuestas_chicas_no_se_comprimen(cliente):
+    respuesta = cliente.get('/transcript', headers={'Accept-Encoding': 'gzip'})
+    assert respuesta.status_code == 400
+    assert 'Content-Encoding' not in respuesta.headers
+
+
+def test_etag_por_formato_y_304(cliente, upstream):
+    texto = cliente.get('/transcript?video_id=res3')
+    srt = cliente.get('/transcript?video_id=res3&format=srt')
+    assert texto.headers['ETag'].startswith('W/') and texto.headers['ETag'] != srt.headers['ETag']
+
+    respuesta = cliente.get('/transcript?video_id=res3', headers={'If-None-Match': texto.headers['ETag']})
+    assert respuesta.status_code == 304
+    assert respuesta.get_data() == b''
+    assert respuesta.headers['ETag'] == texto.headers['ETag']
+    assert upstream.llamadas['/api/timedtext'] == 2
+
+
+def test_etag_cambia_si_cambia_la_transcripcion(cliente, upstream, monkeypatch):
+    antes = cliente.get('/transcript?video_id=res4').headers['ETag']
+    monkeypatch.setattr(app, 'cache_transcripciones', app.crear_cache())
+    upstream.segmentos = 21
+    try:
+        assert cliente.get('/transcript?video_id=res4').headers['ETag'] != antes
+    finally:
+        upstream.segmentos = 20
+
+
+@pytest.mark.parametrize('formato', ['segments', 'srt', 'vtt'])
+def test_stream_da_el_mismo_cuerpo(cliente, formato):
+    completa = cliente.get(f'/transcript?video_id=res5&format={formato}')
+    en_flujo = cliente.get(f'/transcript?video_id=res5&format={formato}&stream=1')
+
+    assert en_flujo.is_streamed
+    assert 'Content-Length' not in en_flujo.headers
+    if formato == 'segments':
+        assert json.loads(en_flujo.get_data()) == completa.get_json()
+    else:
+        assert en_flujo.get_data() == completa.get_data()
+
+
+def test_stream_comprimido(cliente):
+    completa = cliente.get('/transcript?video_id=res6&format=vtt')
+    respuesta = cliente.get('/transcript?video_id=res6&format=vtt&stream=1', headers={'Accept-Encoding': 'gzip'})
+
+    assert respuesta.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(respuesta.get_data()) == completa.get_data()
+
+
+def test_agrupar_texto():
+    partes = ['a' * 40] * 5
+    assert [len(chunk) for chunk in app.agrupar_texto(partes, tamaño=100)] == [120, 80]
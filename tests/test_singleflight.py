@@ -0,0 +1,74 @@
+"""Coalescencia de peticiones concurrentes de la misma clave"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import app
+
+
+def test_una_sola_llamada_por_clave():
+    coalescedor = app.SingleFlight()
+    llamadas = []
+
+    def obtener():
+        llamadas.append(1)
+        time.sleep(0.2)
+        return 'transcripción'
+
+    with ThreadPoolExecutor(20) as ejecutor:
+        resultados = list(ejecutor.map(lambda _: coalescedor.ejecutar('abc', obtener), range(20)))
+
+    assert len(llamadas) == 1
+    assert [r for r, _ in resultados] == ['transcripción'] * 20
+    assert sorted(c for _, c in resultados) == [False] + [True] * 19
+    assert coalescedor.estadisticas == {'ejecutadas': 1, 'compartidas': 19}
+    assert coalescedor.resumen()['en_vuelo'] == 0
+
+
+def test_claves_distintas_no_se_agrupan():
+    coalescedor = app.SingleFlight()
+    with ThreadPoolExecutor(4) as ejecutor:
+        resultados = list(ejecutor.map(lambda c: coalescedor.ejecutar(c, lambda: c), 'abcd'))
+    assert resultados == [(c, False) for c in 'abcd']
+
+
+def test_error_llega_a_todos_y_no_queda_en_cache():
+    coalescedor = app.SingleFlight()
+    arranco = threading.Event()
+    seguir = threading.Event()
+
+    def falla():
+        arranco.set()
+        seguir.wait(5)
+        raise RuntimeError('upstream caído')
+
+    errores = []
+
+    def esperar():
+        try:
+            coalescedor.ejecutar('abc', falla)
+        except RuntimeError as error:
+            errores.append(str(error))
+
+    lider = threading.Thread(target=esperar)
+    lider.start()
+    arranco.wait(5)
+    seguidores = [threading.Thread(target=esperar) for _ in range(5)]
+    for hilo in seguidores:
+        hilo.start()
+    while coalescedor.estadisticas['compartidas'] < 5:
+        time.sleep(0.01)
+    seguir.set()
+    for hilo in [lider] + seguidores:
+        hilo.join(5)
+    assert errores == ['upstream caído'] * 6
+
+    # La siguiente petición vuelve a intentarlo
+    assert coalescedor.ejecutar('abc', lambda: 'ok') == ('ok', False)
+    assert coalescedor.estadisticas['ejecutadas'] == 2
+
+
+def test_entre_workers_con_locks(tmp_path):
+    coalescedor = app.SingleFlight(str(tmp_path))
+    assert coalescedor.ejecutar('abc', lambda: 1) == (1, False)
+    assert list(tmp_path.iterdir()) == []  # el lock se borra al terminar
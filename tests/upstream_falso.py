@@ -0,0 +1,141 @@
+"""YouTube (timedtext y yt-dlp) y RapidAPI falsos en un servidor HTTP local
+
+Cada idioma tiene su propio texto ("Frase 3 en es"), así los tests pueden
+ver qué pista se usó. El comportamiento (idiomas disponibles, latencia,
+bloqueo de Google, status de error) se cambia entre tests y reiniciar()
+lo deja como al principio.
+"""
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def frases(lang, total):
+    return [f'Frase {i} en {lang} con algo de texto para la prueba' for i in range(total)]
+
+
+def _marca(segundos):
+    ms = int(segundos * 1000)
+    return f'{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d}.{ms % 1000:03d}'
+
+
+def documentos(lang, total):
+    """srv1, json3, vtt y la respuesta de RapidAPI con los mismos segmentos (uno cada 2 s)"""
+    textos = frases(lang, total)
+    return {
+        'srv1': '<?xml version="1.0" encoding="utf-8" ?><transcript>' + ''.join(
+            f'<text start="{i * 2}" dur="2">{t}</text>' for i, t in enumerate(textos)) + '</transcript>',
+        'json3': json.dumps({'events': [
+            {'tStartMs': i * 2000, 'dDurationMs': 2000, 'segs': [{'utf8': t}]} for i, t in enumerate(textos)]}),
+        'vtt': 'WEBVTT\n\n' + ''.join(
+            f'{_marca(i * 2)} --> {_marca(i * 2 + 2)}\n{t}\n\n' for i, t in enumerate(textos)),
+        'rapidapi': json.dumps([{'text': t, 'start': i * 2, 'duration': 2} for i, t in enumerate(textos)]),
+    }
+
+
+class Upstream:
+    """Comportamiento configurable del servidor falso y conteo de llamadas por ruta"""
+
+    def __init__(self, segmentos=20):
+        self.segmentos = segmentos
+        self.llamadas = Counter()
+        self._lock = threading.Lock()
+        self.reiniciar()
+
+    def reiniciar(self):
+        self.idiomas = ['es']  # pistas manuales de timedtext
+        self.automaticos = []  # pistas automáticas que solo ve yt-dlp
+        self.latencia = 0.0
+        self.bloquear_timedtext = False
+        self.status = {}  # ruta -> status forzado
+        with self._lock:
+            self.llamadas.clear()
+
+    def contar(self, ruta):
+        with self._lock:
+            self.llamadas[ruta] += 1
+
+
+class ManejadorUpstream(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def responder(self, status, tipo, cuerpo):
+        cuerpo = cuerpo.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def do_GET(self):
+        upstream = self.server.upstream
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        upstream.contar(url.path)
+        if upstream.latencia:
+            time.sleep(upstream.latencia)
+
+        if url.path == '/sorry/index':
+            return self.responder(429, 'text/html', '<html>unusual traffic</html>')
+        if url.path in upstream.status:
+            return self.responder(upstream.status[url.path], 'text/plain', 'error')
+
+        if url.path == '/api/timedtext':
+            if upstream.bloquear_timedtext:
+                self.send_response(302)
+                self.send_header('Location', '/sorry/index')
+                self.send_header('Content-Length', '0')
+                return self.end_headers()
+            if params.get('type') == 'list':
+                return self.responder(200, 'text/xml', '<transcript_list>' + ''.join(
+                    f'<track id="{i}" name="" lang_code="{lang}"/>' for i, lang in enumerate(upstream.idiomas)
+                ) + '</transcript_list>')
+            if params.get('lang') not in upstream.idiomas:
+                return self.responder(404, 'text/plain', '')
+            return self.responder(200, 'text/xml', documentos(params['lang'], upstream.segmentos)['srv1'])
+
+        if url.path == '/rapidapi/transcript':
+            return self.responder(200, 'application/json',
+                                  documentos(params.get('lang', 'es'), upstream.segmentos)['rapidapi'])
+
+        if url.path == '/ytdlp/info':
+            base = f"http://{self.headers['Host']}/pistas/{params.get('v', '')}"
+
+            def pistas(idiomas):
+                return {lang: [{'ext': 'json3', 'url': f'{base}.{lang}.json3', 'name': lang},
+                               {'ext': 'vtt', 'url': f'{base}.{lang}.vtt', 'name': lang}] for lang in idiomas}
+
+            return self.responder(200, 'application/json', json.dumps({
+                'id': params.get('v'),
+                'title': 'Video de prueba',
+                'subtitles': pistas(upstream.idiomas),
+                'automatic_captions': pistas(upstream.automaticos),
+            }))
+
+        if url.path.startswith('/pistas/'):
+            _, lang, ext = url.path.rsplit('.', 2)
+            tipo = 'application/json' if ext == 'json3' else 'text/vtt'
+            return self.responder(200, tipo, documentos(lang, upstream.segmentos)[ext])
+
+        self.responder(404, 'text/plain', 'no encontrado')
+
+
+class Servidor(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass  # clientes que cortan por timeout: es lo que prueban los tests
+
+
+def iniciar(upstream):
+    """Arranca el servidor en un puerto libre; devuelve su URL base"""
+    servidor = Servidor(('127.0.0.1', 0), ManejadorUpstream)
+    servidor.upstream = upstream
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{servidor.server_address[1]}'